@@ -0,0 +1,38 @@
+"""
+Generate thumbnail/medium/WebP variants for every image already under
+static/images, spread across all CPU cores. Images whose variants exist
+are skipped, so the command can be re-run safely.
+
+    python backfill_variants.py [--workers N]
+"""
+import argparse
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from derivatives import generate_variants, source_images
+
+
+def backfill(workers: int) -> dict:
+    images = [str(path) for path in source_images()]
+    stats = {"images": len(images), "variants_created": 0, "failed": 0}
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(generate_variants, image): image for image in images}
+        for future in as_completed(futures):
+            try:
+                stats["variants_created"] += len(future.result())
+            except Exception as e:
+                stats["failed"] += 1
+                print(f"failed: {futures[future]}: {e}")
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="worker processes (default: CPU count)")
+    args = parser.parse_args()
+    for key, value in backfill(args.workers).items():
+        print(f"{key}: {value}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,275 @@
+"""
+Check that no route's SQL falls back to a full table scan or sort.
+
+Seeds a throwaway database, calls every route in-process, captures each
+statement it runs and asks SQLite for its plan (EXPLAIN QUERY PLAN). Any
+`SCAN <table>` that is not in ALLOWED, or temp B-tree sort that is not in
+ALLOWED_SORTS, fails the check. tests/test_query_plans.py runs it with
+the test suite.
+
+    python -m benchmarks.query_plans [--scale tiny] [--verbose]
+"""
+import argparse
+import asyncio
+import io
+import logging
+import os
+import re
+import sqlite3
+import sys
+import tempfile
+import zlib
+from pathlib import Path
+from typing import Dict, List, Tuple
+
+import httpx
+
+logging.getLogger("httpx").setLevel(logging.WARNING)
+
+PASSWORD = "benchmark"
+# A plan line reading a whole table. It still passes when the statement
+# has a LIMIT and needs no sort step: rows then come out in the wanted
+# order and the scan stops after one page (the unfiltered product list
+# walking the primary key)
+TABLE_SCAN = re.compile(r"^SCAN (\w+)$")
+SORT_STEP = "USE TEMP B-TREE FOR"
+LIMIT = re.compile(r"\bLIMIT\b")
+ORDER_BY = re.compile(r"ORDER BY (.+?)(?: LIMIT\b|$)")
+
+# (route, table) -> why scanning it is fine
+ALLOWED: Dict[Tuple[str, str], str] = {
+    ("GET /users/", "user"): "admin listing of every user",
+}
+
+# (route, ORDER BY of the statement, or the plan line) -> why sorting is fine
+ALLOWED_SORTS: Dict[Tuple[str, str], str] = {
+    ("GET /orders/all", '"order".order_date DESC, "order".id DESC'):
+        "re-sorts the one page the keyset subquery read from ix_order_user_date_id",
+    ("GET /products/list", "product.id"):
+        "a price range read from ix_product_category_price_id, sorted by id",
+    ("GET /products/search", "rank, product.id"): "bm25 rank is computed per match; no index can order it",
+    ("GET /products/export", "product.id"):
+        "one batch over several categories (IN), which no single index range returns in id order",
+}
+
+
+def capture(engine, statements: Dict[Tuple[str, str], tuple]):
+    """Record the first parameters each (route, statement) pair ran with."""
+    from sqlalchemy import event
+
+    from metrics import current_request
+
+    @event.listens_for(engine.sync_engine, "before_cursor_execute")
+    def record(conn, cursor, statement, parameters, context, executemany):
+        if executemany or not statement.lstrip().upper().startswith(("SELECT", "UPDATE", "DELETE", "INSERT", "WITH")):
+            return
+        metrics = current_request.get()
+        route = f"{metrics.method} {metrics.route}" if metrics else "background"
+        statements.setdefault((route, statement), parameters)
+
+
+def tiny_png() -> bytes:
+    def chunk(kind: bytes, data: bytes) -> bytes:
+        body = kind + data
+        return len(data).to_bytes(4, "big") + body + zlib.crc32(body).to_bytes(4, "big")
+
+    header = (1).to_bytes(4, "big") * 2 + bytes([8, 2, 0, 0, 0])
+    return (
+        b"\x89PNG\r\n\x1a\n" + chunk(b"IHDR", header)
+        + chunk(b"IDAT", zlib.compress(b"\x00\xff\x00\x00")) + chunk(b"IEND", b"")
+    )
+
+
+async def exercise(client: httpx.AsyncClient) -> List[str]:
+    """Call every route once or twice; returns the calls that failed."""
+    failures = []
+
+    async def call(method: str, url: str, expect=(200,), **kwargs) -> httpx.Response:
+        response = await client.request(method, url, **kwargs)
+        if response.status_code not in expect:
+            failures.append(f"{method} {url}: {response.status_code} {response.text[:200]}")
+        return response
+
+    async def login(username: str) -> Dict[str, str]:
+        response = await call("POST", "/auth/login", data={"username": username, "password": PASSWORD})
+        return {"Authorization": f"Bearer {response.json()['access_token']}"}
+
+    await call("POST", "/auth/register", json={
+        "username": "planner", "email": "planner@example.com", "password": PASSWORD,
+    })
+    admin = await login("admin1")
+    shopper = await login("planner")
+    me = (await call("GET", "/users/me", headers=shopper)).json()
+    await call("GET", "/auth/checktoken", headers=shopper)
+    await call("GET", "/users/", headers=admin)
+    await call("PUT", f"/users/{me['id']}", headers=shopper, json={"email": "planner2@example.com"})
+
+    # Categories
+    categories = (await call("GET", "/categories/", headers=shopper)).json()
+    await call("GET", "/categories/", headers=admin)
+    category = (await call("POST", "/categories/", headers=admin, json={"name": "Plans"})).json()
+    await call("GET", f"/categories/{categories[0]['id']}", headers=shopper)
+    await call("PUT", f"/categories/{category['id']}", headers=admin, json={"name": "Plans 2"})
+
+    # Catalogue
+    first = categories[0]["id"]
+    for params in (
+        {},
+        {"sort": "-price"},
+        {"sort": "name", "category_id": first},
+        {"sort": "-created_at", "is_active": "true", "in_stock": "true"},
+        {"category_id": first, "min_price": 10, "max_price": 200},
+        {"category_id": first, "sort": "price", "is_active": "true", "in_stock": "true"},
+    ):
+        page = (await call("GET", "/products/list", headers=shopper, params=params)).json()
+        if page.get("next_cursor"):
+            await call("GET", "/products/list", headers=shopper, params={**params, "cursor": page["next_cursor"]})
+    for params in ({"q": "lamp"}, {"q": "red ch"}, {"q": "steel", "category_id": first, "in_stock": "true"}):
+        page = (await call("GET", "/products/search", headers=shopper, params=params)).json()
+        if page.get("next_cursor"):
+            await call("GET", "/products/search", headers=shopper, params={**params, "cursor": page["next_cursor"]})
+    products = (await call("GET", f"/products/{first}", headers=shopper)).json()
+    await call("GET", f"/products/details/{products[0]['id']}", headers=shopper)
+
+    # Admin product management
+    created = (await call(
+        "POST", f"/products/{category['id']}", headers=admin,
+        data={"name": "Plan lamp", "description": "Lights plans", "price": "9.5", "stock_quantity": "50"},
+        files={"file": ("lamp.png", tiny_png(), "image/png")},
+    )).json()
+    product_id = created.get("product_id") or created.get("id")
+    await call("PUT", f"/products/update/{product_id}", headers=admin, data={"price": "11", "stock_quantity": "40"})
+    await call("GET", "/products/export", headers=admin)
+    await call("GET", "/products/export", headers=admin, params={"format": "ndjson", "category_id": category["id"]})
+    csv = f"name,description,price,stock_quantity,is_active,category_id\nPlan mug,Mug,3,5,true,{category['id']}\n"
+    await call("POST", "/products/import", headers=admin, files={"file": ("plans.csv", io.BytesIO(csv.encode()), "text/csv")})
+
+    # Cart and checkout
+    stocked = [p["id"] for p in products if p["stock_quantity"] >= 5][:3]
+    for product_id_ in stocked + stocked[:1]:
+        await call("POST", "/cart/add", headers={**shopper, "Idempotency-Key": f"plan-{product_id_}-{len(failures)}"},
+                   json={"product_id": product_id_, "quantity": 1})
+    items = (await call("GET", "/cart/items/", headers=shopper)).json()
+    await call("DELETE", f"/cart/remove/{items[-1]['cart_item_id']}", headers=shopper)
+    await call("POST", "/orders/create", headers={**shopper, "Idempotency-Key": "plan-order"}, json={
+        "items": [{"product_id": stocked[0], "quantity": 2}], "address": "1 Plan Street", "is_paid": True,
+    })
+    orders = (await call("GET", "/orders/all", headers=shopper, params={"limit": 1})).json()
+    await call("GET", "/orders/", headers=shopper, params={"order_id": orders["items"][0]["id"]})
+    # Order history of a seeded shopper with several orders, deep pages included
+    busy = await login("user83")
+    for params in (
+        {"limit": 2},
+        {"limit": 2, "is_paid": "true", "include_products": "true"},
+        {"limit": 2, "since": "2024-01-01T00:00:00", "until": "2030-01-01T00:00:00"},
+    ):
+        page = (await call("GET", "/orders/all", headers=busy, params=params)).json()
+        if page.get("next_cursor"):
+            await call("GET", "/orders/all", headers=busy, params={**params, "cursor": page["next_cursor"]})
+    await call("DELETE", f"/cart/clear/{me['id']}", headers=shopper)
+
+    # Operator views, then the deletes
+    for view in ("cache", "db", "hashing", "derivatives", "outbox", "search", "static"):
+        await call("GET", f"/admin/{view}", headers=admin)
+    await call("DELETE", f"/products/{product_id}", headers=admin)
+    await call("DELETE", f"/categories/{category['id']}", headers=admin)
+    return failures
+
+
+def sort_key(statement: str, plan_line: str) -> str:
+    """What a temp B-tree sorts: the statement's last ORDER BY, or the plan line for GROUP BY/DISTINCT."""
+    orders = ORDER_BY.findall(" ".join(statement.split()))
+    if "FOR ORDER BY" in plan_line and orders:
+        return orders[-1]
+    return plan_line.strip()
+
+
+def check(path: Path, statements: Dict[Tuple[str, str], tuple], verbose: bool) -> List[str]:
+    """EXPLAIN every captured statement; returns the disallowed scans and sorts."""
+    from sqlmodel import SQLModel
+
+    tables = set(SQLModel.metadata.tables)
+    problems = []
+    connection = sqlite3.connect(path)
+    try:
+        for (route, statement), parameters in sorted(statements.items()):
+            plan = [row[3] for row in connection.execute(f"EXPLAIN QUERY PLAN {statement}", parameters)]
+            scans = [m[1] for m in map(TABLE_SCAN.match, plan) if m and m[1] in tables]
+            if LIMIT.search(statement) and not any(SORT_STEP in line for line in plan):
+                scans = []
+            bad = [table for table in scans if (route, table) not in ALLOWED]
+            sorts = [sort_key(statement, line) for line in plan if SORT_STEP in line]
+            bad_sorts = [sort for sort in sorts if (route, sort) not in ALLOWED_SORTS]
+            if verbose or bad or bad_sorts:
+                flag = "SCAN" if bad else "SORT" if bad_sorts else "ok"
+                print(f"[{flag}] {route}: {' '.join(statement.split())[:300]}")
+                for line in plan:
+                    print(f"         {line}")
+            problems += [f"{route}: full scan of {table}" for table in bad]
+            problems += [f"{route}: temp B-tree sort ({sort})" for sort in bad_sorts]
+    finally:
+        connection.close()
+    return problems
+
+
+async def run(path: Path, scale: dict, seed: int):
+    from sqlalchemy import create_engine
+
+    from benchmarks.seed import generate
+    from category_stats import rebuild_all
+    from migrations import upgrade
+    from utils import hash_password
+
+    sync_engine = create_engine(f"sqlite:///{path}")
+    with sync_engine.connect() as connection:
+        upgrade(connection)
+        generate(connection, scale, seed, hash_password(PASSWORD), log=lambda line: None)
+        rebuild_all(connection)
+        connection.commit()
+    sync_engine.dispose()
+
+    import main
+    from database import engine
+
+    statements: Dict[Tuple[str, str], tuple] = {}
+    capture(engine, statements)
+    await main.on_startup()
+    try:
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=main.app), base_url="http://plans") as client:
+            failures = await exercise(client)
+        # Let the outbox and derivative workers run their queries too
+        await asyncio.sleep(1)
+    finally:
+        await main.on_shutdown()
+    return statements, failures
+
+
+def main():
+    from benchmarks.seed import SCALES
+
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--scale", choices=SCALES, default="tiny")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--verbose", action="store_true", help="print every plan, not just the failing ones")
+    args = parser.parse_args()
+
+    # The app reads DATABASE_URL on import; uploads land in the temp dir too
+    workdir = Path(tempfile.mkdtemp(prefix="shop-plans-"))
+    path = workdir / "plans.db"
+    os.environ["DATABASE_URL"] = f"sqlite:///{path}"
+    sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+    os.chdir(workdir)
+
+    statements, failures = asyncio.run(run(path, SCALES[args.scale], args.seed))
+    problems = check(path, statements, args.verbose)
+    routes = {route for route, _ in statements}
+    print(f"Checked {len(statements)} statements from {len(routes)} routes")
+    for failure in failures:
+        print(f"request failed: {failure}")
+    for problem in problems:
+        print(f"disallowed: {problem}")
+    sys.exit(1 if problems or failures else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,281 @@
+"""
+Benchmark the API as it was at given git revisions, for before/after numbers
+on changes older than benchmarks.run (whose API it cannot drive).
+
+Each revision is checked out into a temporary worktree and served by
+uvicorn on a freshly seeded database of its own schema. The scenarios only
+use requests every revision since the baseline understands.
+
+    python -m benchmarks.revisions f50fd58 35f8a56 --scenarios reads --out before_after.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import shutil
+import socket
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+from contextlib import contextmanager
+from datetime import datetime
+from pathlib import Path
+
+import httpx
+
+from benchmarks.run import PASSWORD, Bench, print_report, run_phase
+from benchmarks.seed import description, product_name
+
+ROOT = Path(__file__).resolve().parent.parent
+
+SCENARIOS = ["reads", "logins", "uploads", "large_responses"]
+# Small categories for browsing, plus two large ones for large_responses
+CATEGORIES = 20
+PRODUCTS_PER_CATEGORY = 50
+LARGE_CATEGORIES = (1_000, 10_000)
+SHOPPERS = 1_000
+
+
+# ----------------------------------------------------------
+# Revisions and servers
+# ----------------------------------------------------------
+@contextmanager
+def worktree(revision: str):
+    path = Path(tempfile.mkdtemp(prefix="shop-rev-")) / "tree"
+    subprocess.run(["git", "worktree", "add", "--detach", str(path), revision], cwd=ROOT, check=True,
+                   capture_output=True)
+    try:
+        yield path
+    finally:
+        # Thumbnail workers can outlive the server for a moment and keep
+        # writing into the tree, so delete it until it stays gone
+        for _ in range(10):
+            shutil.rmtree(path.parent, ignore_errors=True)
+            if not path.parent.exists():
+                break
+            time.sleep(1)
+        subprocess.run(["git", "worktree", "prune"], cwd=ROOT, check=True)
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+@contextmanager
+def serve(tree: Path, db: Path, timeout: float = 60):
+    """uvicorn serving `tree`'s app on `db`; yields its base URL."""
+    port = free_port()
+    env = {**os.environ, "DATABASE_URL": f"sqlite:///{db}", "LOG_LEVEL": "WARNING"}
+    # Older revisions echo every SQL statement and print() freely; the
+    # output is dropped, writing it still counts
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--port", str(port), "--log-level", "warning"],
+        cwd=tree, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    url = f"http://127.0.0.1:{port}"
+    deadline = time.monotonic() + timeout
+    try:
+        while True:
+            if server.poll() is not None:
+                raise RuntimeError(f"the server at {tree} exited with {server.returncode}")
+            try:
+                if httpx.get(f"{url}/docs").status_code == 200:
+                    break
+            except httpx.TransportError:
+                pass
+            if time.monotonic() > deadline:
+                raise RuntimeError(f"the server at {tree} did not start")
+            time.sleep(0.2)
+        yield url
+    finally:
+        server.terminate()
+        server.wait()
+
+
+# ----------------------------------------------------------
+# Data
+# ----------------------------------------------------------
+def seed(db: Path, seed_value: int) -> dict:
+    """
+    Fill the tables the app created with plain SQL, which works with every
+    revision's schema; returns the ids the scenarios pick from.
+    """
+    from passlib.context import CryptContext
+
+    rng = random.Random(seed_value)
+    now = datetime(2024, 1, 1).isoformat(sep=" ")
+    # Default cost, so no revision rehashes on login
+    password = CryptContext(schemes=["bcrypt"]).hash(PASSWORD)
+    with sqlite3.connect(db) as connection:
+        user_columns = "username, email, password, is_admin, created_at, last_login_at"
+        connection.execute(f"INSERT INTO user ({user_columns}) VALUES ('admin1', 'admin1@example.com', ?, 1, ?, ?)",
+                           (password, now, now))
+        connection.executemany(
+            f"INSERT INTO user ({user_columns}) VALUES (?, ?, ?, 0, ?, ?)",
+            [(f"user{i}", f"user{i}@example.com", password, now, now) for i in range(1, SHOPPERS + 1)],
+        )
+        admin_id = connection.execute("SELECT id FROM user WHERE username = 'admin1'").fetchone()[0]
+
+        sizes = [PRODUCTS_PER_CATEGORY] * CATEGORIES + list(LARGE_CATEGORIES)
+        categories = []
+        for number, size in enumerate(sizes):
+            category_id = connection.execute(
+                "INSERT INTO productcategory (name, user_id) VALUES (?, ?)", (f"Category {number}", admin_id)
+            ).lastrowid
+            categories.append(category_id)
+            connection.executemany(
+                "INSERT INTO product (name, description, price, stock_quantity, is_active, created_at, "
+                "updated_at, category_id) VALUES (?, ?, ?, ?, 1, ?, ?, ?)",
+                [
+                    (product_name(rng), description(rng), round(rng.uniform(1, 500), 2), 1_000_000, now, now, category_id)
+                    for _ in range(size)
+                ],
+            )
+        products = [row[0] for row in connection.execute(
+            "SELECT id FROM product WHERE category_id IN (%s)" % ",".join("?" * CATEGORIES), categories[:CATEGORIES]
+        )]
+    return {"categories": categories[:CATEGORIES], "large": dict(zip(LARGE_CATEGORIES, categories[CATEGORIES:])),
+            "products": products}
+
+
+# ----------------------------------------------------------
+# Scenarios
+# ----------------------------------------------------------
+class RevisionBench(Bench):
+    """Bench, fed from the seed rather than from endpoints older revisions lack."""
+
+    async def prepare_from(self, data: dict, shoppers: int):
+        self.admin = await self.login("admin1")
+        self.usernames = [f"user{i}" for i in range(1, SHOPPERS + 1)]
+        # One at a time: newer revisions turn away logins past the hashing queue
+        self.shoppers = [await self.login(name) for name in self.usernames[:shoppers]]
+        self.categories = data["categories"]
+        self.admin_category = data["categories"][0]
+        self.products = data["products"]
+        self.large = data["large"]
+
+    async def reads(self, worker: int):
+        headers = self.shoppers[worker % len(self.shoppers)]
+        await self.call(
+            "GET /products/list", "GET", "/products/list",
+            params={"limit": 20, "category_id": self.rng.choice(self.categories)}, headers=headers,
+        )
+        await self.call("GET /products/details/{id}", "GET", f"/products/details/{self.rng.choice(self.products)}",
+                        headers=headers)
+        await self.call("POST /cart/add", "POST", "/cart/add", headers=headers,
+                        json={"product_id": self.rng.choice(self.products), "quantity": 1})
+
+    async def logins(self, worker: int):
+        await self.login_burst(worker)
+
+    def uploads_with_reads(self, size_mb: float):
+        upload = self.uploads(size_mb)
+
+        async def run(worker: int):
+            # Half the workers upload, the others browse meanwhile
+            if worker % 2:
+                await upload(worker)
+            else:
+                await self.call(
+                    "GET /products/list (during uploads)", "GET", "/products/list",
+                    params={"limit": 20, "category_id": self.rng.choice(self.categories)},
+                    headers=self.shoppers[worker % len(self.shoppers)],
+                )
+        return run
+
+    async def large_responses(self, worker: int):
+        for rows, category_id in self.large.items():
+            await self.call(f"GET /products/{{category_id}} ({rows} rows)", "GET", f"/products/{category_id}",
+                            headers=self.admin)
+        await self.call(f"GET /users/ ({SHOPPERS + 1} rows)", "GET", "/users/", headers=self.admin)
+
+
+async def bench_revision(url: str, data: dict, args) -> dict:
+    client = httpx.AsyncClient(
+        base_url=url, timeout=args.timeout,
+        limits=httpx.Limits(max_connections=max(args.concurrency) * 2),
+    )
+    bench = RevisionBench(client, random.Random(args.seed))
+    results = {}
+    try:
+        await bench.prepare_from(data, max(args.concurrency))
+        phases = []
+        for scenario in args.scenarios:
+            if scenario == "uploads":
+                phases += [(f"uploads_{size:g}mb", bench.uploads_with_reads(size)) for size in args.upload_mb]
+            else:
+                phases.append((scenario, getattr(bench, scenario)))
+        for name, iteration in phases:
+            for concurrency in args.concurrency:
+                phase = f"{name}@c{concurrency}"
+                print(f"Running {phase}", file=sys.stderr)
+                results[phase] = await run_phase(bench, iteration, concurrency, args.iterations, args.duration)
+    finally:
+        await client.aclose()
+    return results
+
+
+def run_revision(revision: str, args) -> dict:
+    with worktree(revision) as tree:
+        db = tree / "bench.db"
+        # The app creates its schema at startup; seed it with the server down
+        with serve(tree, db):
+            pass
+        data = seed(db, args.seed)
+        with serve(tree, db) as url:
+            return asyncio.run(bench_revision(url, data, args))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("revisions", nargs="+", help="git revisions, the first is the baseline")
+    parser.add_argument("--scenarios", nargs="+", choices=SCENARIOS, default=SCENARIOS)
+    parser.add_argument("--concurrency", nargs="+", type=int, default=[1, 8, 32])
+    parser.add_argument("--iterations", type=int, default=200, help="iterations per phase")
+    parser.add_argument("--duration", type=float, help="seconds per phase, instead of --iterations")
+    parser.add_argument("--upload-mb", nargs="+", type=float, default=[5])
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--timeout", type=float, default=120)
+    parser.add_argument("--out", help="write the JSON report here")
+    parser.add_argument("--note", action="append", default=[], help="a note for the report (repeatable)")
+    args = parser.parse_args()
+
+    revisions = {}
+    for revision in args.revisions:
+        name = subprocess.run(["git", "rev-parse", "--short", revision], cwd=ROOT, check=True,
+                              capture_output=True, text=True).stdout.strip()
+        print(f"Benchmarking {name}", file=sys.stderr)
+        revisions[name] = run_revision(revision, args)
+
+    baseline = None
+    for name, results in revisions.items():
+        print(f"\n== {name}")
+        report = {"results": results, "extra": {}}
+        print_report(report, baseline)
+        baseline = baseline or report
+
+    if args.out:
+        Path(args.out).write_text(json.dumps({
+            "meta": {
+                "started_at": datetime.now().isoformat(timespec="seconds"),
+                "python": platform.python_version(),
+                "cpus": os.cpu_count(),
+                "seed": args.seed,
+                "iterations": args.iterations,
+                "duration": args.duration,
+                "concurrency": args.concurrency,
+                "scenarios": args.scenarios,
+                "notes": args.note,
+            },
+            "revisions": revisions,
+        }, indent=2) + "\n")
+
+
+if __name__ == "__main__":
+    main()
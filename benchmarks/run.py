@@ -0,0 +1,432 @@
+"""
+Run scripted load scenarios against the API and report latency percentiles,
+throughput and SQL queries per request for every endpoint.
+
+By default the app runs in-process on a database made by benchmarks.seed;
+--url targets a running server instead. Query counts and SQL time come
+from the app's Server-Timing header.
+
+    python -m benchmarks.run bench.db --concurrency 1 8 32 --out run.json
+    python -m benchmarks.run bench.db --baseline base.json --max-regression 0.2
+"""
+import argparse
+import asyncio
+import io
+import json
+import logging
+import os
+import platform
+import random
+import re
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import httpx
+
+# One line per request from httpx would drown the report
+logging.getLogger("httpx").setLevel(logging.WARNING)
+
+SCENARIOS = ["browse", "cart_storm", "checkout", "login_burst", "large_responses", "uploads"]
+CHECKOUT_SIZES = (1, 10, 100)
+SEARCH_TERMS = ["lamp", "steel", "red chair", "wireless head", "organic cot", "vintage", "mug", "port"]
+SORTS = ["id", "-price", "price", "-created_at", "name"]
+PASSWORD = "benchmark"
+# Fraction of login_burst iterations that log in
+LOGIN_SHARE = 0.25
+
+# The "db" entry of the Server-Timing header
+DB_TIMING = re.compile(r'(?:^|,)\s*db;dur=([\d.]+);desc="(\d+) queries"')
+
+
+def percentile(sorted_values: List[float], pct: float) -> float:
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, round(pct / 100 * len(sorted_values) + 0.5) - 1))
+    return sorted_values[index]
+
+
+class Recorder:
+    """Latency, status and query count of every request, per endpoint."""
+
+    def __init__(self):
+        self.samples: Dict[str, List[tuple]] = {}
+
+    def add(self, endpoint: str, seconds: float, status: int, db: Optional[tuple]):
+        self.samples.setdefault(endpoint, []).append((seconds, status, db))
+
+    def summary(self, elapsed: float) -> dict:
+        result = {}
+        for endpoint, samples in sorted(self.samples.items()):
+            latencies = sorted(seconds * 1000 for seconds, _, _ in samples)
+            counted = [db for _, _, db in samples if db is not None]
+            statuses: Dict[str, int] = {}
+            for _, status, _ in samples:
+                statuses[str(status)] = statuses.get(str(status), 0) + 1
+            result[endpoint] = {
+                "count": len(samples),
+                "errors": sum(1 for _, status, _ in samples if status >= 400),
+                "statuses": statuses,
+                "p50_ms": round(percentile(latencies, 50), 3),
+                "p95_ms": round(percentile(latencies, 95), 3),
+                "p99_ms": round(percentile(latencies, 99), 3),
+                "mean_ms": round(sum(latencies) / len(latencies), 3),
+                "max_ms": round(latencies[-1], 3),
+                "throughput_rps": round(len(samples) / elapsed, 2) if elapsed else 0.0,
+                "queries_per_request": round(sum(q for _, q in counted) / len(counted), 2) if counted else None,
+                "db_ms_per_request": round(sum(ms for ms, _ in counted) / len(counted), 3) if counted else None,
+            }
+        return result
+
+
+class Bench:
+    def __init__(self, client: httpx.AsyncClient, rng: random.Random):
+        self.client = client
+        self.rng = rng
+        self.recorder = Recorder()
+        self.admin: Dict[str, str] = {}
+        self.shoppers: List[Dict[str, str]] = []
+        self.usernames: List[str] = []
+        self.products: List[int] = []
+        self.categories: List[int] = []
+        self.large_category: Optional[int] = None
+        self.admin_category: Optional[int] = None
+
+    async def call(self, endpoint: str, method: str, url: str, record: bool = True, **kwargs) -> httpx.Response:
+        started = time.perf_counter()
+        response = await self.client.request(method, url, **kwargs)
+        if record:
+            timing = DB_TIMING.search(response.headers.get("server-timing", ""))
+            self.recorder.add(
+                endpoint, time.perf_counter() - started, response.status_code,
+                (float(timing[1]), int(timing[2])) if timing else None,
+            )
+        return response
+
+    async def login(self, username: str, record: bool = False) -> Dict[str, str]:
+        response = await self.call(
+            "POST /auth/login", "POST", "/auth/login", record=record,
+            data={"username": username, "password": PASSWORD},
+        )
+        response.raise_for_status()
+        return {"Authorization": f"Bearer {response.json()['access_token']}"}
+
+    async def prepare(self, shoppers: int):
+        """Log in, and collect the ids the scenarios pick from."""
+        self.admin = await self.login("admin1")
+        users = (await self.call("", "GET", "/users/", record=False, headers=self.admin)).json()
+        self.usernames = [user["username"] for user in users if not user["is_admin"]]
+        if not self.usernames:
+            sys.exit("The database has no shoppers; create it with benchmarks.seed")
+        self.shoppers = list(await asyncio.gather(
+            *(self.login(name) for name in self.usernames[:shoppers])
+        ))
+
+        categories = (await self.call("", "GET", "/categories/", record=False, headers=self.shoppers[0])).json()
+        self.categories = [category["id"] for category in categories]
+        self.large_category = max(categories, key=lambda category: category["product_count"])["id"]
+        own = (await self.call("", "GET", "/categories/", record=False, headers=self.admin)).json()
+        self.admin_category = own[0]["id"] if own else None
+
+        # Active, well-stocked products for the cart and checkout scenarios
+        cursor = None
+        while len(self.products) < 2000:
+            params = {"limit": 100, "is_active": "true", "in_stock": "true"}
+            if cursor:
+                params["cursor"] = cursor
+            page = (await self.call("", "GET", "/products/list", record=False, params=params, headers=self.shoppers[0])).json()
+            self.products += [item["id"] for item in page["items"] if item["stock_quantity"] >= 20]
+            cursor = page.get("next_cursor")
+            if not cursor:
+                break
+
+    # ------------------------------------------------------
+    # Scenarios: each function is one iteration for one worker
+    # ------------------------------------------------------
+    async def browse(self, worker: int):
+        headers = self.shoppers[worker % len(self.shoppers)]
+        await self.call("GET /categories/", "GET", "/categories/", headers=headers)
+        params = {"limit": 20, "sort": self.rng.choice(SORTS), "category_id": self.rng.choice(self.categories)}
+        page = (await self.call("GET /products/list", "GET", "/products/list", params=params, headers=headers)).json()
+        if page.get("next_cursor"):
+            await self.call(
+                "GET /products/list (next page)", "GET", "/products/list",
+                params={**params, "cursor": page["next_cursor"]}, headers=headers,
+            )
+        await self.call("GET /products/{category_id}", "GET", f"/products/{self.rng.choice(self.categories)}", headers=headers)
+        await self.call("GET /products/details/{id}", "GET", f"/products/details/{self.rng.choice(self.products)}", headers=headers)
+        await self.call(
+            "GET /products/search", "GET", "/products/search",
+            params={"q": self.rng.choice(SEARCH_TERMS), "limit": 20}, headers=headers,
+        )
+
+    async def cart_storm(self, worker: int):
+        # Every worker hammers the same few hot products
+        await self.call(
+            "POST /cart/add", "POST", "/cart/add",
+            headers={**self.shoppers[worker % len(self.shoppers)], "Idempotency-Key": self.key()},
+            json={"product_id": self.rng.choice(self.products[:10]), "quantity": 1},
+        )
+
+    def checkout(self, size: int):
+        async def run(worker: int):
+            headers = self.shoppers[worker % len(self.shoppers)]
+            items = self.rng.sample(self.products, min(size, len(self.products)))
+            for product_id in items:
+                await self.call(
+                    "POST /cart/add (checkout setup)", "POST", "/cart/add",
+                    headers=headers, json={"product_id": product_id, "quantity": 1},
+                )
+            await self.call(
+                f"POST /orders/create ({size} items)", "POST", "/orders/create",
+                headers={**headers, "Idempotency-Key": self.key()},
+                json={
+                    "items": [{"product_id": product_id, "quantity": 1} for product_id in items],
+                    "address": "1 Benchmark Street",
+                    "is_paid": True,
+                },
+            )
+        return run
+
+    async def login_burst(self, worker: int):
+        # Logins mixed into catalogue reads, to see what password hashing
+        # does to catalogue latency
+        if self.rng.random() < LOGIN_SHARE:
+            await self.call(
+                "POST /auth/login", "POST", "/auth/login",
+                data={"username": self.rng.choice(self.usernames), "password": PASSWORD},
+            )
+        else:
+            await self.call(
+                "GET /products/list (during logins)", "GET", "/products/list",
+                params={"limit": 20, "category_id": self.rng.choice(self.categories)},
+                headers=self.shoppers[worker % len(self.shoppers)],
+            )
+
+    async def large_responses(self, worker: int):
+        await self.call("GET /users/ (all)", "GET", "/users/", headers=self.admin)
+        await self.call(
+            "GET /products/{category_id} (largest)", "GET", f"/products/{self.large_category}", headers=self.admin
+        )
+        await self.call("GET /products/list (limit 100)", "GET", "/products/list", params={"limit": 100}, headers=self.admin)
+
+    def uploads(self, size_mb: float):
+        image = noise_png(size_mb)
+
+        async def run(worker: int):
+            # Readers stop at the PNG end chunk; the random tail only keeps
+            # the blob store from deduplicating the uploads
+            data = image + self.rng.randbytes(8)
+            await self.call(
+                f"POST /products/{{category_id}} ({size_mb:g} MB image)", "POST",
+                f"/products/{self.admin_category}",
+                headers=self.admin,
+                data={"name": "Benchmark upload", "price": "9.99", "stock_quantity": "1"},
+                files={"file": ("bench.png", data, "image/png")},
+            )
+        return run
+
+    def key(self) -> str:
+        return f"bench-{self.rng.getrandbits(64):016x}"
+
+    async def wait_for_variants(self, timeout: float = 300) -> dict:
+        """Wait for the thumbnail queue to empty; how long it took and its counters."""
+        started = time.perf_counter()
+        while True:
+            stats = (await self.call("", "GET", "/admin/derivatives", record=False, headers=self.admin)).json()
+            elapsed = time.perf_counter() - started
+            if not stats.get("pending") or elapsed >= timeout:
+                return {**stats, "drain_s": round(elapsed, 3)}
+            await asyncio.sleep(0.1)
+
+
+def noise_png(size_mb: float) -> bytes:
+    """A PNG of random pixels; noise does not compress, so it is about size_mb."""
+    from PIL import Image
+
+    side = max(16, int((size_mb * 1024 * 1024 / 3) ** 0.5))
+    pixels = random.Random(0).randbytes(side * side * 3)
+    buffer = io.BytesIO()
+    Image.frombytes("RGB", (side, side), pixels).save(buffer, "PNG", compress_level=1)
+    return buffer.getvalue()
+
+
+async def run_phase(bench: Bench, iteration, concurrency: int, iterations: int, duration: Optional[float]) -> dict:
+    """Run `iterations` iterations (or for `duration` seconds) over `concurrency` workers."""
+    bench.recorder = Recorder()
+    remaining = [iterations]
+    deadline = time.perf_counter() + duration if duration else None
+
+    async def worker(number: int):
+        while True:
+            if deadline is not None:
+                if time.perf_counter() >= deadline:
+                    return
+            elif remaining[0] <= 0:
+                return
+            remaining[0] -= 1
+            await iteration(number)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker(number) for number in range(concurrency)))
+    return bench.recorder.summary(time.perf_counter() - started)
+
+
+def compare(report: dict, baseline: dict, max_regression: float) -> List[str]:
+    """Endpoints whose p95 or query count got worse than the baseline allows."""
+    regressions = []
+    for phase, endpoints in report["results"].items():
+        for endpoint, stats in endpoints.items():
+            before = baseline.get("results", {}).get(phase, {}).get(endpoint)
+            if not before:
+                continue
+            if before["p95_ms"] and stats["p95_ms"] > before["p95_ms"] * (1 + max_regression):
+                regressions.append(
+                    f"{phase} {endpoint}: p95 {before['p95_ms']:.1f} -> {stats['p95_ms']:.1f} ms"
+                )
+            if (
+                before.get("queries_per_request") is not None
+                and stats.get("queries_per_request") is not None
+                and stats["queries_per_request"] > before["queries_per_request"]
+            ):
+                regressions.append(
+                    f"{phase} {endpoint}: queries {before['queries_per_request']} -> {stats['queries_per_request']}"
+                )
+    return regressions
+
+
+def print_report(report: dict, baseline: Optional[dict]):
+    header = f"{'phase':<22} {'endpoint':<44} {'n':>6} {'err':>4} {'p50':>8} {'p95':>8} {'p99':>8} {'rps':>8} {'q/req':>6}"
+    print(header)
+    print("-" * len(header))
+    for phase, endpoints in report["results"].items():
+        for endpoint, stats in endpoints.items():
+            line = (
+                f"{phase:<22} {endpoint:<44} {stats['count']:>6} {stats['errors']:>4} "
+                f"{stats['p50_ms']:>8.1f} {stats['p95_ms']:>8.1f} {stats['p99_ms']:>8.1f} "
+                f"{stats['throughput_rps']:>8.1f} {stats['queries_per_request'] if stats['queries_per_request'] is not None else '-':>6}"
+            )
+            before = (baseline or {}).get("results", {}).get(phase, {}).get(endpoint)
+            if before and before["p95_ms"]:
+                line += f"  p95 {(stats['p95_ms'] / before['p95_ms'] - 1) * 100:+.0f}%"
+            print(line)
+    for name, value in report["extra"].items():
+        print(f"{name}: {value}")
+
+
+def git_revision() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True,
+            cwd=Path(__file__).resolve().parent,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+async def run(args) -> dict:
+    rng = random.Random(args.seed)
+    app = None
+    if args.url:
+        client = httpx.AsyncClient(base_url=args.url, timeout=args.timeout)
+    else:
+        import main
+
+        app = main.app
+        await main.on_startup()
+        client = httpx.AsyncClient(
+            transport=httpx.ASGITransport(app=app), base_url="http://bench", timeout=args.timeout
+        )
+
+    bench = Bench(client, rng)
+    report = {
+        "meta": {
+            "started_at": datetime.now().isoformat(timespec="seconds"),
+            "target": args.url or str(args.db),
+            "revision": git_revision(),
+            "python": platform.python_version(),
+            "seed": args.seed,
+            "iterations": args.iterations,
+            "duration": args.duration,
+            "concurrency": args.concurrency,
+        },
+        "results": {},
+        "extra": {},
+    }
+    try:
+        await bench.prepare(max(args.concurrency))
+        phases = []
+        for scenario in args.scenarios:
+            if scenario == "checkout":
+                phases += [(f"checkout_{size}", bench.checkout(size)) for size in CHECKOUT_SIZES]
+            elif scenario == "uploads":
+                phases += [(f"uploads_{size:g}mb", bench.uploads(size)) for size in args.upload_mb]
+            else:
+                phases.append((scenario, getattr(bench, scenario)))
+
+        for name, iteration in phases:
+            for concurrency in args.concurrency:
+                phase = f"{name}@c{concurrency}"
+                print(f"Running {phase}", file=sys.stderr)
+                report["results"][phase] = await run_phase(
+                    bench, iteration, concurrency, args.iterations, args.duration
+                )
+            if name.startswith("uploads"):
+                report["extra"][f"{name} variants"] = await bench.wait_for_variants()
+    finally:
+        await client.aclose()
+        if app is not None:
+            import main
+
+            await main.on_shutdown()
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("db", nargs="?", help="database made by benchmarks.seed (in-process mode)")
+    parser.add_argument("--url", help="benchmark a running server instead")
+    parser.add_argument("--scenarios", nargs="+", choices=SCENARIOS, default=SCENARIOS)
+    parser.add_argument("--concurrency", nargs="+", type=int, default=[1, 8, 32])
+    parser.add_argument("--iterations", type=int, default=200, help="iterations per phase")
+    parser.add_argument("--duration", type=float, help="seconds per phase, instead of --iterations")
+    parser.add_argument("--upload-mb", nargs="+", type=float, default=[0.5, 5])
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--timeout", type=float, default=60)
+    parser.add_argument("--out", help="write the JSON report here")
+    parser.add_argument("--baseline", help="JSON report to compare against")
+    parser.add_argument("--max-regression", type=float, default=0.2,
+                        help="allowed p95 slowdown against the baseline (0.2 = 20%%)")
+    args = parser.parse_args()
+
+    if not args.url:
+        if not args.db or not Path(args.db).exists():
+            parser.error("give a database made by benchmarks.seed, or --url")
+        # Point the app at the benchmark database before it is imported, and
+        # keep uploaded blobs out of the working tree
+        args.db = Path(args.db).resolve()
+        args.out = args.out and Path(args.out).resolve()
+        args.baseline = args.baseline and Path(args.baseline).resolve()
+        os.environ["DATABASE_URL"] = f"sqlite:///{args.db}"
+        os.chdir(tempfile.mkdtemp(prefix="shop-bench-"))
+
+    report = asyncio.run(run(args))
+    baseline = json.loads(Path(args.baseline).read_text()) if args.baseline else None
+    print_report(report, baseline)
+    if args.out:
+        Path(args.out).write_text(json.dumps(report, indent=2))
+
+    if baseline:
+        regressions = compare(report, baseline, args.max_regression)
+        for regression in regressions:
+            print(f"REGRESSION {regression}", file=sys.stderr)
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,194 @@
+"""
+Generate a deterministic benchmark database.
+
+The same --seed and scale always produce the same users, categories,
+products, cart items and orders (only password salts differ), so runs on
+different machines or commits are comparable.
+
+    python -m benchmarks.seed bench.db [--scale small] [--products N ...] [--force]
+"""
+import argparse
+import os
+import random
+import sys
+import time
+from datetime import datetime, timedelta
+from pathlib import Path
+
+# Presets: users, admins, categories, products, cart items, orders and the
+# size of one extra oversized category (for large-response benchmarks)
+SCALES = {
+    "tiny": dict(users=100, admins=5, categories=20, products=2_000, cart_items=500, orders=500, large_category=1_000),
+    "small": dict(users=1_000, admins=10, categories=200, products=20_000, cart_items=5_000, orders=5_000, large_category=10_000),
+    "medium": dict(users=10_000, admins=50, categories=1_000, products=200_000, cart_items=50_000, orders=50_000, large_category=10_000),
+    "large": dict(users=50_000, admins=100, categories=10_000, products=1_000_000, cart_items=200_000, orders=200_000, large_category=10_000),
+}
+
+PASSWORD = "benchmark"
+BATCH_SIZE = 5_000
+BASE_TIME = datetime(2024, 1, 1)
+
+ADJECTIVES = [
+    "red", "blue", "green", "black", "white", "vintage", "modern", "compact", "deluxe", "classic",
+    "wireless", "organic", "smart", "portable", "heavy", "light", "premium", "eco", "mini", "ultra",
+]
+MATERIALS = ["cotton", "steel", "wooden", "leather", "ceramic", "glass", "bamboo", "wool", "carbon", "plastic"]
+NOUNS = [
+    "shoe", "lamp", "chair", "kettle", "backpack", "watch", "speaker", "jacket", "mug", "desk",
+    "headphones", "bottle", "blanket", "camera", "keyboard", "notebook", "pan", "scarf", "tent", "bicycle",
+]
+WORDS = ADJECTIVES + MATERIALS + NOUNS + [
+    "for", "with", "and", "everyday", "travel", "home", "office", "outdoor", "kids", "gift",
+]
+
+
+def product_name(rng: random.Random) -> str:
+    return f"{rng.choice(ADJECTIVES).title()} {rng.choice(MATERIALS)} {rng.choice(NOUNS)}"
+
+
+def description(rng: random.Random) -> str:
+    return " ".join(rng.choice(WORDS) for _ in range(rng.randint(6, 20))).capitalize() + "."
+
+
+def generate(connection, scale: dict, seed: int, password_hash: str, log=print) -> dict:
+    """Insert every table's rows in batches; returns row counts."""
+    from sqlmodel import insert
+
+    from models import CartItem, Order, Product, ProductCategory, User
+
+    rng = random.Random(seed)
+
+    def bulk(model, rows):
+        rows = list(rows)
+        for start in range(0, len(rows), BATCH_SIZE):
+            connection.execute(insert(model), rows[start:start + BATCH_SIZE])
+        log(f"  {model.__tablename__}: {len(rows)}")
+        return len(rows)
+
+    counts = {}
+    admins = scale["admins"]
+    counts["users"] = bulk(User, (
+        {
+            "id": i,
+            "username": f"admin{i}" if i <= admins else f"user{i}",
+            "email": f"{'admin' if i <= admins else 'user'}{i}@example.com",
+            "password": password_hash,
+            "is_admin": i <= admins,
+            "created_at": BASE_TIME + timedelta(minutes=i),
+            "last_login_at": BASE_TIME + timedelta(minutes=i),
+        }
+        for i in range(1, scale["users"] + 1)
+    ))
+
+    # The last category is the oversized one
+    category_count = scale["categories"] + 1
+    counts["categories"] = bulk(ProductCategory, (
+        {"id": i, "name": f"{rng.choice(NOUNS).title()}s {i:05d}", "user_id": (i - 1) % admins + 1}
+        for i in range(1, category_count + 1)
+    ))
+
+    # Category sizes are skewed like a real catalogue: a few big ones, a long tail
+    weights = [1 / (rank ** 0.8) for rank in range(1, scale["categories"] + 1)]
+    regular = rng.choices(range(1, scale["categories"] + 1), weights=weights, k=scale["products"])
+    category_ids = regular + [category_count] * scale["large_category"]
+
+    def products():
+        for i, category_id in enumerate(category_ids, 1):
+            created = BASE_TIME + timedelta(seconds=37 * i)
+            yield {
+                "id": i,
+                "name": product_name(rng),
+                "description": description(rng),
+                "price": round(rng.uniform(1, 500), 2),
+                "image_path": None,
+                "stock_quantity": 0 if rng.random() < 0.05 else rng.randint(1, 100),
+                "is_active": rng.random() >= 0.05,
+                "created_at": created,
+                "updated_at": created,
+                "category_id": category_id,
+            }
+
+    counts["products"] = bulk(Product, products())
+    product_count = len(category_ids)
+
+    # Distinct (user, product) pairs; the first `orders` of them are ordered
+    pairs = set()
+    wanted = scale["cart_items"] + scale["orders"]
+    while len(pairs) < wanted:
+        pairs.add((rng.randint(1, scale["users"]), rng.randint(1, product_count)))
+    pairs = sorted(pairs)
+    rng.shuffle(pairs)
+
+    cart_rows, order_rows = [], []
+    for i, (user_id, product_id) in enumerate(pairs, 1):
+        added = BASE_TIME + timedelta(hours=1, seconds=11 * i)
+        in_order = i <= scale["orders"]
+        quantity = rng.randint(1, 3)
+        cart_rows.append({
+            "id": i,
+            "user_id": user_id,
+            "product_id": product_id,
+            "quantity": quantity,
+            "added_at": added,
+            "updated_at": added,
+            "in_order": in_order,
+        })
+        if in_order:
+            order_rows.append({
+                "id": i,
+                "user_id": user_id,
+                "cart_id": i,
+                "total_price": round(quantity * rng.uniform(1, 500), 2),
+                "address": f"{rng.randint(1, 999)} Benchmark Street",
+                "is_paid": rng.random() < 0.7,
+                "order_date": added + timedelta(minutes=5),
+            })
+    counts["cart_items"] = bulk(CartItem, cart_rows)
+    counts["orders"] = bulk(Order, order_rows)
+    return counts
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("db", help="SQLite file to create")
+    parser.add_argument("--scale", choices=SCALES, default="small")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--force", action="store_true", help="overwrite an existing file")
+    for name in SCALES["small"]:
+        parser.add_argument(f"--{name.replace('_', '-')}", type=int, help=f"override the preset's {name}")
+    args = parser.parse_args()
+
+    path = Path(args.db)
+    if path.exists():
+        if not args.force:
+            sys.exit(f"{path} exists; pass --force to overwrite it")
+        for suffix in ("", "-wal", "-shm"):
+            Path(f"{path}{suffix}").unlink(missing_ok=True)
+
+    scale = dict(SCALES[args.scale])
+    for name in scale:
+        if getattr(args, name) is not None:
+            scale[name] = getattr(args, name)
+
+    # The app's modules read DATABASE_URL when imported
+    os.environ["DATABASE_URL"] = f"sqlite:///{path}"
+    from sqlalchemy import create_engine
+
+    from category_stats import rebuild_all
+    from migrations import upgrade
+    from utils import hash_password
+
+    started = time.perf_counter()
+    engine = create_engine(f"sqlite:///{path}")
+    print(f"Seeding {path} ({args.scale}, seed {args.seed})")
+    with engine.connect() as connection:
+        upgrade(connection)
+        generate(connection, scale, args.seed, hash_password(PASSWORD))
+        rebuild_all(connection)
+        connection.commit()
+    engine.dispose()
+    print(f"Done in {time.perf_counter() - started:.1f}s; every user's password is {PASSWORD!r}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+"""
+Measure worker cold start: importing the app, running its startup hooks
+and serving the first request, each in a fresh interpreter.
+
+    python -m benchmarks.startup bench.db [--runs 5] [--out startup.json]
+
+Also times startup on a new, empty database (schema creation included).
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+
+# Runs in the child; prints one JSON line of timings in seconds
+PROBE = """
+import asyncio, json, time
+import httpx
+started = time.perf_counter()
+import main
+imported = time.perf_counter()
+
+async def probe():
+    from utils import create_access_token
+
+    await main.on_startup()
+    ready = time.perf_counter()
+    token = create_access_token({"sub": "1", "username": "probe", "is_admin": False})
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=main.app), base_url="http://probe") as client:
+        response = await client.get("/products/list", headers={"Authorization": f"Bearer {token}"})
+        response.raise_for_status()
+    served = time.perf_counter()
+    await main.on_shutdown()
+    return ready, served
+
+ready, served = asyncio.run(probe())
+print(json.dumps({
+    "import_s": imported - started,
+    "startup_s": ready - imported,
+    "first_request_s": served - ready,
+    "total_s": served - started,
+}))
+"""
+
+
+def probe(database: Path) -> dict:
+    env = {**os.environ, "DATABASE_URL": f"sqlite:///{database}", "LOG_LEVEL": "WARNING"}
+    result = subprocess.run(
+        [sys.executable, "-c", PROBE], cwd=ROOT, env=env, capture_output=True, text=True, check=True,
+    )
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def summarize(samples) -> dict:
+    return {
+        name: {
+            "median_ms": round(statistics.median(s[name] for s in samples) * 1000, 1),
+            "min_ms": round(min(s[name] for s in samples) * 1000, 1),
+            "max_ms": round(max(s[name] for s in samples) * 1000, 1),
+        }
+        for name in samples[0]
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("db", help="database made by benchmarks.seed")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--out", help="write the JSON report here")
+    args = parser.parse_args()
+
+    existing = Path(args.db).resolve()
+    if not existing.exists():
+        parser.error(f"{existing} does not exist")
+    report = {"existing": summarize([probe(existing) for _ in range(args.runs)])}
+
+    fresh = []
+    for _ in range(args.runs):
+        with tempfile.TemporaryDirectory() as scratch:
+            fresh.append(probe(Path(scratch) / "empty.db"))
+    report["fresh"] = summarize(fresh)
+
+    for database, timings in report.items():
+        for name, stats in timings.items():
+            print(f"{database:<9} {name:<16} median {stats['median_ms']:>8.1f} ms  "
+                  f"(min {stats['min_ms']:.1f}, max {stats['max_ms']:.1f})")
+    if args.out:
+        Path(args.out).write_text(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
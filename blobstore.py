@@ -0,0 +1,197 @@
+import hashlib
+import os
+import tempfile
+from contextlib import asynccontextmanager
+from pathlib import Path
+from typing import BinaryIO, Optional
+from uuid import uuid4
+
+from fastapi import HTTPException, UploadFile
+from fastapi.concurrency import run_in_threadpool
+from PIL import Image
+from sqlmodel import func, select
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from derivatives import remove_variants
+from metrics import timed
+from models import Product
+from uploads import (
+    MAX_UPLOAD_BYTES, UPLOAD_CHUNK_SIZE, UPLOAD_DIR, StoredFile, remove_file, safe_filename,
+    stream_to_temp,
+)
+
+# Content-addressed image store: every distinct image is kept once, at
+# static/images/blobs/<first two hex chars>/<sha256><ext>. A blob's
+# reference count is the number of products whose image_path points at it,
+# so it can never drift from the catalog.
+#
+# An upload and the release of the blob's last reference can race: the
+# upload finds the blob, the release counts no references and unlinks it,
+# then the upload commits a row pointing at nothing. So, without any lock
+# (workers may be separate processes):
+# - an upload keeps its temp file, hard-linked to the blob, as a "hold" and
+#   renames it over the blob after its row commits (held);
+# - a release renames the blob aside *before* counting references, and
+#   puts it back if it finds any.
+# Whichever order the steps interleave in, a committed reference ends with
+# the file in place.
+BLOB_DIR = UPLOAD_DIR / "blobs"
+
+
+def blob_path(sha256: str, suffix: str) -> Path:
+    return BLOB_DIR / sha256[:2] / f"{sha256}{suffix.lower()}"
+
+
+def is_blob(path) -> bool:
+    return Path(BLOB_DIR) in Path(path).parents
+
+
+def _place_blob(source: str, final_path: Path) -> None:
+    """Link `source` into the store, unless the blob is already there; `source` stays."""
+    final_path.parent.mkdir(parents=True, exist_ok=True)
+    try:
+        os.link(source, final_path)
+    except FileExistsError:
+        pass
+
+
+def _check_image(path: str) -> None:
+    """Raise ValueError unless `path` holds an image Pillow can read."""
+    try:
+        with Image.open(path) as image:
+            image.verify()
+    except (OSError, SyntaxError, ValueError, Image.DecompressionBombError) as exc:
+        raise ValueError("not an image") from exc
+
+
+def _check_pending(tmp_path: str) -> None:
+    try:
+        _check_image(tmp_path)
+    except ValueError:
+        os.unlink(tmp_path)
+        raise
+
+
+async def store_upload(file: UploadFile, max_bytes: int = MAX_UPLOAD_BYTES) -> StoredFile:
+    """
+    Stream an upload into the store. Identical content is stored only once;
+    anything that is not an image is rejected with 415. Pass the result to
+    held() around the commit of the row that uses it.
+    """
+    with timed("file"):
+        pending = await stream_to_temp(file, BLOB_DIR, max_bytes)
+        try:
+            await run_in_threadpool(_check_pending, pending.tmp_path)
+        except ValueError:
+            raise HTTPException(status_code=415, detail="File is not an image")
+        suffix = Path(safe_filename(file.filename)).suffix
+        final_path = blob_path(pending.sha256, suffix)
+        await run_in_threadpool(_place_blob, pending.tmp_path, final_path)
+    return StoredFile(final_path, pending.size, pending.sha256, pending.tmp_path)
+
+
+def store_file(path: Path) -> Path:
+    """
+    Link an existing file into the store (used by the dedupe migration); the
+    original stays until the caller has pointed its rows at the blob.
+    """
+    digest = hashlib.sha256()
+    with path.open("rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(chunk)
+    final_path = blob_path(digest.hexdigest(), path.suffix)
+    _place_blob(str(path), final_path)
+    return final_path
+
+
+def store_stream(source: BinaryIO, filename: str, max_bytes: int = MAX_UPLOAD_BYTES) -> StoredFile:
+    """
+    Copy a readable binary stream (e.g. an archive member) into the store.
+    Blocking; raises ValueError if it is larger than `max_bytes` or not an
+    image. Held like store_upload's result.
+    """
+    BLOB_DIR.mkdir(parents=True, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=BLOB_DIR, prefix=".upload-", suffix=".part")
+    digest = hashlib.sha256()
+    size = 0
+    try:
+        with os.fdopen(fd, "wb") as out:
+            for chunk in iter(lambda: source.read(UPLOAD_CHUNK_SIZE), b""):
+                size += len(chunk)
+                if size > max_bytes:
+                    raise ValueError(f"larger than {max_bytes} bytes")
+                digest.update(chunk)
+                out.write(chunk)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+    _check_pending(tmp_path)
+    final_path = blob_path(digest.hexdigest(), Path(safe_filename(filename)).suffix)
+    _place_blob(tmp_path, final_path)
+    return StoredFile(final_path, size, digest.hexdigest(), tmp_path)
+
+
+def _drop(stored: StoredFile) -> None:
+    try:
+        os.unlink(stored.hold)
+    except FileNotFoundError:
+        pass
+
+
+def _keep(stored: StoredFile) -> None:
+    # Puts the blob back if a release unlinked it before this commit. When
+    # both names are still links to one file, rename() is a no-op and leaves
+    # the hold behind
+    os.replace(stored.hold, stored.path)
+    _drop(stored)
+
+
+@asynccontextmanager
+async def held(*stored: Optional[StoredFile]):
+    """
+    Wrap the commit of the rows that use `stored`: on success the blobs are
+    made permanent, on error only the holds are dropped.
+    """
+    stored = [item for item in stored if item is not None]
+    try:
+        yield
+    except BaseException:
+        for item in stored:
+            await run_in_threadpool(_drop, item)
+        raise
+    for item in stored:
+        await run_in_threadpool(_keep, item)
+
+
+async def image_ref_count(session: AsyncSession, image_path: str) -> int:
+    return (await session.exec(
+        select(func.count()).select_from(Product).where(Product.image_path == image_path)
+    )).one()
+
+
+def _set_aside(image_path: str) -> Optional[str]:
+    # Hidden, so the variant fallback never redirects to it
+    path = Path(image_path)
+    aside = str(path.with_name(f".{path.name}.{uuid4().hex}.releasing"))
+    try:
+        os.rename(image_path, aside)
+    except FileNotFoundError:
+        return None
+    return aside
+
+
+async def release_images(session: AsyncSession, *image_paths: str) -> None:
+    """
+    Call after committing a change that dropped references to `image_paths`:
+    files nothing points at any more are unlinked.
+    """
+    for image_path in set(filter(None, image_paths)):
+        aside = await run_in_threadpool(_set_aside, image_path)
+        if aside is None:
+            continue
+        if await image_ref_count(session, image_path):
+            # Same content, so replacing a copy an upload put back is harmless
+            await run_in_threadpool(os.replace, aside, image_path)
+        else:
+            await run_in_threadpool(remove_file, aside)
+            await run_in_threadpool(remove_variants, image_path)
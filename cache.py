@@ -0,0 +1,225 @@
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Iterable, Optional
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+CACHE_BACKEND = os.getenv("CACHE_BACKEND", "memory")
+CACHE_MAX_ENTRIES = int(os.getenv("CACHE_MAX_ENTRIES", "10000"))
+CACHE_TTL_SECONDS = float(os.getenv("CACHE_TTL_SECONDS", "60"))
+REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379/0")
+AUTH_CACHE_MAX_ENTRIES = int(os.getenv("AUTH_CACHE_MAX_ENTRIES", "10000"))
+AUTH_CACHE_TTL_SECONDS = float(os.getenv("AUTH_CACHE_TTL_SECONDS", "30"))
+
+_MISSING = object()
+
+
+class CacheStats:
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def as_dict(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "invalidations": self.invalidations,
+            "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+        }
+
+
+class MemoryCache:
+    """Bounded LRU with a per-entry TTL, local to the worker process."""
+
+    def __init__(self, max_entries: int = CACHE_MAX_ENTRIES, ttl: float = CACHE_TTL_SECONDS):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.stats = CacheStats()
+        self._data: "OrderedDict[str, tuple[float, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str, default: Any = None) -> Any:
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                self.stats.misses += 1
+                return default
+            expires_at, value = entry
+            if expires_at < time.monotonic():
+                del self._data[key]
+                self.stats.misses += 1
+                self.stats.evictions += 1
+                return default
+            self._data.move_to_end(key)
+            self.stats.hits += 1
+            return value
+
+    def set(self, key: str, value: Any, ttl: Optional[float] = None) -> None:
+        expires_at = time.monotonic() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            self._data[key] = (expires_at, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+                self.stats.evictions += 1
+
+    def delete(self, *keys: str) -> None:
+        with self._lock:
+            for key in keys:
+                if self._data.pop(key, None) is not None:
+                    self.stats.invalidations += 1
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+
+class RedisCache:
+    """
+    Shared cache on a Redis-compatible server.
+
+    Any client exposing `get`, `set(key, value, ex=...)` and `delete(*keys)`
+    works, so tests can pass an in-process fake instead of a live server.
+    Values are stored as JSON; the TTL and eviction policy are Redis's own.
+    """
+
+    def __init__(self, client=None, ttl: float = CACHE_TTL_SECONDS, prefix: str = "shop:"):
+        if client is None:
+            import redis  # optional dependency, only needed for this backend
+
+            client = redis.Redis.from_url(REDIS_URL)
+        self.client = client
+        self.ttl = ttl
+        self.prefix = prefix
+        self.stats = CacheStats()
+
+    def get(self, key: str, default: Any = None) -> Any:
+        raw = self.client.get(self.prefix + key)
+        if raw is None:
+            self.stats.misses += 1
+            return default
+        self.stats.hits += 1
+        return json.loads(raw)
+
+    def set(self, key: str, value: Any, ttl: Optional[float] = None) -> None:
+        seconds = max(1, int(self.ttl if ttl is None else ttl))
+        self.client.set(self.prefix + key, json.dumps(value), ex=seconds)
+
+    def delete(self, *keys: str) -> None:
+        if keys:
+            self.client.delete(*(self.prefix + key for key in keys))
+            self.stats.invalidations += len(keys)
+
+    def clear(self) -> None:
+        for key in self.client.scan_iter(self.prefix + "*"):
+            self.client.delete(key)
+
+    def __len__(self) -> int:
+        return sum(1 for _ in self.client.scan_iter(self.prefix + "*"))
+
+
+def build_cache():
+    if CACHE_BACKEND == "redis":
+        return RedisCache()
+    return MemoryCache()
+
+
+cache = build_cache()
+
+
+async def cached(key: str, loader: Callable[[], Awaitable[Any]]) -> Any:
+    """
+    Read-through lookup: return the cached value for `key`, or await
+    `loader()`, store its result and return it. Loaders must return
+    JSON-compatible data (e.g. `model_dump(mode="json")`), never live ORM
+    objects. None ("not found") is never stored, so a row created later,
+    through whatever path, is seen at once.
+    """
+    value = cache.get(key, _MISSING)
+    if value is _MISSING:
+        value = await loader()
+        if value is not None:
+            cache.set(key, value)
+    return value
+
+
+def cache_stats() -> dict:
+    return {
+        "backend": type(cache).__name__,
+        "entries": len(cache),
+        **cache.stats.as_dict(),
+    }
+
+
+# ----------------------------------------------------------
+# Catalog keys
+# ----------------------------------------------------------
+# Admins only ever see their own categories, everyone else sees the shared
+# public view, so list entries are keyed by the owning admin or "public".
+def viewer_key(user) -> str:
+    return str(user.id) if user.is_admin else "public"
+
+
+def product_key(product_id: int) -> str:
+    return f"product:{product_id}"
+
+
+def category_key(category_id: int) -> str:
+    return f"category:{category_id}"
+
+
+def category_products_key(category_id: int, viewer: str) -> str:
+    return f"category:{category_id}:products:{viewer}"
+
+
+def categories_key(viewer: str) -> str:
+    return f"categories:{viewer}"
+
+
+def invalidate_products(*product_ids: int) -> None:
+    cache.delete(*(product_key(pid) for pid in product_ids))
+
+
+def invalidate_category(category_id: int, owner_ids: Iterable[Optional[int]]) -> None:
+    """Drop the product lists of a category and every category list it appears in."""
+    keys = [
+        category_key(category_id),
+        category_products_key(category_id, "public"),
+        categories_key("public"),
+    ]
+    for owner_id in set(owner_ids):
+        if owner_id is not None:
+            keys.append(category_products_key(category_id, str(owner_id)))
+            keys.append(categories_key(str(owner_id)))
+    cache.delete(*keys)
+
+
+# ----------------------------------------------------------
+# Authenticated principals
+# ----------------------------------------------------------
+# Always in-process: entries are tiny and short-lived, and a per-user
+# version number lets us drop all of a user's tokens at once without
+# scanning. Other workers see a change once their entry's TTL runs out.
+principal_cache = MemoryCache(AUTH_CACHE_MAX_ENTRIES, AUTH_CACHE_TTL_SECONDS)
+_principal_versions: Dict[int, int] = {}
+
+
+def principal_key(user_id: int, token_id: str) -> str:
+    return f"principal:{user_id}:{_principal_versions.get(user_id, 0)}:{token_id}"
+
+
+def invalidate_principal(user_id: int) -> None:
+    _principal_versions[user_id] = _principal_versions.get(user_id, 0) + 1
+    principal_cache.stats.invalidations += 1
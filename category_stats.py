@@ -0,0 +1,142 @@
+from collections import Counter, defaultdict
+from typing import Dict, Iterable, NamedTuple, Optional
+
+from sqlalchemy import case
+from sqlalchemy.dialects.postgresql import insert as postgresql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlmodel import delete, func, insert, select, update
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from models import CategoryStats, Product
+
+
+def _aggregates():
+    """SELECT computing every CategoryStats column from the product table."""
+    active = Product.is_active == True
+    return (
+        select(
+            Product.category_id,
+            func.count(),
+            func.coalesce(func.sum(case((active, 1), else_=0)), 0),
+            func.coalesce(func.sum(case((active & (Product.stock_quantity > 0), 1), else_=0)), 0),
+            func.min(case((active, Product.price))),
+            func.max(case((active, Product.price))),
+        )
+        .group_by(Product.category_id)
+    )
+
+
+def _insert_from(query):
+    return insert(CategoryStats).from_select(
+        [
+            CategoryStats.category_id,
+            CategoryStats.product_count,
+            CategoryStats.active_count,
+            CategoryStats.in_stock_count,
+            CategoryStats.min_price,
+            CategoryStats.max_price,
+        ],
+        query,
+    )
+
+
+class Counted(NamedTuple):
+    """What one product contributes to its category's aggregates."""
+    category_id: int
+    is_active: bool
+    in_stock: bool
+    price: float
+
+
+def counted(product) -> Counted:
+    """The contribution of a Product, or of a row with the same columns."""
+    return Counted(product.category_id, bool(product.is_active), product.stock_quantity > 0, product.price)
+
+
+async def update_categories(
+    session: AsyncSession, removed: Iterable[Counted] = (), added: Iterable[Counted] = ()
+) -> None:
+    """
+    Apply products leaving (`removed`) and joining (`added`) their
+    categories' aggregates, inside the caller's transaction; a changed
+    product is both, before and after. Counts move by the difference and a
+    new price can only widen the range, so this never reads the categories'
+    products, except for one index seek per range edge whose product went
+    away. Call after the product writes are flushed.
+    """
+    deltas: Dict[int, list] = defaultdict(lambda: [0, 0, 0])
+    prices = {1: defaultdict(Counter), -1: defaultdict(Counter)}
+    for sign, products in ((-1, removed), (1, added)):
+        for product in products:
+            delta = deltas[product.category_id]
+            delta[0] += sign
+            if product.is_active:
+                delta[1] += sign
+                delta[2] += sign * product.in_stock
+                prices[sign][product.category_id][product.price] += 1
+    if not deltas:
+        return
+
+    await session.flush()
+    for category_id, (products, active, in_stock) in deltas.items():
+        gained = prices[1][category_id] - prices[-1][category_id]
+        lost = prices[-1][category_id] - prices[1][category_id]
+        if products or active or in_stock or gained:
+            await _add(session, category_id, products, active, in_stock, min(gained, default=None), max(gained, default=None))
+        if lost:
+            await _reprice(session, category_id, min(lost), max(lost))
+
+
+async def _add(session: AsyncSession, category_id: int, products: int, active: int, in_stock: int,
+               low: Optional[float], high: Optional[float]) -> None:
+    # Upsert: a category gets its row with its first product
+    insert = postgresql_insert if session.bind.dialect.name == "postgresql" else sqlite_insert
+    statement = insert(CategoryStats).values(
+        category_id=category_id, product_count=products, active_count=active,
+        in_stock_count=in_stock, min_price=low, max_price=high,
+    )
+    new = statement.excluded
+    await session.exec(statement.on_conflict_do_update(
+        index_elements=[CategoryStats.category_id],
+        set_={
+            "product_count": CategoryStats.product_count + new.product_count,
+            "active_count": CategoryStats.active_count + new.active_count,
+            "in_stock_count": CategoryStats.in_stock_count + new.in_stock_count,
+            "min_price": case(
+                (CategoryStats.min_price.is_(None), new.min_price),
+                (new.min_price < CategoryStats.min_price, new.min_price),
+                else_=CategoryStats.min_price,
+            ),
+            "max_price": case(
+                (CategoryStats.max_price.is_(None), new.max_price),
+                (new.max_price > CategoryStats.max_price, new.max_price),
+                else_=CategoryStats.max_price,
+            ),
+        },
+    ))
+
+
+async def _reprice(session: AsyncSession, category_id: int, low: float, high: float) -> None:
+    # Prices between low and high left; only an edge they were on moves.
+    # Each lookup walks (category_id, price, id) from one end.
+    active = (Product.category_id == category_id) & (Product.is_active == True)
+    lowest = select(Product.price).where(active).order_by(Product.price).limit(1).scalar_subquery()
+    highest = select(Product.price).where(active).order_by(Product.price.desc()).limit(1).scalar_subquery()
+    await session.exec(
+        update(CategoryStats)
+        .where(
+            CategoryStats.category_id == category_id,
+            (CategoryStats.min_price >= low) | (CategoryStats.max_price <= high),
+        )
+        .values(
+            min_price=case((CategoryStats.min_price >= low, lowest), else_=CategoryStats.min_price),
+            max_price=case((CategoryStats.max_price <= high, highest), else_=CategoryStats.max_price),
+        )
+    )
+
+
+def rebuild_all(connection) -> int:
+    """Recompute every category from scratch (sync, for run_sync)."""
+    connection.execute(delete(CategoryStats))
+    connection.execute(_insert_from(_aggregates()))
+    return connection.execute(select(func.count()).select_from(CategoryStats)).scalar()
@@ -1,14 +1,143 @@
-from sqlmodel import SQLModel, create_engine, Session
+import threading
+import time
+
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+from sqlmodel.ext.asyncio.session import AsyncSession
 from dotenv import load_dotenv
 import os
 
+import migrations
+from settings import settings
+
 load_dotenv()
-DATABASE_URL = os.getenv("DATABASE_URL")
-engine = create_engine(DATABASE_URL, echo=True)
+DATABASE_URL = settings.database_url
+
+# Connection pool
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "10"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "20"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "true").lower() in ("1", "true", "yes")
+
+# SQLite connection pragmas
+SQLITE_BUSY_TIMEOUT_MS = int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "5000"))
+SQLITE_MMAP_SIZE = int(os.getenv("SQLITE_MMAP_SIZE", str(256 * 1024 * 1024)))
+SQLITE_CACHE_SIZE_KB = int(os.getenv("SQLITE_CACHE_SIZE_KB", str(64 * 1024)))
+
+# Plain driver-less URLs from .env are mapped to their async drivers:
+# sqlite:// -> aiosqlite, postgresql:// -> asyncpg.
+ASYNC_DRIVERS = {
+    "sqlite": "sqlite+aiosqlite",
+    "postgresql": "postgresql+asyncpg",
+    "postgres": "postgresql+asyncpg",
+}
+
+
+def async_database_url(url: str) -> str:
+    scheme, sep, rest = url.partition("://")
+    return ASYNC_DRIVERS.get(scheme, scheme) + sep + rest
+
+
+class PoolStats:
+    """How long requests wait to check a connection out of the pool."""
+
+    def __init__(self):
+        self.checkouts = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+        self._lock = threading.Lock()
+
+    def record(self, wait: float):
+        with self._lock:
+            self.checkouts += 1
+            self.total_wait += wait
+            self.max_wait = max(self.max_wait, wait)
+
+    def as_dict(self) -> dict:
+        return {
+            "checkouts": self.checkouts,
+            "total_wait_ms": round(self.total_wait * 1000, 3),
+            "avg_wait_ms": round(self.total_wait * 1000 / self.checkouts, 3) if self.checkouts else 0.0,
+            "max_wait_ms": round(self.max_wait * 1000, 3),
+        }
+
+
+pool_stats = PoolStats()
 
-def get_session():
-    with Session(engine) as session:
+
+class TimedQueuePool(AsyncAdaptedQueuePool):
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            pool_stats.record(time.perf_counter() - start)
+
+
+def _set_sqlite_pragmas(dbapi_connection, connection_record):
+    # WAL lets readers run alongside the single writer, and busy_timeout
+    # makes writers wait for the lock instead of failing with
+    # "database is locked".
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute("PRAGMA synchronous=NORMAL")
+    cursor.execute(f"PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT_MS}")
+    cursor.execute(f"PRAGMA mmap_size={SQLITE_MMAP_SIZE}")
+    cursor.execute(f"PRAGMA cache_size=-{SQLITE_CACHE_SIZE_KB}")
+    cursor.execute("PRAGMA temp_store=MEMORY")
+    cursor.close()
+
+
+def build_engine(url: str, **kwargs):
+    url = async_database_url(url)
+    is_sqlite = url.startswith("sqlite")
+    if not (is_sqlite and ":memory:" in url):
+        kwargs.setdefault("poolclass", TimedQueuePool)
+        kwargs.setdefault("pool_size", DB_POOL_SIZE)
+        kwargs.setdefault("max_overflow", DB_MAX_OVERFLOW)
+        kwargs.setdefault("pool_timeout", DB_POOL_TIMEOUT)
+        kwargs.setdefault("pool_recycle", DB_POOL_RECYCLE)
+        kwargs.setdefault("pool_pre_ping", DB_POOL_PRE_PING)
+
+    new_engine = create_async_engine(url, **kwargs)
+    if is_sqlite:
+        event.listen(new_engine.sync_engine, "connect", _set_sqlite_pragmas)
+    return new_engine
+
+
+# SQL statements are logged through the "sqlalchemy.engine" logger, which
+# logging_config only enables when DEBUG_SQL is set.
+engine = build_engine(DATABASE_URL)
+
+# Objects stay usable after commit: with an async session an expired
+# attribute cannot be lazily reloaded, it raises instead.
+async_session = async_sessionmaker(engine, class_=AsyncSession, expire_on_commit=False)
+
+
+def pool_status() -> dict:
+    pool = engine.pool
+    status = {"pool": type(pool).__name__, **pool_stats.as_dict()}
+    if isinstance(pool, AsyncAdaptedQueuePool):
+        status.update(
+            size=pool.size(),
+            checked_out=pool.checkedout(),
+            overflow=pool.overflow(),
+            idle=pool.checkedin(),
+        )
+    return status
+
+
+async def get_session():
+    async with async_session() as session:
         yield session
 
-def init_db():
-    SQLModel.metadata.create_all(engine)
+
+async def init_db(apply_migrations: bool = settings.auto_migrate):
+    """
+    Bring the schema up to date, or (with AUTO_MIGRATE off) only check
+    that it is: one query when nothing is pending.
+    """
+    async with engine.connect() as connection:
+        await connection.run_sync(migrations.upgrade if apply_migrations else migrations.verify)
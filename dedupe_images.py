@@ -0,0 +1,81 @@
+"""
+Move the existing static/images tree into the content-addressed blob store.
+
+Every file referenced by a product is hashed and linked into
+static/images/blobs/..., byte-identical files collapse into one blob, and
+Product.image_path is rewritten to point at it. The originals are removed
+only once that rewrite has committed, so an interrupted run leaves every
+row pointing at a file. Files no product references are reported and left
+alone.
+
+    python dedupe_images.py [--dry-run]
+"""
+import argparse
+import asyncio
+from collections import defaultdict
+from pathlib import Path
+
+from sqlmodel import select, update
+
+from blobstore import BLOB_DIR, is_blob, store_file
+from database import async_session, init_db
+from models import Product
+from uploads import UPLOAD_DIR, remove_file
+
+
+async def dedupe(dry_run: bool = False) -> dict:
+    await init_db()
+    async with async_session() as session:
+        rows = (await session.exec(
+            select(Product.image_path).where(Product.image_path.is_not(None)).distinct()
+        )).all()
+
+    referenced = {path for path in rows if not is_blob(path)}
+    files = [p for p in UPLOAD_DIR.rglob("*") if p.is_file() and not is_blob(p)]
+    stats = defaultdict(int)
+    stats["files"] = len(files)
+
+    moves = {}
+    for path in files:
+        if str(path) not in referenced:
+            stats["unreferenced"] += 1
+            continue
+        if dry_run:
+            stats["would_move"] += 1
+            continue
+        blob = store_file(path)
+        moves[str(path)] = str(blob)
+
+    stats["missing"] = len(referenced - {str(p) for p in files})
+    if dry_run:
+        return dict(stats)
+
+    async with async_session() as session:
+        for old_path, new_path in moves.items():
+            await session.exec(
+                update(Product).where(Product.image_path == old_path).values(image_path=new_path)
+            )
+        await session.commit()
+
+    for old_path in moves:
+        remove_file(old_path)
+    stats["moved"] = len(moves)
+    stats["blobs"] = len(set(moves.values()))
+
+    # Remove directories the move left empty
+    for directory in sorted((p for p in UPLOAD_DIR.rglob("*") if p.is_dir()), reverse=True):
+        if directory != BLOB_DIR and not is_blob(directory) and not any(directory.iterdir()):
+            directory.rmdir()
+    return dict(stats)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--dry-run", action="store_true", help="report what would change without touching anything")
+    args = parser.parse_args()
+    for key, value in asyncio.run(dedupe(args.dry_run)).items():
+        print(f"{key}: {value}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,160 @@
+import glob
+import logging
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional
+
+from dotenv import load_dotenv
+
+from uploads import UPLOAD_DIR
+
+load_dotenv()
+
+# Resized/re-encoded copies of product images, generated off the request
+# path. name -> (longest side in px, Pillow format, file extension)
+VARIANTS = {
+    "thumb": (256, "JPEG", ".jpg"),
+    "medium": (1024, "JPEG", ".jpg"),
+    "webp": (1024, "WEBP", ".webp"),
+}
+VARIANT_DIR = UPLOAD_DIR / "variants"
+VARIANT_QUALITY = int(os.getenv("VARIANT_QUALITY", "82"))
+DERIVATIVE_WORKERS = int(os.getenv("DERIVATIVE_WORKERS", "2"))
+
+logger = logging.getLogger(__name__)
+
+
+def variant_path(image_path: str, name: str) -> Path:
+    """static/images/<rest>.<ext> -> static/images/variants/<rest>_<name><variant ext>"""
+    source = Path(image_path)
+    try:
+        relative = source.relative_to(UPLOAD_DIR)
+    except ValueError:
+        relative = Path(source.name)
+    ext = VARIANTS[name][2]
+    return VARIANT_DIR / relative.parent / f"{relative.stem}_{name}{ext}"
+
+
+def variant_urls(image_path: Optional[str]) -> Dict[str, str]:
+    """
+    Paths of an image's variants, in the same form as `image_path`. Built
+    from the name alone, as this runs for every product row serialized; the
+    static mount redirects a variant that is not there yet to the original.
+    """
+    if not image_path:
+        return {}
+    return {name: str(variant_path(image_path, name)) for name in VARIANTS}
+
+
+def original_image(path: Path) -> Optional[Path]:
+    """The stored image that variant `path` is made from, if it is a variant and that exists."""
+    try:
+        relative = path.relative_to(VARIANT_DIR)
+    except ValueError:
+        return None
+    stem, _, name = relative.stem.rpartition("_")
+    if not stem or name not in VARIANTS or relative.suffix != VARIANTS[name][2]:
+        return None
+    for candidate in sorted((UPLOAD_DIR / relative.parent).glob(f"{glob.escape(stem)}.*")):
+        if candidate.is_file():
+            return candidate
+    return None
+
+
+def generate_variants(image_path: str) -> List[str]:
+    """Create any missing variants of one image. Runs in a worker process."""
+    from PIL import Image, ImageOps
+
+    created = []
+    with Image.open(image_path) as original:
+        image = ImageOps.exif_transpose(original)
+        for name, (size, image_format, _) in VARIANTS.items():
+            dest = variant_path(image_path, name)
+            if dest.exists():
+                continue
+            variant = image.copy()
+            variant.thumbnail((size, size))
+            if image_format == "JPEG" and variant.mode not in ("RGB", "L"):
+                variant = variant.convert("RGB")
+            dest.parent.mkdir(parents=True, exist_ok=True)
+            tmp = dest.with_name(f".{dest.name}.part")
+            variant.save(tmp, image_format, quality=VARIANT_QUALITY, optimize=True)
+            os.replace(tmp, dest)
+            created.append(str(dest))
+    return created
+
+
+def remove_variants(image_path: str) -> None:
+    for name in VARIANTS:
+        try:
+            variant_path(image_path, name).unlink()
+        except FileNotFoundError:
+            pass
+
+
+class DerivativeQueue:
+    """
+    Background queue of variant jobs on a small process pool. Submitting is
+    fire-and-forget; an image already queued is not queued twice. Jobs
+    finish on the executor's callback thread, hence the lock.
+    """
+
+    def __init__(self, workers: int = DERIVATIVE_WORKERS):
+        self.workers = workers
+        self.pending = set()
+        self.completed = 0
+        self.failed = 0
+        self._executor = None
+        self._lock = threading.Lock()
+
+    def submit(self, *image_paths: str) -> None:
+        for image_path in filter(None, image_paths):
+            with self._lock:
+                if image_path in self.pending:
+                    continue
+                if self._executor is None:
+                    self._executor = ProcessPoolExecutor(max_workers=self.workers)
+                self.pending.add(image_path)
+                executor = self._executor
+            future = executor.submit(generate_variants, image_path)
+            future.add_done_callback(lambda f, path=image_path: self._done(path, f))
+
+    def _done(self, image_path: str, future) -> None:
+        error = None if future.cancelled() else future.exception()
+        with self._lock:
+            self.pending.discard(image_path)
+            if future.cancelled():
+                return
+            if error is not None:
+                self.failed += 1
+            else:
+                self.completed += 1
+        if error is not None:
+            logger.warning("Generating variants of %s failed: %s", image_path, error)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "workers": self.workers,
+                "pending": len(self.pending),
+                "completed": self.completed,
+                "failed": self.failed,
+            }
+
+    def shutdown(self) -> None:
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+
+derivative_queue = DerivativeQueue()
+
+
+def source_images(root: Path = UPLOAD_DIR) -> Iterable[Path]:
+    """Every original image under static/images (variants excluded)."""
+    for path in root.rglob("*"):
+        if path.is_file() and not path.name.startswith(".") and VARIANT_DIR not in path.parents:
+            yield path
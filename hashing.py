@@ -0,0 +1,81 @@
+import asyncio
+import os
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from dotenv import load_dotenv
+from fastapi import HTTPException
+
+from metrics import timed
+from utils import hash_password, verify_and_update_password
+
+load_dotenv()
+
+# bcrypt runs on its own small pool so a burst of logins cannot occupy the
+# threadpool that serves every other request. "thread" is enough because
+# bcrypt releases the GIL; "process" isolates it further.
+PASSWORD_HASH_POOL = os.getenv("PASSWORD_HASH_POOL", "thread")
+PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", str(max(1, (os.cpu_count() or 2) // 2))))
+# Hash jobs allowed to run or wait at once; beyond this requests get a 503.
+PASSWORD_HASH_MAX_PENDING = int(os.getenv("PASSWORD_HASH_MAX_PENDING", str(PASSWORD_HASH_WORKERS * 16)))
+
+
+class PasswordHasher:
+    def __init__(
+        self,
+        workers: int = PASSWORD_HASH_WORKERS,
+        max_pending: int = PASSWORD_HASH_MAX_PENDING,
+        pool: str = PASSWORD_HASH_POOL,
+    ):
+        self.workers = workers
+        self.max_pending = max_pending
+        self.pool = pool
+        self.pending = 0
+        self.rejected = 0
+        self._executor = None
+
+    def _get_executor(self):
+        if self._executor is None:
+            executor_class = ProcessPoolExecutor if self.pool == "process" else ThreadPoolExecutor
+            self._executor = executor_class(max_workers=self.workers)
+        return self._executor
+
+    async def _run(self, fn, *args):
+        # Admission control: everything runs on the event loop thread, so a
+        # plain counter is enough to bound the queue.
+        if self.pending >= self.max_pending:
+            self.rejected += 1
+            raise HTTPException(
+                status_code=503,
+                detail="Too many concurrent login requests, please retry.",
+                headers={"Retry-After": "1"},
+            )
+        self.pending += 1
+        try:
+            loop = asyncio.get_running_loop()
+            with timed("hash"):
+                return await loop.run_in_executor(self._get_executor(), fn, *args)
+        finally:
+            self.pending -= 1
+
+    async def hash(self, password: str) -> str:
+        return await self._run(hash_password, password)
+
+    async def verify_and_update(self, password: str, hashed: str):
+        return await self._run(verify_and_update_password, password, hashed)
+
+    def stats(self) -> dict:
+        return {
+            "pool": self.pool,
+            "workers": self.workers,
+            "max_pending": self.max_pending,
+            "pending": self.pending,
+            "rejected": self.rejected,
+        }
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+
+password_hasher = PasswordHasher()
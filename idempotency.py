@@ -0,0 +1,197 @@
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import time
+from contextlib import asynccontextmanager
+from datetime import datetime, timedelta
+from typing import Any, Optional
+
+from dotenv import load_dotenv
+from fastapi import HTTPException
+from sqlalchemy.exc import IntegrityError
+from sqlmodel import and_, delete, or_, select, update
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from models import IdempotencyRecord
+from serialization import ORJSONResponse
+
+load_dotenv()
+
+IDEMPOTENCY_HEADER = "Idempotency-Key"
+# How long a completed response is replayed for
+IDEMPOTENCY_TTL_HOURS = float(os.getenv("IDEMPOTENCY_TTL_HOURS", "24"))
+# An execution that has not finished after this long is considered dead and
+# another request with the same key may take over
+IDEMPOTENCY_LOCK_SECONDS = float(os.getenv("IDEMPOTENCY_LOCK_SECONDS", "60"))
+# How long a concurrent duplicate waits for the first request to finish
+IDEMPOTENCY_WAIT_SECONDS = float(os.getenv("IDEMPOTENCY_WAIT_SECONDS", "10"))
+IDEMPOTENCY_POLL_SECONDS = float(os.getenv("IDEMPOTENCY_POLL_SECONDS", "0.05"))
+IDEMPOTENCY_SWEEP_SECONDS = float(os.getenv("IDEMPOTENCY_SWEEP_SECONDS", "600"))
+
+logger = logging.getLogger(__name__)
+
+
+def fingerprint(body: Any) -> str:
+    """sha256 of a raw body, or of the canonical JSON form of a parsed one."""
+    if not isinstance(body, bytes):
+        body = json.dumps(body, sort_keys=True, separators=(",", ":"), default=str).encode()
+    return hashlib.sha256(body).hexdigest()
+
+
+class Idempotency:
+    """
+    The state of one keyed request. Either `replay` is set (send it and do
+    nothing else), or this request owns the key and must call `complete`
+    in the same transaction as its writes.
+    """
+
+    def __init__(self, record_id: Optional[int] = None, replay: Optional[ORJSONResponse] = None):
+        self.record_id = record_id
+        self.replay = replay
+        self.completed = False
+
+    async def complete(self, session: AsyncSession, body: Any, status_code: int = 200) -> None:
+        if self.record_id is None:
+            return
+        now = datetime.now()
+        result = await session.exec(
+            update(IdempotencyRecord)
+            .where(IdempotencyRecord.id == self.record_id, IdempotencyRecord.status == "in_progress")
+            .values(
+                status="completed",
+                status_code=status_code,
+                response=body,
+                expires_at=now + timedelta(hours=IDEMPOTENCY_TTL_HOURS),
+            )
+        )
+        if result.rowcount != 1:
+            # Our lock ran out and another request took the key over; its
+            # execution wins, so this transaction must not commit
+            raise HTTPException(status_code=409, detail="Idempotency-Key was taken over by a retry")
+        self.completed = True
+
+
+def _replay(record: IdempotencyRecord) -> ORJSONResponse:
+    return ORJSONResponse(
+        record.response,
+        status_code=record.status_code or 200,
+        headers={"Idempotent-Replayed": "true"},
+    )
+
+
+async def _claim(session_factory, user_id: int, endpoint: str, key: str, digest: str) -> Idempotency:
+    match = (
+        IdempotencyRecord.user_id == user_id,
+        IdempotencyRecord.endpoint == endpoint,
+        IdempotencyRecord.key == key,
+    )
+    deadline = time.monotonic() + IDEMPOTENCY_WAIT_SECONDS
+    while True:
+        now = datetime.now()
+        async with session_factory() as session:
+            # Expired outcomes and abandoned executions no longer hold the key
+            await session.exec(
+                delete(IdempotencyRecord).where(
+                    *match,
+                    or_(
+                        IdempotencyRecord.expires_at < now,
+                        and_(IdempotencyRecord.status == "in_progress", IdempotencyRecord.locked_until < now),
+                    ),
+                )
+            )
+            record = IdempotencyRecord(
+                user_id=user_id,
+                endpoint=endpoint,
+                key=key,
+                fingerprint=digest,
+                locked_until=now + timedelta(seconds=IDEMPOTENCY_LOCK_SECONDS),
+                expires_at=now + timedelta(hours=IDEMPOTENCY_TTL_HOURS),
+            )
+            session.add(record)
+            try:
+                # The unique (user, endpoint, key) constraint lets exactly
+                # one request through, across every worker
+                await session.commit()
+                return Idempotency(record.id)
+            except IntegrityError:
+                await session.rollback()
+            existing = (await session.exec(select(IdempotencyRecord).where(*match))).first()
+
+        if existing is None:
+            continue
+        if existing.fingerprint != digest:
+            raise HTTPException(
+                status_code=422,
+                detail="Idempotency-Key was already used for a different request.",
+            )
+        if existing.status == "completed":
+            return Idempotency(replay=_replay(existing))
+        if time.monotonic() >= deadline:
+            raise HTTPException(
+                status_code=409,
+                detail="A request with this Idempotency-Key is still being processed.",
+                headers={"Retry-After": "1"},
+            )
+        await asyncio.sleep(IDEMPOTENCY_POLL_SECONDS)
+
+
+async def _release(session_factory, record_id: int) -> None:
+    async with session_factory() as session:
+        await session.exec(
+            delete(IdempotencyRecord).where(
+                IdempotencyRecord.id == record_id, IdempotencyRecord.status == "in_progress"
+            )
+        )
+        await session.commit()
+
+
+@asynccontextmanager
+async def idempotent(session_factory, user_id: int, endpoint: str, key: Optional[str], body: Any):
+    """
+    Run a mutation at most once per (user, endpoint, Idempotency-Key).
+
+    Without a key this does nothing. Otherwise the first request claims the
+    key; retries of a completed request get its stored response back, and
+    concurrent duplicates wait for the first one to finish. If the block
+    fails or ends without `complete`, the key is released so the client
+    can retry for real.
+    """
+    if not key:
+        yield Idempotency()
+        return
+
+    idem = await _claim(session_factory, user_id, endpoint, key, fingerprint(body))
+    if idem.replay is not None:
+        yield idem
+        return
+    try:
+        yield idem
+    except BaseException:
+        # Only drops the record if the outcome never committed
+        await _release(session_factory, idem.record_id)
+        raise
+    if not idem.completed:
+        await _release(session_factory, idem.record_id)
+
+
+async def purge_expired(session: AsyncSession) -> int:
+    result = await session.exec(
+        delete(IdempotencyRecord).where(IdempotencyRecord.expires_at < datetime.now())
+    )
+    await session.commit()
+    return result.rowcount
+
+
+async def idempotency_sweeper(session_factory) -> None:
+    """Background loop deleting expired idempotency records until cancelled."""
+    while True:
+        await asyncio.sleep(IDEMPOTENCY_SWEEP_SECONDS)
+        try:
+            async with session_factory() as session:
+                purged = await purge_expired(session)
+            if purged:
+                logger.info("Purged %d expired idempotency records", purged)
+        except Exception:
+            logger.exception("Idempotency sweep failed")
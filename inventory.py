@@ -0,0 +1,143 @@
+import asyncio
+import logging
+import os
+from collections import defaultdict
+from datetime import datetime, timedelta
+from typing import Dict, Optional
+
+from dotenv import load_dotenv
+from sqlalchemy import case
+from sqlalchemy.dialects.postgresql import insert as postgresql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlmodel import delete, func, select, update
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from cache import invalidate_category, invalidate_products
+from category_stats import counted, update_categories
+from models import CartItem, Product, ProductCategory
+
+load_dotenv()
+
+# Cart items untouched for this long give their stock back to the catalog.
+RESERVATION_TTL_MINUTES = float(os.getenv("RESERVATION_TTL_MINUTES", "30"))
+RESERVATION_SWEEP_SECONDS = float(os.getenv("RESERVATION_SWEEP_SECONDS", "60"))
+
+logger = logging.getLogger(__name__)
+
+
+async def reserve_stock(session: AsyncSession, product_id: int, quantity: int) -> Optional[int]:
+    """
+    Take `quantity` units out of stock if, and only if, that many are left.
+
+    The check and the decrement are one conditional UPDATE, so concurrent
+    reservations can never drive stock below zero. Returns the product's
+    category id, or None when the product is missing or short; the caller
+    owns the transaction.
+    """
+    result = await session.exec(
+        update(Product)
+        .where(Product.id == product_id, Product.stock_quantity >= quantity)
+        .values(stock_quantity=Product.stock_quantity - quantity)
+        .returning(Product.stock_quantity, Product.category_id, Product.is_active, Product.price)
+    )
+    row = result.first()
+    if row is None:
+        return None
+    # Only selling out changes the category's in-stock count
+    if row.stock_quantity == 0:
+        sold_out = counted(row)
+        await update_categories(session, removed=[sold_out._replace(in_stock=True)], added=[sold_out])
+    return row.category_id
+
+
+async def add_reservation(session: AsyncSession, user_id: int, product_id: int, quantity: int) -> None:
+    """
+    Add `quantity` to the user's open cart row for a product, creating it if
+    needed. One upsert on the unique open-row index, so two concurrent adds
+    can never create duplicate rows.
+    """
+    now = datetime.now()
+    insert = postgresql_insert if session.bind.dialect.name == "postgresql" else sqlite_insert
+    statement = insert(CartItem).values(
+        user_id=user_id, product_id=product_id, quantity=quantity,
+        added_at=now, updated_at=now, in_order=False,
+    )
+    await session.exec(statement.on_conflict_do_update(
+        index_elements=[CartItem.user_id, CartItem.product_id],
+        index_where=CartItem.in_order == False,
+        set_={"quantity": CartItem.quantity + statement.excluded.quantity, "updated_at": now},
+    ))
+
+
+async def release_cart_items(session: AsyncSession, *conditions) -> Dict[int, int]:
+    """
+    Delete the cart items matching `conditions` and return their stock, in
+    two bulk statements. Returns {product id: category id} of the affected
+    products.
+
+    The stock given back is what the DELETE itself reports, so a matching
+    row added by a concurrent request is either deleted and credited here
+    or left alone; it can never be deleted without its stock.
+    """
+    deleted = (await session.exec(
+        delete(CartItem).where(*conditions).returning(CartItem.product_id, CartItem.quantity)
+    )).all()
+    if not deleted:
+        return {}
+
+    returned = defaultdict(int)
+    for product_id, quantity in deleted:
+        returned[product_id] += quantity
+    product_ids = list(returned)
+    restocked = (await session.exec(
+        update(Product)
+        .where(Product.id.in_(product_ids))
+        .values(stock_quantity=Product.stock_quantity + case(dict(returned), value=Product.id))
+        .returning(Product.id, Product.stock_quantity, Product.category_id, Product.is_active, Product.price)
+    )).all()
+    # Only products that had sold out change their category's in-stock count
+    back = [counted(row) for row in restocked if row.stock_quantity == returned[row.id]]
+    await update_categories(session, removed=[c._replace(in_stock=False) for c in back], added=back)
+    return {row.id: row.category_id for row in restocked}
+
+
+async def invalidate_stock(session: AsyncSession, categories: Dict[int, int]) -> None:
+    """
+    Call after committing a stock change to {product id: category id}: drops
+    the cached products and their categories' lists and aggregates.
+    """
+    if not categories:
+        return
+    invalidate_products(*categories)
+    owners = dict((await session.exec(
+        select(ProductCategory.id, ProductCategory.user_id)
+        .where(ProductCategory.id.in_(set(categories.values())))
+    )).all())
+    for category_id, owner_id in owners.items():
+        invalidate_category(category_id, [owner_id])
+
+
+async def release_expired_reservations(session: AsyncSession) -> int:
+    """Give back stock from carts abandoned for longer than the reservation TTL."""
+    cutoff = datetime.now() - timedelta(minutes=RESERVATION_TTL_MINUTES)
+    released = await release_cart_items(
+        session,
+        CartItem.in_order == False,
+        func.coalesce(CartItem.updated_at, CartItem.added_at) < cutoff,
+    )
+    await session.commit()
+    await invalidate_stock(session, released)
+    return len(released)
+
+
+async def reservation_sweeper(session_factory) -> None:
+    """Background loop releasing expired reservations until cancelled."""
+    while True:
+        await asyncio.sleep(RESERVATION_SWEEP_SECONDS)
+        try:
+            async with session_factory() as session:
+                released = await release_expired_reservations(session)
+            if released:
+                logger.info("Released %d expired cart reservations", released)
+        except Exception:
+            logger.exception("Reservation sweep failed")
@@ -0,0 +1,44 @@
+from typing import Dict, Iterable, List, Tuple
+
+from sqlmodel import select
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from models import CartItem, Product
+
+
+async def load_products(session: AsyncSession, product_ids: Iterable[int]) -> Dict[int, Product]:
+    """Fetch many products in one `IN (...)` query, keyed by id."""
+    ids = set(product_ids)
+    if not ids:
+        return {}
+    products = (await session.exec(select(Product).where(Product.id.in_(ids)))).all()
+    return {product.id: product for product in products}
+
+
+async def load_cart_products(session: AsyncSession, items: Iterable[CartItem]) -> Dict[int, Product]:
+    """Batched CartItem -> Product loader: one query however many items there are."""
+    return await load_products(session, (item.product_id for item in items))
+
+
+async def load_order_products(session: AsyncSession, cart_ids: Iterable[int]) -> Dict[int, Tuple[CartItem, Product]]:
+    """The cart item and product behind each of many orders, in one join, keyed by cart item id."""
+    ids = {cart_id for cart_id in cart_ids if cart_id is not None}
+    if not ids:
+        return {}
+    rows = (await session.exec(
+        select(CartItem, Product)
+        .join(Product, CartItem.product_id == Product.id)
+        .where(CartItem.id.in_(ids))
+    )).all()
+    return {item.id: (item, product) for item, product in rows}
+
+
+async def cart_with_products(session: AsyncSession, user_id: int) -> List[Tuple[CartItem, Product]]:
+    """A user's cart (items not yet ordered) joined to its products in a single select."""
+    query = (
+        select(CartItem, Product)
+        .join(Product, CartItem.product_id == Product.id)
+        .where(CartItem.user_id == user_id, CartItem.in_order == False)
+        .order_by(CartItem.id)
+    )
+    return (await session.exec(query)).all()
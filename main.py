@@ -1,17 +1,44 @@
+import asyncio
+
 from fastapi import FastAPI
-from fastapi.staticfiles import StaticFiles
 from fastapi.middleware.cors import CORSMiddleware
-from pathlib import Path
 
-from database import init_db
-from routes import auth, users, products, categories, cart, order
+from database import async_session, engine, init_db
+from logging_config import RequestIdMiddleware, setup_logging
+from metrics import MetricsMiddleware, instrument_engine
+from derivatives import derivative_queue
+from hashing import password_hasher
+from idempotency import idempotency_sweeper
+from inventory import reservation_sweeper
+from search import search_index
+from serialization import ORJSONResponse
+from static_files import CachedStaticFiles
+from routes import auth, users, products, categories, cart, order, admin, metrics
+
+setup_logging()
+# Per-request SQL counts and times, for Server-Timing and /metrics
+instrument_engine(engine)
 
-app = FastAPI(title="Shop API", version="1.0.0")
+# orjson encodes datetimes, dicts and lists natively and much faster than
+# the stdlib encoder
+app = FastAPI(title="Shop API", version="1.0.0", default_response_class=ORJSONResponse)
 
 # Initialize database
 @app.on_event("startup")
-def on_startup():
-    init_db()
+async def on_startup():
+    await init_db()
+    await search_index.setup(engine)
+    # Return stock held by abandoned carts in the background
+    app.state.reservation_sweeper = asyncio.create_task(reservation_sweeper(async_session))
+    app.state.idempotency_sweeper = asyncio.create_task(idempotency_sweeper(async_session))
+
+
+@app.on_event("shutdown")
+async def on_shutdown():
+    app.state.reservation_sweeper.cancel()
+    app.state.idempotency_sweeper.cancel()
+    password_hasher.shutdown()
+    derivative_queue.shutdown()
 
 # CORS middleware
 app.add_middleware(
@@ -20,13 +47,14 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Request-ID", "ETag", "Content-Range", "Idempotent-Replayed", "Server-Timing"],
 )
+# Inside RequestIdMiddleware, so its log lines carry the request id
+app.add_middleware(MetricsMiddleware)
+app.add_middleware(RequestIdMiddleware)
 
-# ✅ Create and mount static directory
-UPLOAD_DIR = Path("static/images")
-UPLOAD_DIR.mkdir(parents=True, exist_ok=True)
-
-app.mount("/static", StaticFiles(directory="static"), name="static")
+# Uploads create static/ on first write, so it need not exist yet
+app.mount("/static", CachedStaticFiles(directory="static", check_dir=False), name="static")
 
 # Include routers
 app.include_router(auth.router)
@@ -35,3 +63,5 @@ app.include_router(products.router)
 app.include_router(categories.router)
 app.include_router(cart.router)
 app.include_router(order.router)
+app.include_router(admin.router)
+app.include_router(metrics.router)
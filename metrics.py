@@ -0,0 +1,250 @@
+import bisect
+import logging
+import os
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from dotenv import load_dotenv
+from sqlalchemy import event
+
+load_dotenv()
+
+# Statements slower than this are logged with the route that ran them
+SLOW_QUERY_MS = float(os.getenv("SLOW_QUERY_MS", "100"))
+# The same statement run this many times in one request is logged as a likely N+1
+N_PLUS_ONE_THRESHOLD = int(os.getenv("N_PLUS_ONE_THRESHOLD", "10"))
+# Send each request's time breakdown back in a Server-Timing header
+SERVER_TIMING = os.getenv("SERVER_TIMING", "true").lower() in ("1", "true", "yes")
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100, 250)
+# Request phases besides the database; each is timed where the work happens
+PHASES = ("hash", "file", "serialize")
+
+logger = logging.getLogger(__name__)
+
+
+# ----------------------------------------------------------
+# Prometheus histograms and counters
+# ----------------------------------------------------------
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(pairs) -> str:
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+
+class Histogram:
+    def __init__(self, name: str, help: str, labels: Sequence[str] = (), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets)
+        # label values -> (per-bucket counts with +Inf last, [sum])
+        self._series: Dict[Tuple[str, ...], Tuple[List[int], List[float]]] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, *label_values: str) -> None:
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            counts, total = self._series.setdefault(label_values, ([0] * (len(self.buckets) + 1), [0.0]))
+            counts[index] += 1
+            total[0] += value
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            series = [(key, list(counts), total[0]) for key, (counts, total) in sorted(self._series.items())]
+        for label_values, counts, total in series:
+            pairs = list(zip(self.labels, label_values))
+            cumulative = 0
+            for bound, count in zip([*map(str, self.buckets), "+Inf"], counts):
+                cumulative += count
+                lines.append(f"{self.name}_bucket{_labels(pairs + [('le', bound)])} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels(pairs)} {total}")
+            lines.append(f"{self.name}_count{_labels(pairs)} {cumulative}")
+        return lines
+
+
+class CounterMetric:
+    def __init__(self, name: str, help: str, labels: Sequence[str] = ()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self._values: Dict[Tuple[str, ...], int] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *label_values: str) -> None:
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + 1
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            values = sorted(self._values.items())
+        for label_values, value in values:
+            lines.append(f"{self.name}{_labels(list(zip(self.labels, label_values)))} {value}")
+        return lines
+
+
+REQUEST_SECONDS = Histogram(
+    "http_request_duration_seconds", "Time from request to response start.", ("method", "route", "status")
+)
+PHASE_SECONDS = Histogram(
+    "http_request_phase_seconds", "Time spent per request in each phase.", ("method", "route", "phase")
+)
+REQUEST_QUERIES = Histogram(
+    "http_request_db_queries", "SQL statements run per request.", ("method", "route"), QUERY_COUNT_BUCKETS
+)
+QUERY_SECONDS = Histogram("db_query_duration_seconds", "Duration of single SQL statements.")
+SLOW_QUERIES = CounterMetric("db_slow_queries_total", f"Statements slower than {SLOW_QUERY_MS:g} ms.", ("route",))
+N_PLUS_ONE = CounterMetric(
+    "db_repeated_query_requests_total",
+    f"Requests that ran one statement {N_PLUS_ONE_THRESHOLD}+ times (likely N+1).",
+    ("route",),
+)
+REGISTRY = [REQUEST_SECONDS, PHASE_SECONDS, REQUEST_QUERIES, QUERY_SECONDS, SLOW_QUERIES, N_PLUS_ONE]
+
+
+def render_metrics() -> str:
+    """Every metric in the Prometheus text exposition format."""
+    return "\n".join(line for metric in REGISTRY for line in metric.render()) + "\n"
+
+
+# ----------------------------------------------------------
+# Per-request accounting
+# ----------------------------------------------------------
+class RequestMetrics:
+    def __init__(self, scope):
+        self.scope = scope
+        self.method = scope["method"]
+        self.queries = 0
+        self.sql_seconds = 0.0
+        self.statements: Counter = Counter()
+        self.phases: Dict[str, float] = dict.fromkeys(PHASES, 0.0)
+
+    @property
+    def route(self) -> str:
+        # Routing fills the scope in before the endpoint runs
+        return _route_label(self.scope)
+
+    def server_timing(self, total: float) -> str:
+        app = total - self.sql_seconds - sum(self.phases.values())
+        parts = [f'db;dur={self.sql_seconds * 1000:.3f};desc="{self.queries} queries"']
+        parts += [f"{name};dur={seconds * 1000:.3f}" for name, seconds in self.phases.items() if seconds]
+        parts += [f"app;dur={max(app, 0) * 1000:.3f}", f"total;dur={total * 1000:.3f}"]
+        return ", ".join(parts)
+
+
+current_request: ContextVar[Optional[RequestMetrics]] = ContextVar("current_request", default=None)
+
+
+@contextmanager
+def timed(phase: str):
+    """Add the block's duration to a phase of the current request, if any."""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        metrics = current_request.get()
+        if metrics is not None:
+            metrics.phases[phase] += time.perf_counter() - started
+
+
+def _route_label(scope) -> str:
+    route = scope.get("route")
+    if route is not None:
+        return route.path
+    # Mounted apps (static files) only leave their prefix behind
+    return scope.get("root_path") or "unmatched"
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("query_started", []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - conn.info["query_started"].pop()
+    QUERY_SECONDS.observe(elapsed)
+    metrics = current_request.get()
+    if metrics is not None:
+        metrics.queries += 1
+        metrics.sql_seconds += elapsed
+        if not executemany:
+            metrics.statements[statement] += 1
+    if elapsed * 1000 >= SLOW_QUERY_MS:
+        route = f"{metrics.method} {metrics.route}" if metrics else "background"
+        SLOW_QUERIES.inc(metrics.route if metrics else "background")
+        logger.warning("Slow query (%.1f ms) in %s: %s", elapsed * 1000, route, " ".join(statement.split())[:500])
+
+
+def instrument_engine(engine) -> None:
+    """Time every statement `engine` runs and charge it to the current request."""
+    sync_engine = getattr(engine, "sync_engine", engine)
+    if not event.contains(sync_engine, "before_cursor_execute", _before_cursor_execute):
+        event.listen(sync_engine, "before_cursor_execute", _before_cursor_execute)
+        event.listen(sync_engine, "after_cursor_execute", _after_cursor_execute)
+
+
+class MetricsMiddleware:
+    """
+    Account every HTTP request: SQL statements and their time, the other
+    phases reported through `timed`, and the total until the response
+    starts. Adds a Server-Timing header and feeds the /metrics histograms.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        metrics = RequestMetrics(scope)
+        token = current_request.set(metrics)
+        started = time.perf_counter()
+
+        async def send_with_timing(message):
+            if message["type"] == "http.response.start":
+                total = time.perf_counter() - started
+                if SERVER_TIMING:
+                    headers = list(message.get("headers", []))
+                    headers.append((b"server-timing", metrics.server_timing(total).encode()))
+                    message["headers"] = headers
+                self._observe(metrics, message["status"], total)
+                # Only what ran before the response started: a streamed
+                # body legitimately repeats its batch query
+                self._check_repeats(metrics)
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            current_request.reset(token)
+
+    def _observe(self, metrics: RequestMetrics, status: int, total: float) -> None:
+        labels = (metrics.method, metrics.route)
+        REQUEST_SECONDS.observe(total, *labels, str(status))
+        REQUEST_QUERIES.observe(metrics.queries, *labels)
+        PHASE_SECONDS.observe(metrics.sql_seconds, *labels, "db")
+        for phase, seconds in metrics.phases.items():
+            if seconds:
+                PHASE_SECONDS.observe(seconds, *labels, phase)
+
+    def _check_repeats(self, metrics: RequestMetrics) -> None:
+        if not metrics.statements:
+            return
+        statement, count = metrics.statements.most_common(1)[0]
+        if count >= N_PLUS_ONE_THRESHOLD:
+            N_PLUS_ONE.inc(metrics.route)
+            logger.warning(
+                "Possible N+1 in %s %s: one statement ran %d times: %s",
+                metrics.method, metrics.route, count, " ".join(statement.split())[:500],
+            )
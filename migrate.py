@@ -0,0 +1,36 @@
+"""
+Bring the database schema up to date (see migrations.py). Run it once per
+deploy, before the app's workers start.
+
+    python migrate.py [--status]
+"""
+import argparse
+import asyncio
+
+from database import engine
+from logging_config import setup_logging
+import migrations
+
+
+async def run(status: bool) -> None:
+    async with engine.connect() as connection:
+        if status:
+            print(f"version: {await connection.run_sync(migrations.current_version)}")
+            for m in await connection.run_sync(migrations.pending):
+                print(f"pending: {m.version} {m.description}")
+        else:
+            applied = await connection.run_sync(migrations.upgrade)
+            print(f"applied: {applied or 'nothing, already up to date'}")
+    await engine.dispose()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--status", action="store_true", help="show the version and pending migrations")
+    args = parser.parse_args()
+    setup_logging()
+    asyncio.run(run(args.status))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,343 @@
+# Versioned schema migrations.
+#
+# Each migration is a function of a (sync) connection registered with
+# `@migration(version, description)`; applied versions are recorded in the
+# schemaversion table. A brand-new database gets the current models' schema
+# in one go (plus the migrations marked `on_create`, for what the models
+# cannot declare) and is stamped with every version; an existing one runs
+# just the migrations it has not had. Migrations must be safe to re-run (create IF NOT
+# EXISTS, backfill only what is missing).
+#
+# Run `python migrate.py` before starting the app's workers; with
+# AUTO_MIGRATE on (the default) the app also does it at startup.
+import logging
+from datetime import datetime
+from typing import Callable, List, NamedTuple
+
+from sqlalchemy import (
+    JSON, Boolean, Column, DateTime, Float, ForeignKey, Index, Integer, MetaData, String, Table,
+    UniqueConstraint, inspect,
+)
+from sqlalchemy.orm import aliased
+from sqlalchemy.schema import CreateIndex
+from sqlalchemy.exc import IntegrityError, OperationalError, ProgrammingError
+from sqlmodel import SQLModel, delete, func, insert, select, update
+
+from category_stats import rebuild_all
+from models import CartItem, CategoryStats, Product, SchemaVersion
+from search import create_fts_table
+
+logger = logging.getLogger(__name__)
+
+
+class Migration(NamedTuple):
+    version: int
+    description: str
+    apply: Callable
+    # Also run on a brand-new database, after create_all
+    on_create: bool = False
+
+
+MIGRATIONS: List[Migration] = []
+
+
+def migration(version: int, description: str, on_create: bool = False):
+    def register(func: Callable) -> Callable:
+        if MIGRATIONS and version <= MIGRATIONS[-1].version:
+            raise ValueError(f"migration {version} is out of order")
+        MIGRATIONS.append(Migration(version, description, func, on_create))
+        return func
+    return register
+
+
+def latest_version() -> int:
+    return MIGRATIONS[-1].version
+
+
+def _create_index(connection, index) -> None:
+    # IF NOT EXISTS rather than checkfirst: SQLite reflection does not
+    # report expression indexes, so checkfirst would try to create them again
+    connection.execute(CreateIndex(index, if_not_exists=True))
+
+
+def create_indexes(connection, *names: str) -> None:
+    """Create the named indexes, as declared on the models, where missing."""
+    indexes = {index.name: index for table in SQLModel.metadata.sorted_tables for index in table.indexes}
+    for name in names:
+        _create_index(connection, indexes[name])
+
+
+def _baseline_metadata() -> MetaData:
+    """
+    The schema as the app last created it before migrations existed. Frozen
+    on purpose: what the models gained since then comes from the later
+    migrations, which may have to prepare the data first.
+    """
+    metadata = MetaData()
+    Table(
+        "user", metadata,
+        Column("id", Integer, primary_key=True),
+        Column("username", String, nullable=False, unique=True),
+        Column("email", String, nullable=False, unique=True),
+        Column("password", String, nullable=False),
+        Column("is_admin", Boolean, nullable=False),
+        Column("created_at", DateTime, nullable=False),
+        Column("last_login_at", DateTime, nullable=False),
+    )
+    Table(
+        "productcategory", metadata,
+        Column("id", Integer, primary_key=True),
+        Column("name", String, nullable=False),
+        Column("user_id", Integer, ForeignKey("user.id")),
+        Index("ix_productcategory_name_id", "name", "id"),
+        Index("ix_productcategory_user_name", "user_id", "name"),
+    )
+    Table(
+        "categorystats", metadata,
+        Column("category_id", Integer, ForeignKey("productcategory.id"), primary_key=True),
+        Column("product_count", Integer, nullable=False),
+        Column("active_count", Integer, nullable=False),
+        Column("in_stock_count", Integer, nullable=False),
+        Column("min_price", Float),
+        Column("max_price", Float),
+    )
+    Table(
+        "product", metadata,
+        Column("id", Integer, primary_key=True),
+        Column("name", String, nullable=False),
+        Column("description", String),
+        Column("price", Float, nullable=False),
+        Column("image_path", String),
+        Column("stock_quantity", Integer, nullable=False),
+        Column("is_active", Boolean, nullable=False),
+        Column("created_at", DateTime, nullable=False),
+        Column("updated_at", DateTime),
+        Column("category_id", Integer, ForeignKey("productcategory.id"), nullable=False),
+        Index("ix_product_category_price_id", "category_id", "price", "id"),
+        Index("ix_product_category_created_id", "category_id", "created_at", "id"),
+        Index("ix_product_price_id", "price", "id"),
+        Index("ix_product_created_id", "created_at", "id"),
+        Index("ix_product_name_id", "name", "id"),
+        Index("ix_product_image_path", "image_path"),
+    )
+    Table(
+        "cartitem", metadata,
+        Column("id", Integer, primary_key=True),
+        Column("user_id", Integer, ForeignKey("user.id"), nullable=False),
+        Column("product_id", Integer, ForeignKey("product.id"), nullable=False),
+        Column("quantity", Integer, nullable=False),
+        Column("added_at", DateTime, nullable=False),
+        Column("updated_at", DateTime),
+        Column("in_order", Boolean, nullable=False),
+    )
+    Table(
+        "order", metadata,
+        Column("id", Integer, primary_key=True),
+        Column("user_id", Integer, ForeignKey("user.id"), nullable=False),
+        Column("cart_id", Integer, ForeignKey("cartitem.id")),
+        Column("total_price", Float, nullable=False),
+        Column("address", String, nullable=False),
+        Column("is_paid", Boolean, nullable=False),
+        Column("order_date", DateTime, nullable=False),
+    )
+    Table(
+        "outboxevent", metadata,
+        Column("id", Integer, primary_key=True),
+        Column("topic", String, nullable=False),
+        Column("idempotency_key", String, nullable=False, unique=True),
+        Column("payload", JSON),
+        Column("status", String, nullable=False),
+        Column("attempts", Integer, nullable=False),
+        Column("available_at", DateTime, nullable=False),
+        Column("created_at", DateTime, nullable=False),
+        Column("processed_at", DateTime),
+        Column("last_error", String),
+        Index("ix_outboxevent_status_available_id", "status", "available_at", "id"),
+    )
+    Table(
+        "idempotencyrecord", metadata,
+        Column("id", Integer, primary_key=True),
+        Column("user_id", Integer, ForeignKey("user.id"), nullable=False),
+        Column("endpoint", String, nullable=False),
+        Column("key", String, nullable=False),
+        Column("fingerprint", String, nullable=False),
+        Column("status", String, nullable=False),
+        Column("status_code", Integer),
+        Column("response", JSON),
+        Column("created_at", DateTime, nullable=False),
+        Column("locked_until", DateTime, nullable=False),
+        Column("expires_at", DateTime, nullable=False),
+        UniqueConstraint("user_id", "endpoint", "key", name="uq_idempotency_user_endpoint_key"),
+        Index("ix_idempotencyrecord_expires_at", "expires_at"),
+    )
+    return metadata
+
+
+# ----------------------------------------------------------
+# Migrations
+# ----------------------------------------------------------
+@migration(1, "Schema as created before migrations existed")
+def baseline(connection):
+    # Unversioned databases were kept up to date by create_all at every
+    # startup; this is that one last time, with the models of the day.
+    metadata = _baseline_metadata()
+    metadata.create_all(connection)
+    for table in metadata.sorted_tables:
+        for index in table.indexes:
+            _create_index(connection, index)
+
+
+@migration(2, "Index cart item and order foreign keys")
+def foreign_key_indexes(connection):
+    # Product.category_id and ProductCategory.user_id already lead composite
+    # indexes, which serve lookups by them just as well
+    create_indexes(
+        connection,
+        "ix_cartitem_user_id",
+        "ix_cartitem_product_id",
+        "ix_order_user_id",
+        "ix_order_cart_id",
+    )
+
+
+@migration(3, "Backfill category aggregates")
+def category_stats(connection):
+    has_stats = connection.execute(select(CategoryStats.category_id).limit(1)).first()
+    has_products = connection.execute(select(Product.id).limit(1)).first()
+    if has_products and not has_stats:
+        logger.info("Built aggregates for %d categories", rebuild_all(connection))
+
+
+@migration(4, "One open cart row per user and product")
+def unique_open_cart_items(connection):
+    # Racing add-to-cart requests could each insert a row; fold duplicates
+    # into the oldest one before the unique index can be built
+    open_items = CartItem.in_order == False
+    keep = (
+        select(func.min(CartItem.id))
+        .where(open_items)
+        .group_by(CartItem.user_id, CartItem.product_id)
+    )
+    duplicate = aliased(CartItem)
+    total = (
+        select(func.sum(duplicate.quantity))
+        .where(
+            duplicate.user_id == CartItem.user_id,
+            duplicate.product_id == CartItem.product_id,
+            duplicate.in_order == False,
+        )
+        .scalar_subquery()
+    )
+    merged = connection.execute(
+        update(CartItem)
+        .where(open_items, CartItem.id.in_(keep.having(func.count() > 1)))
+        .values(quantity=total)
+    ).rowcount
+    if merged:
+        connection.execute(delete(CartItem).where(open_items, CartItem.id.not_in(keep)))
+        logger.info("Merged duplicate open cart rows for %d user/product pairs", merged)
+    create_indexes(connection, "uq_cartitem_user_product_open", "ix_cartitem_open_touched")
+
+
+@migration(5, "Index order history by user and date")
+def order_history_index(connection):
+    create_indexes(connection, "ix_order_user_date_id")
+
+
+@migration(6, "Full-text index over product names and descriptions", on_create=True)
+def product_search_index(connection):
+    # Only on SQLite builds with FTS5; elsewhere search falls back to the
+    # in-memory index (see search.py)
+    if connection.dialect.name == "sqlite" and not create_fts_table(connection):
+        logger.info("SQLite has no FTS5; product search will use the in-memory index")
+
+
+@migration(7, "Index category product lists by name")
+def category_name_index(connection):
+    create_indexes(connection, "ix_product_category_name_id")
+
+
+# ----------------------------------------------------------
+# Runner
+# ----------------------------------------------------------
+def current_version(connection) -> int:
+    try:
+        version = connection.execute(select(func.max(SchemaVersion.version))).scalar()
+    except (OperationalError, ProgrammingError):
+        # No schemaversion table yet
+        connection.rollback()
+        return 0
+    return version or 0
+
+
+def _stamp(connection, migrations: List[Migration]) -> None:
+    now = datetime.now()
+    connection.execute(insert(SchemaVersion), [
+        {"version": m.version, "description": m.description, "applied_at": now} for m in migrations
+    ])
+
+
+def upgrade(connection) -> List[int]:
+    """Apply every pending migration, each in its own transaction; returns their versions."""
+    version = current_version(connection)
+    if version >= latest_version():
+        return []
+
+    if version == 0 and not set(inspect(connection).get_table_names()) & set(SQLModel.metadata.tables):
+        # New database: no need to replay history
+        SQLModel.metadata.create_all(connection)
+        for m in MIGRATIONS:
+            if m.on_create:
+                m.apply(connection)
+        if not _stamp_or_yield(connection, MIGRATIONS):
+            return []
+        logger.info("Created the schema at version %d", latest_version())
+        return [m.version for m in MIGRATIONS]
+
+    # Versions are recorded from the first migration on
+    SchemaVersion.__table__.create(connection, checkfirst=True)
+    applied = []
+    for m in MIGRATIONS:
+        if m.version <= version:
+            continue
+        # Errors from the migration itself propagate: it is not recorded
+        # and runs again next time
+        m.apply(connection)
+        if _stamp_or_yield(connection, [m]):
+            logger.info("Applied migration %d: %s", m.version, m.description)
+            applied.append(m.version)
+    return applied
+
+
+def _stamp_or_yield(connection, migrations: List[Migration]) -> bool:
+    """
+    Record `migrations` and commit. False when another process recorded
+    them first (their schemaversion rows already exist); the work done here
+    is rolled back then, as far as the database allows.
+    """
+    try:
+        _stamp(connection, migrations)
+    except IntegrityError:
+        connection.rollback()
+        still_pending = {m.version for m in pending(connection)}
+        if any(m.version in still_pending for m in migrations):
+            # Still pending: not a concurrent stamp after all
+            raise
+        return False
+    connection.commit()
+    return True
+
+
+def pending(connection) -> List[Migration]:
+    version = current_version(connection)
+    return [m for m in MIGRATIONS if m.version > version]
+
+
+def verify(connection) -> None:
+    """Fail fast if the database is behind the code."""
+    missing = pending(connection)
+    if missing:
+        raise RuntimeError(
+            f"Database schema is missing migrations {[m.version for m in missing]}; "
+            "run `python migrate.py` first"
+        )
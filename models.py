@@ -1,10 +1,18 @@
 from datetime import datetime
-from typing import List, Optional
-from sqlmodel import SQLModel, Field, Relationship, Column, DateTime
-from pydantic import EmailStr
+from typing import Dict, List, Optional
+from sqlmodel import JSON, SQLModel, Field, Relationship, Column, DateTime, Index, UniqueConstraint, text
+from pydantic import EmailStr, computed_field
+
+from derivatives import variant_urls
 
 
 class ProductCategory(SQLModel, table=True):
+    # Category lists are ordered by name, per owner for admins
+    __table_args__ = (
+        Index("ix_productcategory_name_id", "name", "id"),
+        Index("ix_productcategory_user_name", "user_id", "name"),
+    )
+
     id: int = Field(primary_key=True)
     name: str = Field()
     user_id: Optional[int] = Field(default=None, foreign_key="user.id")
@@ -14,6 +22,31 @@ class ProductCategory(SQLModel, table=True):
     products: List["Product"] = Relationship(back_populates="category")
 
 
+class CategoryStats(SQLModel, table=True):
+    """
+    Per-category product aggregates, kept up to date by category_stats so
+    the category list never has to scan products. Prices and the in-stock
+    count only cover active products.
+    """
+    category_id: int = Field(primary_key=True, foreign_key="productcategory.id")
+    product_count: int = 0
+    active_count: int = 0
+    in_stock_count: int = 0
+    min_price: Optional[float] = None
+    max_price: Optional[float] = None
+
+
+class CategorySummary(SQLModel):
+    id: int
+    name: str
+    user_id: Optional[int] = None
+    product_count: int = 0
+    active_count: int = 0
+    in_stock_count: int = 0
+    min_price: Optional[float] = None
+    max_price: Optional[float] = None
+
+
 class User(SQLModel, table=True):
     id: int = Field(primary_key=True)
     username: str = Field(unique=True)
@@ -31,6 +64,19 @@ class User(SQLModel, table=True):
 
 
 class Product(SQLModel, table=True):
+    # Composite indexes backing the keyset-paginated catalog listing: each
+    # one ends with `id` so a (filter, sort key, id) seek is a range scan.
+    __table_args__ = (
+        Index("ix_product_category_price_id", "category_id", "price", "id"),
+        Index("ix_product_category_created_id", "category_id", "created_at", "id"),
+        Index("ix_product_category_name_id", "category_id", "name", "id"),
+        Index("ix_product_price_id", "price", "id"),
+        Index("ix_product_created_id", "created_at", "id"),
+        Index("ix_product_name_id", "name", "id"),
+        # Image reference counts for the content-addressed blob store
+        Index("ix_product_image_path", "image_path"),
+    )
+
     id: int = Field(primary_key=True)
     name: str
     description: Optional[str] = None
@@ -48,11 +94,118 @@ class Product(SQLModel, table=True):
     category: Optional[ProductCategory] = Relationship(back_populates="products")
     cart_items: List["CartItem"] = Relationship(back_populates="product")
 
+    @computed_field
+    @property
+    def image_variants(self) -> Dict[str, str]:
+        """Thumbnail/medium/WebP paths; each redirects to the original until generated."""
+        return variant_urls(self.image_path)
+
+
+# ----------------------------------------------------------
+# Read schemas
+# ----------------------------------------------------------
+# What the API sends back: plain (non-table) models without relationships
+# or secrets. List endpoints fill them with serialization.dump_rows.
+class UserRead(SQLModel):
+    id: int
+    username: str
+    email: str
+    is_admin: bool
+    created_at: datetime
+    last_login_at: datetime
+
+
+class ProductRead(SQLModel):
+    id: int
+    name: str
+    description: Optional[str] = None
+    price: float
+    image_path: Optional[str] = None
+    stock_quantity: int
+    is_active: bool
+    created_at: datetime
+    updated_at: Optional[datetime] = None
+    category_id: int
+    image_variants: Dict[str, str] = {}
+
+
+class OrderRead(SQLModel):
+    id: int
+    user_id: int
+    cart_id: Optional[int] = None
+    total_price: float
+    address: str
+    is_paid: bool
+    order_date: datetime
+
+
+class OrderProduct(SQLModel):
+    """The product an order was for, as embedded in order history."""
+    product_id: int
+    name: str
+    price: float
+    image_path: Optional[str] = None
+    quantity: int
+
+
+class OrderDetail(OrderRead):
+    # Only filled in when asked for (include_products=true)
+    product: Optional[OrderProduct] = None
+
+
+class OrderPage(SQLModel):
+    items: List[OrderDetail]
+    next_cursor: Optional[str] = None
+
+
+class ProductPage(SQLModel):
+    items: List[ProductRead]
+    next_cursor: Optional[str] = None
+
+
+class CategoryFacet(SQLModel):
+    category_id: int
+    count: int
+
+
+class PriceFacet(SQLModel):
+    min: float
+    max: Optional[float] = None
+    count: int
+
+
+class SearchFacets(SQLModel):
+    categories: List[CategoryFacet]
+    price: List[PriceFacet]
+
+
+class SearchPage(ProductPage):
+    total: int
+    facets: SearchFacets
+
 
 class CartItem(SQLModel, table=True):
+    __table_args__ = (
+        # At most one open (not yet ordered) row per user and product; the
+        # add-to-cart upsert relies on it. Ordered rows are history and may
+        # repeat. Also serves checkout's and the cart page's lookups.
+        Index(
+            "uq_cartitem_user_product_open", "user_id", "product_id",
+            unique=True,
+            sqlite_where=text("in_order = 0"),
+            postgresql_where=text("in_order = false"),
+        ),
+        # The reservation sweeper's "open and untouched since" scan
+        Index(
+            "ix_cartitem_open_touched", text("coalesce(updated_at, added_at)"),
+            sqlite_where=text("in_order = 0"),
+            postgresql_where=text("in_order = false"),
+        ),
+    )
+
     id: int = Field(primary_key=True)
-    user_id: int = Field(foreign_key="user.id")
-    product_id: int = Field(foreign_key="product.id")
+    user_id: int = Field(foreign_key="user.id", index=True)
+    product_id: int = Field(foreign_key="product.id", index=True)
     quantity: int = Field(default=1, ge=1)
     added_at: datetime = Field(default_factory=datetime.now)
     updated_at: datetime = Field(
@@ -67,9 +220,15 @@ class CartItem(SQLModel, table=True):
 
 
 class Order(SQLModel, table=True):
+    # Order history: seek by user and date, and filter on is_paid, without
+    # touching the table; only the rows of the page are read
+    __table_args__ = (
+        Index("ix_order_user_date_id", "user_id", "order_date", "id", "is_paid"),
+    )
+
     id: int = Field(primary_key=True)
-    user_id: int = Field(foreign_key="user.id")
-    cart_id: Optional[int] = Field(default=None, foreign_key="cartitem.id")  # <-- add this
+    user_id: int = Field(foreign_key="user.id", index=True)
+    cart_id: Optional[int] = Field(default=None, foreign_key="cartitem.id", index=True)
     total_price: float = Field(default=0.0)
     address: str = Field(default="")
     is_paid: bool = Field(default=False)
@@ -79,3 +238,55 @@ class Order(SQLModel, table=True):
     user: Optional["User"] = Relationship(back_populates="orders")
     cart_item: Optional["CartItem"] = Relationship(back_populates="order")
 
+
+class OutboxEvent(SQLModel, table=True):
+    """
+    Follow-up work recorded in the same transaction as the change that
+    caused it, and carried out later by outbox_worker.py.
+    """
+    # The worker's claim query: due pending events, oldest first
+    __table_args__ = (
+        Index("ix_outboxevent_status_available_id", "status", "available_at", "id"),
+    )
+
+    id: int = Field(primary_key=True)
+    topic: str
+    # Unique per unit of work, so it is never enqueued twice; handlers pass
+    # it on to anything downstream that must not act twice
+    idempotency_key: str = Field(unique=True)
+    payload: dict = Field(default_factory=dict, sa_column=Column(JSON))
+    status: str = Field(default="pending")  # pending | done | failed
+    attempts: int = Field(default=0)
+    available_at: datetime = Field(default_factory=datetime.now)
+    created_at: datetime = Field(default_factory=datetime.now)
+    processed_at: Optional[datetime] = None
+    last_error: Optional[str] = None
+
+
+class IdempotencyRecord(SQLModel, table=True):
+    """The outcome of a mutation sent with an Idempotency-Key, for replays."""
+    __table_args__ = (
+        UniqueConstraint("user_id", "endpoint", "key", name="uq_idempotency_user_endpoint_key"),
+        Index("ix_idempotencyrecord_expires_at", "expires_at"),
+    )
+
+    id: int = Field(primary_key=True)
+    user_id: int = Field(foreign_key="user.id")
+    endpoint: str
+    key: str
+    # sha256 of the request body; a key may only be reused for the same body
+    fingerprint: str
+    status: str = Field(default="in_progress")  # in_progress | completed
+    status_code: Optional[int] = None
+    response: Optional[dict] = Field(default=None, sa_column=Column(JSON))
+    created_at: datetime = Field(default_factory=datetime.now)
+    # An in-progress record past this is taken to be abandoned
+    locked_until: datetime
+    expires_at: datetime
+
+
+class SchemaVersion(SQLModel, table=True):
+    """One row per migration applied to this database (see migrations.py)."""
+    version: int = Field(primary_key=True)
+    description: str
+    applied_at: datetime = Field(default_factory=datetime.now)
@@ -0,0 +1,173 @@
+import asyncio
+import logging
+import os
+from datetime import datetime, timedelta
+from typing import Awaitable, Callable, Dict, Iterable, List, Tuple
+
+from dotenv import load_dotenv
+from sqlmodel import func, insert, select, update
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from models import OutboxEvent
+
+load_dotenv()
+
+OUTBOX_BATCH_SIZE = int(os.getenv("OUTBOX_BATCH_SIZE", "50"))
+OUTBOX_POLL_SECONDS = float(os.getenv("OUTBOX_POLL_SECONDS", "1"))
+# A claimed event that is neither done nor failed within the lease (the
+# worker died) becomes due again.
+OUTBOX_LEASE_SECONDS = float(os.getenv("OUTBOX_LEASE_SECONDS", "60"))
+OUTBOX_MAX_ATTEMPTS = int(os.getenv("OUTBOX_MAX_ATTEMPTS", "8"))
+OUTBOX_RETRY_BASE_SECONDS = float(os.getenv("OUTBOX_RETRY_BASE_SECONDS", "2"))
+
+logger = logging.getLogger(__name__)
+
+Handler = Callable[[AsyncSession, OutboxEvent], Awaitable[None]]
+HANDLERS: Dict[str, Handler] = {}
+
+
+def handler(topic: str):
+    """Register the coroutine that carries out events of `topic`."""
+    def register(func: Handler) -> Handler:
+        HANDLERS[topic] = func
+        return func
+    return register
+
+
+async def enqueue(session: AsyncSession, topic: str, events: Iterable[Tuple[str, dict]]) -> None:
+    """
+    Add (idempotency key, payload) events to the outbox in the caller's
+    transaction, with one multi-row INSERT. Nothing runs until it commits.
+    """
+    now = datetime.now()
+    rows = [
+        {"topic": topic, "idempotency_key": key, "payload": payload, "available_at": now, "created_at": now}
+        for key, payload in events
+    ]
+    if rows:
+        await session.exec(insert(OutboxEvent), params=rows)
+
+
+# ----------------------------------------------------------
+# Worker
+# ----------------------------------------------------------
+async def claim(session: AsyncSession, limit: int = OUTBOX_BATCH_SIZE) -> List[OutboxEvent]:
+    """
+    Take up to `limit` due events by pushing their `available_at` past the
+    lease. The claim is a single conditional UPDATE, so two workers never
+    get the same event (SQLite has no SKIP LOCKED; this needs none).
+    """
+    now = datetime.now()
+    due = (
+        select(OutboxEvent.id)
+        .where(OutboxEvent.status == "pending", OutboxEvent.available_at <= now)
+        .order_by(OutboxEvent.available_at, OutboxEvent.id)
+        .limit(limit)
+        .scalar_subquery()
+    )
+    claimed = (await session.exec(
+        update(OutboxEvent)
+        .where(
+            OutboxEvent.id.in_(due),
+            OutboxEvent.status == "pending",
+            OutboxEvent.available_at <= now,
+        )
+        .values(
+            attempts=OutboxEvent.attempts + 1,
+            available_at=now + timedelta(seconds=OUTBOX_LEASE_SECONDS),
+        )
+        .returning(OutboxEvent)
+    )).scalars().all()
+    await session.commit()
+    return sorted(claimed, key=lambda event: event.id)
+
+
+async def process(session_factory, event: OutboxEvent) -> bool:
+    """Run one claimed event's handler and record the outcome."""
+    func = HANDLERS.get(event.topic)
+    try:
+        if func is None:
+            raise LookupError(f"no handler for topic {event.topic!r}")
+        async with session_factory() as session:
+            await func(session, event)
+            await session.commit()
+    except Exception as exc:
+        failed = func is None or event.attempts >= OUTBOX_MAX_ATTEMPTS
+        delay = OUTBOX_RETRY_BASE_SECONDS * 2 ** (event.attempts - 1)
+        logger.warning(
+            "Outbox event %s (%s) attempt %d failed: %r",
+            event.id, event.topic, event.attempts, exc,
+        )
+        values = {"last_error": repr(exc)[:500]}
+        if failed:
+            values["status"] = "failed"
+        else:
+            values["available_at"] = datetime.now() + timedelta(seconds=delay)
+        await _finish(session_factory, event, values)
+        return False
+
+    await _finish(session_factory, event, {"status": "done", "processed_at": datetime.now(), "last_error": None})
+    return True
+
+
+async def _finish(session_factory, event: OutboxEvent, values: dict) -> None:
+    async with session_factory() as session:
+        await session.exec(
+            update(OutboxEvent)
+            .where(OutboxEvent.id == event.id, OutboxEvent.status == "pending")
+            .values(**values)
+        )
+        await session.commit()
+
+
+async def drain(session_factory, once: bool = False) -> int:
+    """
+    Process due events until cancelled, polling every OUTBOX_POLL_SECONDS
+    when idle. With `once`, stop as soon as nothing is due. Returns the
+    number of events that succeeded.
+    """
+    done = 0
+    while True:
+        async with session_factory() as session:
+            events = await claim(session)
+        if not events:
+            if once:
+                return done
+            await asyncio.sleep(OUTBOX_POLL_SECONDS)
+            continue
+        results = await asyncio.gather(*(process(session_factory, event) for event in events))
+        done += sum(results)
+
+
+async def outbox_stats(session: AsyncSession) -> dict:
+    counts = dict((await session.exec(
+        select(OutboxEvent.status, func.count()).group_by(OutboxEvent.status)
+    )).all())
+    oldest = (await session.exec(
+        select(func.min(OutboxEvent.created_at)).where(OutboxEvent.status == "pending")
+    )).one()
+    return {
+        "pending": counts.get("pending", 0),
+        "done": counts.get("done", 0),
+        "failed": counts.get("failed", 0),
+        "oldest_pending": oldest,
+    }
+
+
+# ----------------------------------------------------------
+# Handlers
+# ----------------------------------------------------------
+@handler("order.created")
+async def confirm_order(session: AsyncSession, event: OutboxEvent) -> None:
+    """
+    Post-checkout work for one order. Confirmation (and, later, payment
+    capture) happens here, off the checkout request; anything external is
+    called with `event.idempotency_key` so a retried event is not acted on
+    twice.
+    """
+    payload = event.payload
+    logger.info(
+        "Order %s confirmed for user %s: total %.2f, paid=%s (key %s)",
+        payload["order_id"], payload["user_id"], payload["total_price"],
+        payload["is_paid"], event.idempotency_key,
+    )
@@ -0,0 +1,33 @@
+"""
+Drain the outbox: run the follow-up work recorded by checkout (see
+outbox.py) with retries and backoff. Several workers can run at once.
+
+    python outbox_worker.py [--once]
+"""
+import argparse
+import asyncio
+
+from database import async_session, init_db
+from logging_config import setup_logging
+from outbox import drain
+
+
+async def run(once: bool) -> int:
+    await init_db()
+    return await drain(async_session, once=once)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--once", action="store_true", help="exit when no event is due")
+    args = parser.parse_args()
+    setup_logging()
+    try:
+        processed = asyncio.run(run(args.once))
+    except KeyboardInterrupt:
+        return
+    print(f"processed: {processed}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+import base64
+import json
+from datetime import datetime
+from typing import Any, List, Optional, Sequence
+
+from fastapi import HTTPException
+from sqlalchemy import tuple_
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+
+
+def encode_cursor(values: Sequence[Any]) -> str:
+    """Pack the sort key of the last row on a page into an opaque token."""
+    payload = [
+        {"dt": v.isoformat()} if isinstance(v, datetime) else v
+        for v in values
+    ]
+    raw = json.dumps(payload, separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def _matches(value: Any, python_type: type) -> bool:
+    if isinstance(value, bool):
+        return python_type is bool
+    if python_type is float:
+        return isinstance(value, (int, float))
+    return isinstance(value, python_type)
+
+
+def decode_cursor(cursor: str, types: Sequence[type]) -> List[Any]:
+    """
+    Unpack a cursor whose values must be of `types`, in order; anything
+    else is a 400 rather than a query comparing the key to the wrong type.
+    """
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        payload = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        if not isinstance(payload, list) or len(payload) != len(types):
+            raise ValueError
+        values = [
+            datetime.fromisoformat(v["dt"]) if isinstance(v, dict) else v
+            for v in payload
+        ]
+    except (ValueError, TypeError, KeyError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    if not all(_matches(value, python_type) for value, python_type in zip(values, types)):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    return values
+
+
+def column_type(column) -> type:
+    """The Python type of a column's values (seeing through SQLModel's AutoString)."""
+    type_ = column.type
+    return getattr(type_, "impl", type_).python_type
+
+
+def keyset_paginate(query, columns, cursor: Optional[str], limit: int, descending: bool = False):
+    """
+    Apply keyset ("seek") pagination to a select.
+
+    `columns` is the full sort key and must end with a unique column (the
+    primary key) so that pages never overlap. Rows past the cursor are found
+    with a row-value comparison, which an index on the same columns answers
+    without scanning the skipped rows, so deep pages cost the same as the
+    first one. One extra row is fetched to tell whether a next page exists.
+    """
+    if cursor:
+        last = decode_cursor(cursor, [column_type(c) for c in columns])
+        key = tuple_(*columns)
+        query = query.where(key < tuple_(*last) if descending else key > tuple_(*last))
+
+    order = [c.desc() for c in columns] if descending else list(columns)
+    return query.order_by(*order).limit(limit + 1)
+
+
+def page_response(rows, columns, limit: int):
+    """Trim the look-ahead row and build `{"items", "next_cursor"}`."""
+    rows = list(rows)
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        last = rows[-1]
+        next_cursor = encode_cursor([getattr(last, c.key) for c in columns])
+    return {"items": rows, "next_cursor": next_cursor}
@@ -0,0 +1,53 @@
+"""
+Write gzip siblings (foo.svg -> foo.svg.gz) for compressible files under
+static/, so CachedStaticFiles can serve them without compressing per request.
+Safe to re-run: up-to-date siblings are skipped.
+
+    python precompress_static.py [--dry-run]
+"""
+import argparse
+import gzip
+import os
+import shutil
+from mimetypes import guess_type
+from pathlib import Path
+
+from static_files import COMPRESSIBLE_TYPES, ENCODINGS
+
+STATIC_DIR = Path("static")
+SIBLING_SUFFIXES = tuple(suffix for _, suffix in ENCODINGS)
+
+
+def precompress(path: Path) -> bool:
+    target = path.with_name(path.name + ".gz")
+    if target.exists() and target.stat().st_mtime >= path.stat().st_mtime:
+        return False
+    tmp = target.with_name(f".{target.name}.part")
+    with open(path, "rb") as src, gzip.open(tmp, "wb", compresslevel=9) as dst:
+        shutil.copyfileobj(src, dst)
+    os.replace(tmp, target)
+    return True
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--dry-run", action="store_true", help="only list the files")
+    args = parser.parse_args()
+
+    written = 0
+    for path in STATIC_DIR.rglob("*"):
+        if not path.is_file() or path.name.startswith(".") or path.name.endswith(SIBLING_SUFFIXES):
+            continue
+        media_type = guess_type(path.name)[0] or ""
+        if not media_type.startswith(COMPRESSIBLE_TYPES):
+            continue
+        if args.dry_run:
+            print(path)
+        elif precompress(path):
+            written += 1
+    if not args.dry_run:
+        print(f"Wrote {written} gzip files")
+
+
+if __name__ == "__main__":
+    main()
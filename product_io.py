@@ -0,0 +1,276 @@
+import csv
+import io
+import json
+import logging
+import os
+import zipfile
+from datetime import datetime
+from itertools import islice
+from pathlib import Path
+from typing import AsyncIterator, BinaryIO, Dict, Iterator, List, Optional, Tuple
+
+import orjson
+from dotenv import load_dotenv
+from fastapi import HTTPException, UploadFile
+from fastapi.concurrency import run_in_threadpool
+from pydantic import ValidationError
+from sqlmodel import Field, SQLModel, insert, select
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from blobstore import held, release_images, store_stream
+from cache import invalidate_category
+from category_stats import Counted, update_categories
+from derivatives import derivative_queue
+from models import Product, ProductCategory
+from search import search_index
+from uploads import MAX_UPLOAD_BYTES, StoredFile
+
+load_dotenv()
+
+IMPORT_BATCH_SIZE = int(os.getenv("IMPORT_BATCH_SIZE", "1000"))
+# Every failed row is counted; only this many are described in the report.
+IMPORT_MAX_ERRORS = int(os.getenv("IMPORT_MAX_ERRORS", "1000"))
+EXPORT_BATCH_SIZE = int(os.getenv("EXPORT_BATCH_SIZE", "1000"))
+
+FORMATS = {"csv": "text/csv", "ndjson": "application/x-ndjson"}
+EXPORT_COLUMNS = [
+    "id", "name", "description", "price", "stock_quantity", "is_active",
+    "category_id", "image_path", "created_at", "updated_at",
+]
+
+logger = logging.getLogger(__name__)
+
+
+class ProductImportRow(SQLModel):
+    name: str = Field(min_length=1)
+    description: Optional[str] = None
+    price: float = Field(ge=0)
+    stock_quantity: int = Field(ge=0)
+    is_active: bool = True
+    category_id: int
+    # File name inside the uploaded images archive
+    image: Optional[str] = None
+
+
+def import_format(filename: Optional[str], requested: Optional[str]) -> str:
+    if requested:
+        return requested
+    suffix = Path(filename or "").suffix.lower()
+    if suffix == ".csv":
+        return "csv"
+    if suffix in (".ndjson", ".jsonl"):
+        return "ndjson"
+    raise HTTPException(status_code=400, detail="Cannot tell the file format; pass format=csv or format=ndjson.")
+
+
+def read_records(source: BinaryIO, fmt: str) -> Iterator[Tuple[int, object]]:
+    """
+    Yield (line number, record dict) pairs one at a time from a CSV or
+    NDJSON file, so only the current row is ever in memory. A line that
+    cannot be parsed yields an error message instead of a dict.
+    """
+    text = io.TextIOWrapper(source, encoding="utf-8-sig", newline="")
+    if fmt == "csv":
+        reader = csv.DictReader(text)
+        for record in reader:
+            # Empty cells mean "not given"; cells beyond the header are dropped
+            yield reader.line_num, {
+                key: value for key, value in record.items() if key and value not in ("", None)
+            }
+        return
+
+    for line_number, line in enumerate(text, 1):
+        if not line.strip():
+            continue
+        try:
+            record = json.loads(line)
+        except ValueError as exc:
+            yield line_number, f"invalid JSON: {exc}"
+            continue
+        yield line_number, record if isinstance(record, dict) else "expected a JSON object"
+
+
+def _validation_message(exc: ValidationError) -> str:
+    return "; ".join(
+        f"{'.'.join(str(part) for part in error['loc'])}: {error['msg']}" for error in exc.errors()
+    )
+
+
+def _store_archive_image(archive: zipfile.ZipFile, name: str) -> StoredFile:
+    info = archive.getinfo(name)
+    if info.file_size > MAX_UPLOAD_BYTES:
+        raise ValueError(f"larger than {MAX_UPLOAD_BYTES} bytes")
+    with archive.open(info) as member:
+        return store_stream(member, name)
+
+
+class ImportReport:
+    def __init__(self):
+        self.imported = 0
+        self.failed = 0
+        self.errors: List[dict] = []
+
+    def error(self, line: int, message: str) -> None:
+        self.failed += 1
+        if len(self.errors) < IMPORT_MAX_ERRORS:
+            self.errors.append({"line": line, "error": message})
+
+    def as_dict(self) -> dict:
+        return {"imported": self.imported, "failed": self.failed, "errors": self.errors}
+
+
+async def import_products(
+    session: AsyncSession,
+    user,
+    file: UploadFile,
+    fmt: str,
+    images: Optional[UploadFile] = None,
+) -> dict:
+    """
+    Import products into categories owned by `user`.
+
+    Rows are read and validated IMPORT_BATCH_SIZE at a time; each batch's
+    valid rows go in with one multi-row INSERT and one commit. Bad rows are
+    reported by line number and skipped, and a batch that fails to insert
+    only fails its own rows. `images` is an optional zip archive; a row's
+    `image` names a file in it, which is added to the blob store once no
+    matter how many rows use it.
+    """
+    owned = set((await session.exec(
+        select(ProductCategory.id).where(ProductCategory.user_id == user.id)
+    )).all())
+
+    archive = None
+    if images is not None:
+        try:
+            archive = await run_in_threadpool(zipfile.ZipFile, images.file)
+        except zipfile.BadZipFile:
+            raise HTTPException(status_code=400, detail="images must be a zip archive")
+
+    records = read_records(file.file, fmt)
+    stored_images: Dict[str, str] = {}
+    report = ImportReport()
+
+    while batch := await run_in_threadpool(lambda: list(islice(records, IMPORT_BATCH_SIZE))):
+        lines, values, new_images, new_blobs = [], [], set(), []
+        now = datetime.now()
+        for line, record in batch:
+            if isinstance(record, str):
+                report.error(line, record)
+                continue
+            try:
+                row = ProductImportRow.model_validate(record)
+            except ValidationError as exc:
+                report.error(line, _validation_message(exc))
+                continue
+            if row.category_id not in owned:
+                report.error(line, f"category {row.category_id} not found or not yours")
+                continue
+
+            image_path = None
+            if row.image:
+                if archive is None:
+                    report.error(line, "image given but no images archive uploaded")
+                    continue
+                if row.image not in stored_images:
+                    try:
+                        stored = await run_in_threadpool(_store_archive_image, archive, row.image)
+                    except KeyError:
+                        report.error(line, f"image {row.image!r} is not in the archive")
+                        continue
+                    except (ValueError, zipfile.BadZipFile) as exc:
+                        report.error(line, f"image {row.image!r}: {exc}")
+                        continue
+                    stored_images[row.image] = str(stored.path)
+                    new_blobs.append(stored)
+                image_path = stored_images[row.image]
+                new_images.add(image_path)
+
+            lines.append(line)
+            values.append({
+                **row.model_dump(exclude={"image"}),
+                "image_path": image_path,
+                "created_at": now,
+                "updated_at": now,
+            })
+
+        if not values:
+            continue
+        category_ids = {value["category_id"] for value in values}
+        try:
+            # Row order does not matter here; keeping it would cost one
+            # INSERT per row on SQLite
+            async with held(*new_blobs):
+                ids = (await session.exec(insert(Product).returning(Product.id), params=values)).scalars().all()
+                await search_index.update(session, *ids)
+                await update_categories(session, added=[
+                    Counted(v["category_id"], v["is_active"], v["stock_quantity"] > 0, v["price"]) for v in values
+                ])
+                await session.commit()
+        except Exception as exc:
+            logger.exception("Import batch of %d rows failed", len(values))
+            await session.rollback()
+            for line in lines:
+                report.error(line, f"batch insert failed: {exc.__class__.__name__}")
+            # Blobs only this batch used are gone now; store them again if needed
+            await release_images(session, *new_images)
+            stored_images = {name: path for name, path in stored_images.items() if path not in new_images}
+            continue
+
+        report.imported += len(ids)
+        derivative_queue.submit(*new_images)
+        for category_id in category_ids:
+            invalidate_category(category_id, [user.id])
+
+    return report.as_dict()
+
+
+# ----------------------------------------------------------
+# Export
+# ----------------------------------------------------------
+def _csv_value(value):
+    # Written the way the importer reads them back
+    if value is None:
+        return ""
+    if isinstance(value, bool):
+        return "true" if value else "false"
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return value
+
+
+def _encode_csv(rows, header: bool = False) -> bytes:
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    if header:
+        writer.writerow(EXPORT_COLUMNS)
+    for row in rows:
+        writer.writerow(_csv_value(value) for value in row)
+    return buffer.getvalue().encode()
+
+
+def _encode_ndjson(rows) -> bytes:
+    return b"".join(orjson.dumps(dict(row._mapping)) + b"\n" for row in rows)
+
+
+async def export_products(session_factory, fmt: str, conditions=()) -> AsyncIterator[bytes]:
+    """
+    Stream the matching products as CSV or NDJSON, EXPORT_BATCH_SIZE rows
+    at a time, paging on the primary key. Each batch uses a short-lived
+    session, so a slow client never holds a connection between batches.
+    """
+    columns = [getattr(Product, name) for name in EXPORT_COLUMNS]
+    if fmt == "csv":
+        yield _encode_csv([], header=True)
+
+    last_id = None
+    while True:
+        query = select(*columns).where(*conditions).order_by(Product.id).limit(EXPORT_BATCH_SIZE)
+        if last_id is not None:
+            query = query.where(Product.id > last_id)
+        async with session_factory() as session:
+            rows = (await session.exec(query)).all()
+        if not rows:
+            return
+        yield _encode_csv(rows) if fmt == "csv" else _encode_ndjson(rows)
+        last_id = rows[-1].id
@@ -0,0 +1,61 @@
+from fastapi import APIRouter, Depends, HTTPException
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from cache import cache_stats
+from database import get_session, pool_status
+from derivatives import derivative_queue
+from hashing import password_hasher
+from outbox import outbox_stats
+from search import search_index
+from static_files import static_stats
+from .auth import get_current_user
+
+router = APIRouter(prefix="/admin", tags=["admin"])
+
+
+def require_admin(user=Depends(get_current_user)):
+    if not user.is_admin:
+        raise HTTPException(status_code=403, detail="Admin access required")
+    return user
+
+
+@router.get("/cache", response_model=dict)
+def read_cache_stats(user=Depends(require_admin)):
+    """Hit/miss/eviction counters of the catalog cache in this worker."""
+    return cache_stats()
+
+
+@router.get("/db", response_model=dict)
+def read_pool_stats(user=Depends(require_admin)):
+    """Connection pool occupancy and checkout wait times in this worker."""
+    return pool_status()
+
+
+@router.get("/hashing", response_model=dict)
+def read_hashing_stats(user=Depends(require_admin)):
+    """Password hashing pool occupancy and admission rejections."""
+    return password_hasher.stats()
+
+
+@router.get("/derivatives", response_model=dict)
+def read_derivative_stats(user=Depends(require_admin)):
+    """Image variant job queue: pending, completed and failed jobs."""
+    return derivative_queue.stats()
+
+
+@router.get("/outbox", response_model=dict)
+async def read_outbox_stats(session: AsyncSession = Depends(get_session), user=Depends(require_admin)):
+    """Outbox events by status and the age of the oldest pending one."""
+    return await outbox_stats(session)
+
+
+@router.get("/search", response_model=dict)
+def read_search_stats(user=Depends(require_admin)):
+    """Which search index is in use and, for the in-memory one, its size."""
+    return search_index.stats()
+
+
+@router.get("/static", response_model=dict)
+def read_static_stats(user=Depends(require_admin)):
+    """Static file responses by status, and bytes sent vs. saved by caching."""
+    return static_stats.as_dict()
@@ -1,50 +1,65 @@
 from fastapi import APIRouter, Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
-from sqlmodel import Session, select
+from sqlmodel import SQLModel, select
 from datetime import datetime
 from database import get_session
-from models import User
-from utils import verify_password, hash_password, create_access_token, decode_token
+from models import User, UserRead
+from cache import principal_cache, principal_key
+from hashing import password_hasher
+from utils import create_access_token, decode_token
 from sqlmodel.ext.asyncio.session import AsyncSession
 from jose import JWTError
+import logging
+
+logger = logging.getLogger(__name__)
 
 router = APIRouter(prefix="/auth", tags=["auth"])
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/auth/login")
 
 
-@router.post("/register", response_model=User)
-def register_user(user: User, session: Session = Depends(get_session)):
-    existing_user = session.exec(select(User).where(User.email == user.email)).first()
-    existing_username = session.exec(select(User).where(User.username == user.username)).first()
+@router.post("/register", response_model=UserRead)
+async def register_user(user: User, session: AsyncSession = Depends(get_session)):
+    existing_user = (await session.exec(select(User).where(User.email == user.email))).first()
+    existing_username = (await session.exec(select(User).where(User.username == user.username))).first()
     if existing_username:
         raise HTTPException(status_code=400, detail="Username already registered")
     if existing_user:
         raise HTTPException(status_code=400, detail="Email already registered")
-    user.password = hash_password(user.password)
+    user.password = await password_hasher.hash(user.password)
     session.add(user)
-    session.commit()
-    session.refresh(user)
+    await session.commit()
+    await session.refresh(user)
     return user
 
 
 @router.post("/login")
-def login(form_data: OAuth2PasswordRequestForm = Depends(), session: Session = Depends(get_session)):
-    user = session.exec(select(User).where(User.username == form_data.username)).first()
-    print(user)
-    if not user or not verify_password(form_data.password, user.password):
+async def login(form_data: OAuth2PasswordRequestForm = Depends(), session: AsyncSession = Depends(get_session)):
+    user = (await session.exec(select(User).where(User.username == form_data.username))).first()
+    if not user:
         raise HTTPException(status_code=401, detail="Invalid credentials")
-    token = create_access_token({"sub": str(user.id)})
+    valid, new_hash = await password_hasher.verify_and_update(form_data.password, user.password)
+    if not valid:
+        logger.info("Failed login for username %r", form_data.username)
+        raise HTTPException(status_code=401, detail="Invalid credentials")
+    token = create_access_token({
+        "sub": str(user.id),
+        "username": user.username,
+        "is_admin": user.is_admin,
+    })
+    if new_hash:
+        # Stored hash used an older work factor
+        user.password = new_hash
     user.last_login_at = datetime.now()
-    session.commit()
+    await session.commit()
     return {"access_token": token, "token_type": "bearer","userrole":user.is_admin}
 
 
 
 @router.get("/checktoken")
-def check_token(
+async def check_token(
     token: str = Depends(oauth2_scheme),
-    session: Session = Depends(get_session),
+    session: AsyncSession = Depends(get_session),
 ):
     try:
         payload = decode_token(token)
@@ -55,7 +70,7 @@ def check_token(
     if not user_id:
         raise HTTPException(status_code=401, detail="Invalid token payload")
 
-    user = session.get(User, int(user_id))
+    user = await session.get(User, int(user_id))
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
 
@@ -63,12 +78,45 @@ def check_token(
 
 
 
-def get_current_user(token: str = Depends(oauth2_scheme), session: Session = Depends(get_session)):
+async def load_user(payload: dict, session: AsyncSession) -> User:
+    """
+    Resolve a token's user through the principal cache. The result is a
+    detached copy: read it, but load the row from the session to change it.
+    """
+    user_id = int(payload["sub"])
+    key = principal_key(user_id, payload.get("jti", ""))
+    data = principal_cache.get(key)
+    if data is None:
+        user = await session.get(User, user_id)
+        if not user:
+            raise HTTPException(status_code=404, detail="User not found")
+        data = user.model_dump()
+        principal_cache.set(key, data)
+    return User.model_validate(data)
+
+
+async def get_current_user(token: str = Depends(oauth2_scheme), session: AsyncSession = Depends(get_session)):
     payload = decode_token(token)
     if not payload:
         raise HTTPException(status_code=401, detail="Invalid token")
-    user = session.get(User, int(payload["sub"]))
-    if not user:
-        raise HTTPException(status_code=404, detail="User not found")
-    return user
+    return await load_user(payload, session)
+
+
+class Principal(SQLModel):
+    id: int
+    username: str
+    is_admin: bool = False
+
 
+async def get_current_principal(token: str = Depends(oauth2_scheme), session: AsyncSession = Depends(get_session)):
+    """
+    `get_current_user` for read-only routes, narrowed to what they need.
+    Identity and role come from the principal cache, never the token's
+    claims: those hold for the token's whole lifetime, but a demotion has to
+    apply as soon as update_user invalidates the cache.
+    """
+    payload = decode_token(token)
+    if not payload:
+        raise HTTPException(status_code=401, detail="Invalid token")
+    user = await load_user(payload, session)
+    return Principal(id=user.id, username=user.username, is_admin=user.is_admin)
@@ -1,135 +1,110 @@
-from fastapi import APIRouter, Depends, HTTPException, Request
-from sqlmodel import Session, select
+from fastapi import APIRouter, Depends, Header, HTTPException, Request
+from sqlmodel import select
+from sqlmodel.ext.asyncio.session import AsyncSession
 from models import CartItem, Product, User, Order
 from .auth import get_current_user
 from datetime import datetime
-from database import get_session
+from typing import Optional
+from database import async_session, get_session
+from inventory import add_reservation, invalidate_stock, release_cart_items, reserve_stock
+from idempotency import IDEMPOTENCY_HEADER, idempotent
+from loaders import cart_with_products
 import logging
 router = APIRouter(prefix="/cart", tags=["Cart"])
 
 
 @router.post("/add")
-def add_to_cart(
+async def add_to_cart(
     request: dict = {
         "product_id": int,
         "quantity": int
     },
-    session: Session = Depends(get_session),
+    idempotency_key: Optional[str] = Header(None, alias=IDEMPOTENCY_HEADER, max_length=255),
+    session: AsyncSession = Depends(get_session),
     current_user: User = Depends(get_current_user)
 ):
-    product_id = request['product_id']
-    quantity = request['quantity']
-
-    # Check if product exists
-    product = session.get(Product, product_id)
-    if not product:
-        raise HTTPException(status_code=404, detail="Product not found")
-
-    # Validate stock
-    if quantity > product.stock_quantity:
-        raise HTTPException(
-            status_code=400,
-            detail=f"Only {product.stock_quantity} units available in stock. Maximum quantity allowed is {product.stock_quantity}."
-        )
-
-    # Check if cart item already exists
-    existing_item = session.exec(
-        select(CartItem)
-        .where(CartItem.user_id == current_user.id)
-        .where(CartItem.product_id == product_id)
-    ).first()
-
-    if existing_item:
-        new_quantity = existing_item.quantity + quantity
-        print(new_quantity, product.stock_quantity)
-        if new_quantity > product.stock_quantity:
+    """
+    Reserve stock and add it to the cart. Send an Idempotency-Key header to
+    make retries safe: a repeated key returns the first response instead of
+    reserving again.
+    """
+    async with idempotent(async_session, current_user.id, "POST /cart/add", idempotency_key, request) as idem:
+        if idem.replay is not None:
+            return idem.replay
+
+        product_id = request['product_id']
+        quantity = request['quantity']
+        if not isinstance(quantity, int) or quantity < 1:
+            raise HTTPException(status_code=400, detail="Quantity must be a positive integer.")
+
+        # Reserve stock and upsert the cart row in one transaction; the
+        # conditional decrement is what guards against overselling.
+        category_id = await reserve_stock(session, product_id, quantity)
+        if category_id is None:
+            await session.rollback()
+            product = await session.get(Product, product_id)
+            if not product:
+                raise HTTPException(status_code=404, detail="Product not found")
             raise HTTPException(
                 status_code=400,
-                detail=f"Cannot add more than {product.stock_quantity} units to cart. Current quantity in cart is {existing_item.quantity}. Maximum allowed is {product.stock_quantity - existing_item.quantity}."
+                detail=f"Only {product.stock_quantity} units available in stock. Maximum quantity allowed is {product.stock_quantity}."
             )
-        existing_item.quantity = new_quantity
-        existing_item.updated_at = datetime.now()
-        session.add(existing_item)
-    else:
-        new_item = CartItem(
-            user_id=current_user.id,
-            product_id=product_id,
-            quantity=quantity,
-        )
-        session.add(new_item)
-
-    session.commit()
-    session.refresh(existing_item or new_item)  # ✅ fixed line
 
-    # Reduce stock in Product table
-    product = session.get(Product, product_id)
-    product.stock_quantity -= quantity
-    session.add(product)
+        await add_reservation(session, current_user.id, product_id, quantity)
+        product_name = (await session.exec(select(Product.name).where(Product.id == product_id))).one()
+        response = {
+            "message": f"{product_name} added to cart successfully.",
+        }
+        await idem.complete(session, response)
+        await session.commit()
+        await invalidate_stock(session, {product_id: category_id})
 
-    session.commit()
-    session.refresh(product)
-
-    return {
-        "message": f"{product.name} added to cart successfully.",
-    }
+        return response
 
 
 
 @router.get("/items/")
-def get_cart_items(
-    session: Session = Depends(get_session),
+async def get_cart_items(
+    session: AsyncSession = Depends(get_session),
     current_user: User = Depends(get_current_user)
 ):
-    items = session.exec(
-        select(CartItem).where(CartItem.user_id == current_user.id)
-    ).all()
-
     # Attach product details for richer response
     response = []
-    for item in items:
-        product = session.get(Product, item.product_id)
-        if product:
-            response.append({
-                "cart_item_id": item.id,
-                "product_id": product.id,
-                "product_name": product.name,
-                "price": product.price,
-                "quantity": item.quantity,
-                "subtotal": product.price * item.quantity,
-                "image_path": product.image_path,
-                "stock_quantity": product.stock_quantity,
-            })
+    for item, product in await cart_with_products(session, current_user.id):
+        response.append({
+            "cart_item_id": item.id,
+            "product_id": product.id,
+            "product_name": product.name,
+            "price": product.price,
+            "quantity": item.quantity,
+            "subtotal": product.price * item.quantity,
+            "image_path": product.image_path,
+            "stock_quantity": product.stock_quantity,
+        })
     return response
 
 
 @router.delete("/remove/{cart_item_id}")
-def remove_from_cart(cart_item_id: int, session: Session = Depends(get_session)):
-    cart_item = session.get(CartItem, cart_item_id)
-    if not cart_item:
+async def remove_from_cart(cart_item_id: int, session: AsyncSession = Depends(get_session)):
+    released = await release_cart_items(
+        session, CartItem.id == cart_item_id, CartItem.in_order == False
+    )
+    if not released:
         raise HTTPException(status_code=404, detail="Cart item not found")
-    # Add stock back to Product table
-    product = session.get(Product, cart_item.product_id)
-    product.stock_quantity += cart_item.quantity
-    session.add(product)
-
-    session.delete(cart_item)
-    session.commit()
+    await session.commit()
+    await invalidate_stock(session, released)
     return {"message": "Item removed from cart"}
 
 
 @router.delete("/clear/{user_id}")
-def clear_cart(user_id: int, session: Session = Depends(get_session)):
+async def clear_cart(user_id: int, session: AsyncSession = Depends(get_session)):
     """Convenience endpoint to clear all cart items for a user."""
-    items = session.exec(select(CartItem).where(CartItem.user_id == user_id)).all()
-    if not items:
+    released = await release_cart_items(
+        session, CartItem.user_id == user_id, CartItem.in_order == False
+    )
+    if not released:
         raise HTTPException(status_code=404, detail="Cart is already empty")
 
-    for item in items:
-        # Add stock back to Product table
-        product = session.get(Product, item.product_id)
-        product.stock_quantity += item.quantity
-        session.add(product)
-        session.delete(item)
-
-    session.commit()
+    await session.commit()
+    await invalidate_stock(session, released)
     return {"message": "Cart cleared successfully"}
@@ -1,83 +1,121 @@
 from models import ProductCategory
 from .auth import get_current_user
 from fastapi import APIRouter, Depends, HTTPException
-from sqlmodel import Session, delete, select
+from sqlmodel import delete, select
+from sqlmodel.ext.asyncio.session import AsyncSession
 from typing import List
 
+from cache import (
+    cached, categories_key, category_key, invalidate_category, invalidate_products,
+    viewer_key,
+)
+from blobstore import release_images
 from database import get_session
-from models import ProductCategory, Product
-from .auth import get_current_user
+from search import search_index
+from models import CategoryStats, CategorySummary, ProductCategory, Product
+from .auth import get_current_principal, get_current_user
 
 router = APIRouter(prefix="/categories", tags=["categories"])
 
 
 @router.post("/", response_model=ProductCategory)
-def create_category(
+async def create_category(
     category: ProductCategory,
-    session: Session = Depends(get_session),
+    session: AsyncSession = Depends(get_session),
     user=Depends(get_current_user)
 ):
     category.user_id = user.id 
     session.add(category)
-    session.commit()
-    session.refresh(category)
+    await session.commit()
+    await session.refresh(category)
+    invalidate_category(category.id, [user.id])
     return category
 
 
-@router.get("/", response_model=List[ProductCategory])
-def list_categories(session: Session = Depends(get_session), user=Depends(get_current_user)):
-    if not user.is_admin:
-        subquery = select(Product.id).where(Product.category_id == ProductCategory.id)
+@router.get("/", response_model=List[CategorySummary])
+async def list_categories(session: AsyncSession = Depends(get_session), user=Depends(get_current_principal)):
+    """
+    Categories with their product counts and price range. Shoppers see
+    every category that has products, admins see their own.
+    """
+    async def load():
+        query = select(ProductCategory, CategoryStats).order_by(ProductCategory.name, ProductCategory.id)
+        if not user.is_admin:
+            query = query.join(CategoryStats, CategoryStats.category_id == ProductCategory.id).where(
+                CategoryStats.product_count > 0
+            )
+        else:
+            query = query.outerjoin(CategoryStats, CategoryStats.category_id == ProductCategory.id).where(
+                ProductCategory.user_id == user.id
+            )
+        rows = (await session.exec(query)).all()
+        return [
+            {
+                **category.model_dump(mode="json"),
+                **(stats.model_dump(mode="json", exclude={"category_id"}) if stats else {}),
+            }
+            for category, stats in rows
+        ]
 
-        categories = session.exec(
-            select(ProductCategory).where(subquery.exists()).order_by(ProductCategory.name)
-        ).all()
-    else:
-        categories = session.exec(select(ProductCategory).where(ProductCategory.user_id == user.id).order_by(ProductCategory.name)).all()
-    return categories
+    categories = await cached(categories_key(viewer_key(user)), load)
+    return [CategorySummary.model_validate(c) for c in categories]
 
 @router.get("/{category_id}", response_model=ProductCategory)
-def read_category(
+async def read_category(
     category_id: int,
-    session: Session = Depends(get_session),
-    user=Depends(get_current_user)
+    session: AsyncSession = Depends(get_session),
+    user=Depends(get_current_principal)
 ):
-    category = session.get(ProductCategory, category_id)
+    async def load():
+        category = await session.get(ProductCategory, category_id)
+        return category.model_dump(mode="json") if category else None
+
+    category = await cached(category_key(category_id), load)
     if not category:
         raise HTTPException(status_code=404, detail="Category not found")
-    return category
+    return ProductCategory.model_validate(category)
 
 @router.put("/{category_id}", response_model=ProductCategory)
-def update_category(
+async def update_category(
     category_id: int,
     category_update: ProductCategory,
-    session: Session = Depends(get_session),
+    session: AsyncSession = Depends(get_session),
     user=Depends(get_current_user)
 ):
-    category = session.get(ProductCategory, category_id)
+    category = await session.get(ProductCategory, category_id)
     if not category:
         raise HTTPException(status_code=404, detail="Category not found")
+    old_owner_id = category.user_id
     category_update_data = category_update.dict(exclude_unset=True)
     for key, value in category_update_data.items():
         setattr(category, key, value)
     session.add(category)
-    session.commit()
-    session.refresh(category)
+    await session.commit()
+    await session.refresh(category)
+    invalidate_category(category_id, [old_owner_id, category.user_id])
     return category
 
 @router.delete("/{category_id}", response_model=ProductCategory)
-def delete_category(
+async def delete_category(
     category_id: int,
-    session: Session = Depends(get_session),
+    session: AsyncSession = Depends(get_session),
     user=Depends(get_current_user)
 ):
-    product = session.exec(select(Product).where(Product.category_id == category_id)).first()
-    if product:
-        session.exec(delete(Product).where(Product.category_id == category_id))
+    products = (await session.exec(
+        select(Product.id, Product.image_path).where(Product.category_id == category_id)
+    )).all()
+    product_ids = [p.id for p in products]
+    if product_ids:
+        await session.exec(delete(Product).where(Product.category_id == category_id))
     
-    category = session.get(ProductCategory, category_id)
+    category = await session.get(ProductCategory, category_id)
     if not category:
         raise HTTPException(status_code=404, detail="Category not found")
-    session.delete(category)
-    session.commit()
+    await session.exec(delete(CategoryStats).where(CategoryStats.category_id == category_id))
+    await session.delete(category)
+    await search_index.remove(session, *product_ids)
+    await session.commit()
+    invalidate_products(*product_ids)
+    invalidate_category(category_id, [category.user_id])
+    await release_images(session, *(p.image_path for p in products))
     return category
\ No newline at end of file
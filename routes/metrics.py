@@ -0,0 +1,24 @@
+import os
+import secrets
+from typing import Optional
+
+from dotenv import load_dotenv
+from fastapi import APIRouter, Header, HTTPException
+from fastapi.responses import PlainTextResponse
+
+from metrics import render_metrics
+
+load_dotenv()
+
+# Scrapers usually cannot log in; if set, /metrics wants this bearer token
+METRICS_TOKEN = os.getenv("METRICS_TOKEN")
+
+router = APIRouter(tags=["metrics"])
+
+
+@router.get("/metrics", response_class=PlainTextResponse, include_in_schema=False)
+def read_metrics(authorization: Optional[str] = Header(None)):
+    """Request, phase and SQL histograms of this worker, for Prometheus."""
+    if METRICS_TOKEN and not secrets.compare_digest(authorization or "", f"Bearer {METRICS_TOKEN}"):
+        raise HTTPException(status_code=401, detail="Invalid metrics token")
+    return PlainTextResponse(render_metrics(), media_type="text/plain; version=0.0.4")
@@ -1,113 +1,205 @@
-from fastapi import APIRouter, HTTPException, Depends,Request
-from sqlmodel import Session
-from models import Order, CartItem
-from database import get_session
+from fastapi import APIRouter, HTTPException, Depends, Header, Query, Request
+from sqlmodel.ext.asyncio.session import AsyncSession
+from models import Order, OrderPage, OrderRead, CartItem, Product
+from database import async_session, get_session
 from .auth import get_current_user
-from sqlmodel import select
-from typing import List
+from sqlmodel import insert, select, update
+from typing import Optional
+from datetime import datetime
+from idempotency import IDEMPOTENCY_HEADER, idempotent
+from loaders import load_order_products
+from pagination import DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE, keyset_paginate, page_response
+from serialization import ORJSONResponse, dump_rows, read_columns
+from outbox import enqueue
 import logging
 logger = logging.getLogger(__name__)
-router = APIRouter(prefix="/orders")
-
-
-
 router = APIRouter(prefix="/orders", tags=["Orders"])
-# {'items': [{'product_id': 1, 'quantity': 3, 'price': 308.74}], 'address': 'hello', 'is_paid': False}
+# {'items': [{'product_id': 1, 'quantity': 3}], 'address': 'hello', 'is_paid': False}
 @router.post("/create")
 async def create_order(
     request: Request,
-    session: Session = Depends(get_session),
+    idempotency_key: Optional[str] = Header(None, alias=IDEMPOTENCY_HEADER, max_length=255),
+    session: AsyncSession = Depends(get_session),
     user=Depends(get_current_user)
 ):
-    try:
-        data = await request.json()
-        print("Received data:", data)
-
-        items = data.get("items", [])
-        address = data.get("address")
-        is_paid = data.get("is_paid", False)
-
-        if not items or not address:
-            raise HTTPException(status_code=400, detail="Items and address are required.")
-
-        created_orders = []
-
-        for item in items:
-            # Validate fields
-            if "product_id" not in item or "quantity" not in item or "price" not in item:
-                raise HTTPException(status_code=400, detail="Each item must include product_id, quantity, and price.")
-
-            # Find cart item by user + product
-            cart_item = session.exec(
-                select(CartItem).where(
+    """
+    Turn cart items into orders. With an Idempotency-Key header, a retried
+    checkout returns the orders created the first time instead of failing
+    on the now-ordered cart.
+    """
+    body = await request.body()
+    async with idempotent(async_session, user.id, "POST /orders/create", idempotency_key, body) as idem:
+        if idem.replay is not None:
+            return idem.replay
+
+        try:
+            data = await request.json()
+            logger.debug("Creating order for user %s with %d item(s)", user.id, len(data.get("items", [])))
+
+            items = data.get("items", [])
+            address = data.get("address")
+            is_paid = data.get("is_paid", False)
+
+            if not items or not address:
+                raise HTTPException(status_code=400, detail="Items and address are required.")
+
+            product_ids = []
+            for item in items:
+                # Validate fields
+                if "product_id" not in item:
+                    raise HTTPException(status_code=400, detail="Each item must include product_id.")
+                if item["product_id"] not in product_ids:
+                    product_ids.append(item["product_id"])
+
+            # All active cart items for the requested products, with their
+            # products, in one query
+            rows = (await session.exec(
+                select(CartItem, Product)
+                .join(Product, CartItem.product_id == Product.id)
+                .where(
                     CartItem.user_id == user.id,
-                    CartItem.product_id == item["product_id"],
-                    CartItem.in_order == True
-                )
-            ).first()
-
-            if not cart_item:
-                raise HTTPException(
-                    status_code=404,
-                    detail=f"No active cart item found for product_id {item['product_id']}."
+                    CartItem.product_id.in_(product_ids),
+                    CartItem.in_order == False,
                 )
+            )).all()
+            cart = {cart_item.product_id: (cart_item, product) for cart_item, product in rows}
+
+            for product_id in product_ids:
+                if product_id not in cart:
+                    raise HTTPException(
+                        status_code=404,
+                        detail=f"No active cart item found for product_id {product_id}."
+                    )
+
+            # Totals come from the reserved cart quantity and the stored price;
+            # client-supplied prices are ignored.
+            new_orders = [
+                Order(
+                    user_id=user.id,
+                    cart_id=cart_item.id,
+                    total_price=cart_item.quantity * product.price,
+                    address=address,
+                    is_paid=is_paid,
+                ).model_dump(exclude={"id"})
+                for cart_item, product in (cart[product_id] for product_id in product_ids)
+            ]
+            # One multi-row INSERT ... RETURNING. Rows may come back in any
+            # order (asking SQLAlchemy to keep it costs one INSERT per row on
+            # SQLite), so they are matched back by their cart item
+            returned = (await session.exec(
+                insert(Order).returning(Order.id, Order.cart_id, Order.total_price),
+                params=new_orders,
+            )).all()
+            by_cart = {o.cart_id: o for o in returned}
+            created_orders = [by_cart[order["cart_id"]] for order in new_orders]
 
             # Mark as ordered
-            cart_item.in_order = True
-            session.add(cart_item)
-
-            # Create order linked to that cart item
-            order = Order(
-                user_id=user.id,
-                cart_id=cart_item.id,
-                total_price=item["quantity"] * item["price"],
-                address=address,
-                is_paid=is_paid,
+            await session.exec(
+                update(CartItem)
+                .where(CartItem.id.in_([cart[product_id][0].id for product_id in product_ids]))
+                .values(in_order=True)
             )
-            session.add(order)
-            session.flush()
-            created_orders.append(order)
-
-        # ✅ Commit once at the end
-        session.commit()
-
-        return {
-            "message": "Order(s) placed successfully",
-            "orders": [
-                {
-                    "order_id": o.id,
-                    "total_price": o.total_price
-                }
-                for o in created_orders
-            ],
-        }
 
-    except HTTPException:
-        raise
-    except Exception as e:
-        session.rollback()
-        print("Order creation failed:", e)
-        raise HTTPException(status_code=500, detail="Order creation failed.")
+            # Follow-up work is done by outbox_worker.py, not in this request;
+            # the events commit (or roll back) together with the orders
+            await enqueue(session, "order.created", [
+                (
+                    f"order.created:{o.id}",
+                    {"order_id": o.id, "user_id": user.id, "total_price": float(o.total_price), "is_paid": is_paid},
+                )
+                for o in created_orders
+            ])
+
+            response = {
+                "message": "Order(s) placed successfully",
+                "orders": [
+                    {
+                        "order_id": o.id,
+                        "total_price": float(o.total_price)
+                    }
+                    for o in created_orders
+                ],
+            }
+            await idem.complete(session, response)
+            await session.commit()
+            return response
+
+        except HTTPException:
+            raise
+        except Exception:
+            logger.exception("Order creation failed for user %s", user.id)
+            await session.rollback()
+            raise HTTPException(status_code=500, detail="Order creation failed.")
 
 
 @router.get("/", response_model=Order)
-def get_order_details(
+async def get_order_details(
     order_id: int,
-    session: Session = Depends(get_session),
+    session: AsyncSession = Depends(get_session),
     user=Depends(get_current_user)
 ):
-    order = session.exec(select(Order).where(Order.user_id == user.id)).first()
+    order = (await session.exec(
+        select(Order).where(Order.id == order_id, Order.user_id == user.id)
+    )).first()
     if not order:
         raise HTTPException(status_code=404, detail="Order not found")
     return order
 
 
-@router.get("/all", response_model=List[Order])
-def get_all_orders(
-    session: Session = Depends(get_session),
+# Newest first; the key ix_order_user_date_id is sorted by
+ORDER_SORT = (Order.order_date, Order.id)
+
+
+@router.get("/all", response_model=OrderPage)
+async def get_all_orders(
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    cursor: Optional[str] = Query(None),
+    since: Optional[datetime] = Query(None, description="Orders placed at or after this time"),
+    until: Optional[datetime] = Query(None, description="Orders placed before this time"),
+    is_paid: Optional[bool] = Query(None),
+    include_products: bool = Query(False, description="Embed each order's product and quantity"),
+    session: AsyncSession = Depends(get_session),
     user=Depends(get_current_user)
 ):
-    orders = session.exec(select(Order).where(Order.user_id == user.id)).all()
-    return orders
+    """
+    Return one page of your orders, newest first, plus a `next_cursor` for
+    the following page.
+
+    Pass `next_cursor` back unchanged (with the same filters) to continue;
+    it is `null` on the last page.
+    """
+    conditions = [Order.user_id == user.id]
+    if since is not None:
+        conditions.append(Order.order_date >= since)
+    if until is not None:
+        conditions.append(Order.order_date < until)
+    if is_paid is not None:
+        conditions.append(Order.is_paid == is_paid)
+
+    # Find the page's ids in the index alone, then read just those rows
+    page_ids = keyset_paginate(
+        select(Order.id).where(*conditions), ORDER_SORT, cursor, limit, descending=True
+    ).subquery()
+    rows = (await session.exec(
+        select(*read_columns(Order, OrderRead))
+        .join(page_ids, Order.id == page_ids.c.id)
+        .order_by(*(column.desc() for column in ORDER_SORT))
+    )).all()
+    page = page_response(rows, ORDER_SORT, limit)
+    page["items"] = dump_rows(OrderRead, page["items"])
+
+    if include_products:
+        # One query for the whole page
+        loaded = await load_order_products(session, (order["cart_id"] for order in page["items"]))
+        for order in page["items"]:
+            item, product = loaded.get(order["cart_id"], (None, None))
+            order["product"] = product and {
+                "product_id": product.id,
+                "name": product.name,
+                "price": product.price,
+                "image_path": product.image_path,
+                "quantity": item.quantity,
+            }
+    return ORJSONResponse(page)
 
 
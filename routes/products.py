@@ -1,35 +1,84 @@
 from fastapi import (
-    APIRouter, Depends, HTTPException, UploadFile, File, Form, Request, Path
+    APIRouter, Depends, HTTPException, UploadFile, File, Form, Request, Path, Query
 )
-from sqlmodel import Session, select
-from typing import List
-from pathlib import Path as FilePath
-import shutil
+from sqlmodel import select
+from sqlmodel.ext.asyncio.session import AsyncSession
+from typing import List, Optional
 from datetime import datetime
 import logging
 import os
 
-from database import get_session
-from models import Product, ProductCategory, User
-from .auth import get_current_user
+from database import async_session, get_session
+from fastapi.responses import StreamingResponse
+
+from models import Product, ProductCategory, ProductPage, ProductRead, SearchPage, User
+from category_stats import counted, update_categories
+from cache import (
+    cached, category_products_key, invalidate_category, invalidate_products,
+    product_key, viewer_key,
+)
+from pagination import DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE, keyset_paginate, page_response
+from blobstore import held, release_images, store_upload
+from derivatives import derivative_queue
+from loaders import load_products
+from product_io import FORMATS, export_products, import_format, import_products
+from search import facets, page_hits, search_index, tokenize
+from serialization import ORJSONResponse, dump_rows
+from .admin import require_admin
+from .auth import get_current_principal, get_current_user
 
 router = APIRouter(prefix="/products", tags=["products"])
 
-# Base upload directory
-UPLOAD_DIR = FilePath("static/images")
-UPLOAD_DIR.mkdir(parents=True, exist_ok=True)
+logger = logging.getLogger(__name__)
 
 
-logging.basicConfig(
-    level=logging.DEBUG,
-    format="%(asctime)s [%(levelname)s] %(filename)s:%(lineno)d - %(message)s"
-)
+# ----------------------------------------------------------
+# Bulk import / export
+# ----------------------------------------------------------
+# Declared before the /{category_id} routes so the paths are not taken for
+# category ids.
+@router.post("/import", response_model=dict)
+async def import_products_file(
+    file: UploadFile = File(...),
+    images: UploadFile = File(None),
+    format: Optional[str] = Query(None, pattern="^(csv|ndjson)$"),
+    session: AsyncSession = Depends(get_session),
+    user=Depends(require_admin),
+):
+    """
+    Create products from a CSV (with a header row) or NDJSON file with the
+    fields name, description, price, stock_quantity, is_active, category_id
+    and optionally image, a file name inside the `images` zip archive.
+
+    Returns how many rows were imported, how many failed and why.
+    """
+    fmt = import_format(file.filename, format)
+    return await import_products(session, user, file, fmt, images)
+
+
+@router.get("/export")
+async def export_products_file(
+    format: str = Query("csv", pattern="^(csv|ndjson)$"),
+    category_id: Optional[int] = Query(None),
+    user=Depends(require_admin),
+):
+    """Stream every product in your categories as CSV or NDJSON."""
+    owned = select(ProductCategory.id).where(ProductCategory.user_id == user.id)
+    conditions = [Product.category_id.in_(owned)]
+    if category_id is not None:
+        conditions.append(Product.category_id == category_id)
+    return StreamingResponse(
+        export_products(async_session, format, conditions),
+        media_type=FORMATS[format],
+        headers={"Content-Disposition": f'attachment; filename="products.{format}"'},
+    )
+
 
 # ----------------------------------------------------------
 # Create Product (with image upload)
 # ----------------------------------------------------------
 @router.post("/{category_id}", response_model=dict)
-def create_product(
+async def create_product(
     category_id: int = Path(...),
     name: str = Form(...),
     description: str = Form(None),
@@ -37,15 +86,15 @@ def create_product(
     stock_quantity: int = Form(...),
     is_active: bool = Form(True),
     file: UploadFile = File(None),
-    session: Session = Depends(get_session),
+    session: AsyncSession = Depends(get_session),
     user=Depends(get_current_user),
 ):
     """Create a product under a given category, optionally uploading an image."""
 
     # Ensure the category exists
-    category = session.exec(
+    category = (await session.exec(
         select(ProductCategory).where(ProductCategory.id == category_id)
-    ).first()
+    )).first()
     if not category:
         raise HTTPException(status_code=404, detail="Category not found")
 
@@ -60,25 +109,24 @@ def create_product(
         created_at=datetime.now(),
         updated_at=datetime.now(),
     )
-    session.add(product)
-    session.commit()
-    session.refresh(product)
-
-    # Create directory for this user/category
-    category_folder = category.name.lower().replace(" ", "_")
-    user_dir = UPLOAD_DIR / user.username / category_folder
-    user_dir.mkdir(parents=True, exist_ok=True)
-
-    # Handle image upload
+    # Handle image upload (stored by content, so repeats cost no space)
+    stored = None
     if file:
-        file_path = user_dir / f"{product.id}_{file.filename}"
-        with file_path.open("wb") as buffer:
-            shutil.copyfileobj(file.file, buffer)
+        stored = await store_upload(file)
+        product.image_path = str(stored.path)
 
-        product.image_path = str(file_path)
+    async with held(stored):
         session.add(product)
-        session.commit()
-        session.refresh(product)
+        await session.flush()
+        await search_index.update(session, product.id)
+        await update_categories(session, added=[counted(product)])
+        await session.commit()
+    await session.refresh(product)
+
+    invalidate_products(product.id)
+    invalidate_category(category_id, [category.user_id])
+    # Thumbnails etc. are generated in the background
+    derivative_queue.submit(product.image_path)
 
     return {
         "message": "Product created successfully",
@@ -88,58 +136,155 @@ def create_product(
 
 
 # ----------------------------------------------------------
-# List all products
+# List products (keyset paginated, filterable)
 # ----------------------------------------------------------
-@router.get("/list", response_model=List[Product])
-def list_products(
-    session: Session = Depends(get_session),
-    user=Depends(get_current_user)
+# Sort name -> (sort key columns, descending). Every key ends with the
+# primary key so the cursor identifies exactly one row.
+PRODUCT_SORTS = {
+    "id": ((Product.id,), False),
+    "-id": ((Product.id,), True),
+    "price": ((Product.price, Product.id), False),
+    "-price": ((Product.price, Product.id), True),
+    "created_at": ((Product.created_at, Product.id), False),
+    "-created_at": ((Product.created_at, Product.id), True),
+    "name": ((Product.name, Product.id), False),
+    "-name": ((Product.name, Product.id), True),
+}
+
+
+def product_filters(category_id, min_price, max_price, is_active, in_stock) -> list:
+    """WHERE conditions shared by the catalog listing and search."""
+    conditions = []
+    if category_id is not None:
+        conditions.append(Product.category_id == category_id)
+    if min_price is not None:
+        conditions.append(Product.price >= min_price)
+    if max_price is not None:
+        conditions.append(Product.price <= max_price)
+    if is_active is not None:
+        conditions.append(Product.is_active == is_active)
+    if in_stock is True:
+        conditions.append(Product.stock_quantity > 0)
+    elif in_stock is False:
+        conditions.append(Product.stock_quantity <= 0)
+    return conditions
+
+
+@router.get("/list", response_model=ProductPage)
+async def list_products(
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    cursor: Optional[str] = Query(None),
+    sort: str = Query("id", pattern="^-?(id|price|created_at|name)$"),
+    category_id: Optional[int] = Query(None),
+    min_price: Optional[float] = Query(None, ge=0),
+    max_price: Optional[float] = Query(None, ge=0),
+    is_active: Optional[bool] = Query(None),
+    in_stock: Optional[bool] = Query(None),
+    session: AsyncSession = Depends(get_session),
+    user=Depends(get_current_principal)
 ):
-    return session.exec(select(Product)).all()
+    """
+    Return one page of products plus a `next_cursor` for the following page.
+
+    Pass `next_cursor` back unchanged (with the same sort and filters) to
+    continue; it is `null` on the last page.
+    """
+    columns, descending = PRODUCT_SORTS[sort]
+
+    query = select(Product).where(
+        *product_filters(category_id, min_price, max_price, is_active, in_stock)
+    )
+    query = keyset_paginate(query, columns, cursor, limit, descending)
+    page = page_response((await session.exec(query)).all(), columns, limit)
+    page["items"] = dump_rows(ProductRead, page["items"])
+    return ORJSONResponse(page)
+
+
+# ----------------------------------------------------------
+# Search products (full text over name and description)
+# ----------------------------------------------------------
+@router.get("/search", response_model=SearchPage)
+async def search_products(
+    q: str = Query(..., min_length=1, max_length=200),
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    cursor: Optional[str] = Query(None),
+    category_id: Optional[int] = Query(None),
+    min_price: Optional[float] = Query(None, ge=0),
+    max_price: Optional[float] = Query(None, ge=0),
+    is_active: Optional[bool] = Query(None),
+    in_stock: Optional[bool] = Query(None),
+    session: AsyncSession = Depends(get_session),
+    user=Depends(get_current_principal)
+):
+    """
+    Products matching every word of `q` (the last one as a prefix), best
+    match first, with match counts per category and price range.
+
+    Takes the same filters as `/products/list`; page with `next_cursor`.
+    """
+    conditions = product_filters(category_id, min_price, max_price, is_active, in_stock)
+    hits = await search_index.search(session, tokenize(q), conditions)
+    page, next_cursor = page_hits(hits, cursor, limit)
+    products = await load_products(session, (hit.id for hit in page))
+    return ORJSONResponse({
+        "items": dump_rows(ProductRead, (products[hit.id] for hit in page if hit.id in products)),
+        "next_cursor": next_cursor,
+        "total": len(hits),
+        "facets": facets(hits),
+    })
 
 
 # ----------------------------------------------------------
 # Get product details by product_id
 # ----------------------------------------------------------
 @router.get("/details/{product_id}", response_model=Product)
-def get_product_details_by_id(
+async def get_product_details_by_id(
     product_id: int,
-    session: Session = Depends(get_session),
-    user=Depends(get_current_user)
+    session: AsyncSession = Depends(get_session),
+    user=Depends(get_current_principal)
 ):
-    product = session.get(Product, product_id)
+    async def load():
+        product = await session.get(Product, product_id)
+        return product.model_dump(mode="json") if product else None
+
+    product = await cached(product_key(product_id), load)
     if not product:
         raise HTTPException(status_code=404, detail="Product not found")
-    return product
+    # Cached entries are JSON data; table models are not validated on
+    # output, so rebuild them to get typed fields back.
+    return Product.model_validate(product)
 
 
 # ----------------------------------------------------------
 # List products by category
 # ----------------------------------------------------------
-@router.get("/{category_id}", response_model=List[Product])
-def get_products_by_category(
+@router.get("/{category_id}", response_model=List[ProductRead])
+async def get_products_by_category(
     category_id: int,
-    session: Session = Depends(get_session),
-    user=Depends(get_current_user)
+    session: AsyncSession = Depends(get_session),
+    user=Depends(get_current_principal)
 ):
-    query = (
-        select(Product)
-        .join(ProductCategory, Product.category_id == ProductCategory.id)
-        .where(ProductCategory.id == category_id)
-    )
+    async def load():
+        query = (
+            select(Product)
+            .join(ProductCategory, Product.category_id == ProductCategory.id)
+            .where(ProductCategory.id == category_id)
+        )
 
-    if user.is_admin:
-        query = query.where(ProductCategory.user_id == user.id)
+        if user.is_admin:
+            query = query.where(ProductCategory.user_id == user.id)
 
-    products = session.exec(query).all()
-    return products
+        return [p.model_dump(mode="json") for p in (await session.exec(query)).all()]
+
+    # Cached entries are already JSON data in the ProductRead shape
+    return ORJSONResponse(await cached(category_products_key(category_id, viewer_key(user)), load))
 
 
 # ----------------------------------------------------------
 # Update Product
 # ----------------------------------------------------------
 @router.put("/update/{product_id}", response_model=Product)
-def update_product(
+async def update_product(
     product_id: int,
     name: str = Form(None),
     description: str = Form(None),
@@ -148,16 +293,19 @@ def update_product(
     is_active: bool = Form(None),
     category_id: int = Form(None),
     file: UploadFile = File(None),
-    session: Session = Depends(get_session),
+    session: AsyncSession = Depends(get_session),
     user=Depends(get_current_user)
 ):
-    db_product = session.get(Product, product_id)
+    db_product = await session.get(Product, product_id)
     if not db_product:
         raise HTTPException(status_code=404, detail="Product not found")
 
     # Check ownership
-    if db_product.category.user_id != user.id:
+    category = await session.get(ProductCategory, db_product.category_id)
+    if category.user_id != user.id:
         raise HTTPException(status_code=403, detail="Not authorized")
+    old_category_id = db_product.category_id
+    before = counted(db_product)
 
     # Update fields
     if name is not None:
@@ -174,28 +322,34 @@ def update_product(
         db_product.category_id = category_id
 
     # Replace image
+    old_image_path = db_product.image_path
+    stored = None
     if file:
-        if db_product.image_path:
-            old_path = Path(db_product.image_path)
-            if old_path.exists():
-                try:
-                    old_path.unlink()
-                except Exception as e:
-                    logging.warning(f"Failed to delete old image: {e}")
-
-        user_dir = UPLOAD_DIR / user.username
-        user_dir.mkdir(parents=True, exist_ok=True)
-        new_path = user_dir / f"{db_product.id}_{file.filename}"
-
-        with new_path.open("wb") as buffer:
-            shutil.copyfileobj(file.file, buffer)
-
-        db_product.image_path = str(new_path)
+        stored = await store_upload(file)
+        db_product.image_path = str(stored.path)
 
     db_product.updated_at = datetime.now()
-    session.add(db_product)
-    session.commit()
-    session.refresh(db_product)
+    async with held(stored):
+        session.add(db_product)
+        if name is not None or description is not None:
+            await search_index.update(session, db_product.id)
+        after = counted(db_product)
+        if after != before:
+            await update_categories(session, removed=[before], added=[after])
+        await session.commit()
+    await session.refresh(db_product)
+
+    # Only drop the old file once the new one is committed, and only if no
+    # other product still shares it
+    if old_image_path != db_product.image_path:
+        await release_images(session, old_image_path)
+        derivative_queue.submit(db_product.image_path)
+
+    invalidate_products(db_product.id)
+    invalidate_category(old_category_id, [user.id])
+    if db_product.category_id != old_category_id:
+        new_category = await session.get(ProductCategory, db_product.category_id)
+        invalidate_category(db_product.category_id, [new_category.user_id if new_category else None])
     return db_product
 
 
@@ -203,26 +357,25 @@ def update_product(
 # Delete Product
 # ----------------------------------------------------------
 @router.delete("/{product_id}", response_model=dict)
-def delete_product(
+async def delete_product(
     product_id: int,
-    session: Session = Depends(get_session),
+    session: AsyncSession = Depends(get_session),
     user=Depends(get_current_user)
 ):
-    db_product = session.get(Product, product_id)
+    db_product = await session.get(Product, product_id)
     if not db_product:
         raise HTTPException(status_code=404, detail="Product not found")
 
-    if db_product.category.user_id != user.id:
+    category = await session.get(ProductCategory, db_product.category_id)
+    if category.user_id != user.id:
         raise HTTPException(status_code=403, detail="Not authorized")
 
-    if db_product.image_path:
-        old_path = Path(db_product.image_path)
-        if old_path.exists():
-            try:
-                old_path.unlink()
-            except Exception as e:
-                logging.warning(f"Failed to delete old image: {e}")
+    await session.delete(db_product)
+    await search_index.remove(session, product_id)
+    await update_categories(session, removed=[counted(db_product)])
+    await session.commit()
+    await release_images(session, db_product.image_path)
 
-    session.delete(db_product)
-    session.commit()
+    invalidate_products(product_id)
+    invalidate_category(db_product.category_id, [user.id])
     return {"message": "Product deleted successfully"}
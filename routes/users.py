@@ -1,35 +1,40 @@
 from fastapi import APIRouter, Depends, HTTPException
-from sqlmodel import Session, select
+from sqlmodel import select
+from sqlmodel.ext.asyncio.session import AsyncSession
 from typing import List
 
 from database import get_session
-from models import User
+from models import User, UserRead
 from routes.auth import get_current_user
+from cache import invalidate_principal
+from serialization import ORJSONResponse, dump_rows, read_columns
 
 router = APIRouter(prefix="/users", tags=["users"])
 
 
-@router.get("/me", response_model=User)
-def read_current_user(current_user: User = Depends(get_current_user)):
+@router.get("/me", response_model=UserRead)
+async def read_current_user(current_user: User = Depends(get_current_user)):
     return current_user
 
 
-@router.get("/", response_model=List[User])
-def list_users(session: Session = Depends(get_session), user=Depends(get_current_user)):
+@router.get("/", response_model=List[UserRead])
+async def list_users(session: AsyncSession = Depends(get_session), user=Depends(get_current_user)):
     if not user.is_admin:
         raise HTTPException(status_code=403, detail="Admin access required")
-    return session.exec(select(User)).all()
+    # Only the columns that go out; password hashes never leave the database
+    rows = (await session.exec(select(*read_columns(User, UserRead)))).all()
+    return ORJSONResponse(dump_rows(UserRead, rows))
 
 
-@router.put("/{user_id}", response_model=User)
-def update_user(
+@router.put("/{user_id}", response_model=UserRead)
+async def update_user(
     user_id: int,
     user_update: User,
-    session: Session = Depends(get_session),
+    session: AsyncSession = Depends(get_session),
     current_user: User = Depends(get_current_user)
 ):
     
-    user = session.get(User, user_id)
+    user = await session.get(User, user_id)
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
 
@@ -42,6 +47,7 @@ def update_user(
         setattr(user, key, value)
 
     session.add(user)
-    session.commit()
-    session.refresh(user)
+    await session.commit()
+    await session.refresh(user)
+    invalidate_principal(user.id)
     return user
@@ -0,0 +1,359 @@
+import bisect
+import logging
+import math
+import os
+import re
+import threading
+import unicodedata
+from collections import Counter
+from typing import Dict, Iterable, List, NamedTuple, Optional, Sequence
+
+from dotenv import load_dotenv
+from sqlalchemy import bindparam, column, func, literal_column, table, text
+from sqlmodel import select
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from models import Product
+from pagination import decode_cursor, encode_cursor
+
+load_dotenv()
+
+# "auto" uses SQLite FTS5 when the database has it, "memory" forces the
+# in-process inverted index (e.g. on other databases). The in-memory index
+# only sees writes made by its own process, so it is for single-worker
+# deployments; startup refuses it when WEB_CONCURRENCY asks for more.
+SEARCH_BACKEND = os.getenv("SEARCH_BACKEND", "auto")
+WEB_CONCURRENCY = int(os.getenv("WEB_CONCURRENCY", "1"))
+# Ranking, facets and paging work on at most this many best matches.
+SEARCH_MAX_RESULTS = int(os.getenv("SEARCH_MAX_RESULTS", "1000"))
+# Upper bounds of the price facet buckets; the last bucket is open-ended.
+SEARCH_PRICE_BUCKETS = [
+    float(edge) for edge in os.getenv("SEARCH_PRICE_BUCKETS", "10,25,50,100,250,500").split(",")
+]
+
+# A match in the name counts this many times more than one in the description.
+NAME_WEIGHT = 10.0
+DESCRIPTION_WEIGHT = 1.0
+# BM25 parameters, the same defaults FTS5 uses.
+BM25_K1 = 1.2
+BM25_B = 0.75
+# SQLite caps the number of bound parameters per statement.
+ID_CHUNK_SIZE = 500
+
+FTS_TABLE = "product_fts"
+
+logger = logging.getLogger(__name__)
+
+
+def create_fts_table(connection) -> bool:
+    """
+    Create and fill the FTS5 table unless it exists (run by the migrations).
+    False when this SQLite build has no FTS5.
+    """
+    available = connection.exec_driver_sql(
+        "SELECT sqlite_compileoption_used('ENABLE_FTS5')"
+    ).scalar()
+    if not available:
+        return False
+    exists = connection.exec_driver_sql(
+        "SELECT 1 FROM sqlite_master WHERE name = ?", (FTS_TABLE,)
+    ).first()
+    if not exists:
+        connection.exec_driver_sql(
+            f"CREATE VIRTUAL TABLE {FTS_TABLE} USING fts5("
+            "name, description, tokenize = 'unicode61 remove_diacritics 2', prefix = '2 3')"
+        )
+        connection.exec_driver_sql(
+            f"INSERT INTO {FTS_TABLE} (rowid, name, description) "
+            "SELECT id, name, coalesce(description, '') FROM product"
+        )
+    return True
+
+
+class SearchHit(NamedTuple):
+    """One ranked match. Lower `rank` is better, as with FTS5's bm25()."""
+    id: int
+    rank: float
+    category_id: int
+    price: float
+
+
+def tokenize(value: Optional[str]) -> List[str]:
+    """Lower-cased words with accents stripped, like FTS5's unicode61 tokenizer."""
+    if not value:
+        return []
+    folded = unicodedata.normalize("NFKD", value.lower())
+    folded = "".join(c for c in folded if not unicodedata.combining(c))
+    return re.findall(r"\w+", folded)
+
+
+def fts_query(terms: Sequence[str]) -> str:
+    """
+    Every term must match; the last one also matches as a prefix, so
+    results keep up while the user is still typing. Terms are quoted, which
+    keeps FTS5 query syntax out of user input.
+    """
+    quoted = [f'"{term}"' for term in terms]
+    quoted[-1] += "*"
+    return " ".join(quoted)
+
+
+def _chunks(ids: Sequence[int]) -> Iterable[Sequence[int]]:
+    for start in range(0, len(ids), ID_CHUNK_SIZE):
+        yield ids[start:start + ID_CHUNK_SIZE]
+
+
+# ----------------------------------------------------------
+# In-memory inverted index (fallback)
+# ----------------------------------------------------------
+class InvertedIndex:
+    """
+    term -> {product id: weighted term frequency}, plus a sorted term list
+    for prefix lookups. Only text lives here; filters are applied against
+    the database, so stock and price are never stale.
+    """
+
+    def __init__(self):
+        self.postings: Dict[str, Dict[int, float]] = {}
+        self.lengths: Dict[int, float] = {}
+        self.doc_terms: Dict[int, List[str]] = {}
+        self.terms: List[str] = []
+        self._total_length = 0.0
+        self._lock = threading.Lock()
+
+    def add(self, product_id: int, name: Optional[str], description: Optional[str]) -> None:
+        frequencies = Counter()
+        for term in tokenize(name):
+            frequencies[term] += NAME_WEIGHT
+        for term in tokenize(description):
+            frequencies[term] += DESCRIPTION_WEIGHT
+        with self._lock:
+            self._discard(product_id)
+            for term, frequency in frequencies.items():
+                if term not in self.postings:
+                    self.postings[term] = {}
+                    bisect.insort(self.terms, term)
+                self.postings[term][product_id] = frequency
+            length = sum(frequencies.values())
+            self.lengths[product_id] = length
+            self.doc_terms[product_id] = list(frequencies)
+            self._total_length += length
+
+    def remove(self, product_id: int) -> None:
+        with self._lock:
+            self._discard(product_id)
+
+    def _discard(self, product_id: int) -> None:
+        length = self.lengths.pop(product_id, None)
+        if length is None:
+            return
+        self._total_length -= length
+        for term in self.doc_terms.pop(product_id):
+            docs = self.postings[term]
+            del docs[product_id]
+            if not docs:
+                del self.postings[term]
+                del self.terms[bisect.bisect_left(self.terms, term)]
+
+    def _expand(self, prefix: str) -> List[str]:
+        start = bisect.bisect_left(self.terms, prefix)
+        end = bisect.bisect_left(self.terms, prefix + "\uffff")
+        return self.terms[start:end]
+
+    def match(self, terms: Sequence[str]) -> Dict[int, float]:
+        """Product id -> rank (negated BM25) for products matching every term."""
+        with self._lock:
+            count = len(self.lengths)
+            if not count:
+                return {}
+            average = self._total_length / count or 1.0
+            scores: Optional[Dict[int, float]] = None
+            for position, term in enumerate(terms):
+                expansions = self._expand(term) if position == len(terms) - 1 else [term]
+                term_scores: Dict[int, float] = {}
+                for expansion in expansions:
+                    docs = self.postings.get(expansion, {})
+                    idf = math.log(1 + (count - len(docs) + 0.5) / (len(docs) + 0.5))
+                    for product_id, frequency in docs.items():
+                        norm = BM25_K1 * (1 - BM25_B + BM25_B * self.lengths[product_id] / average)
+                        term_scores[product_id] = term_scores.get(product_id, 0.0) + (
+                            idf * frequency * (BM25_K1 + 1) / (frequency + norm)
+                        )
+                if scores is None:
+                    scores = term_scores
+                else:
+                    scores = {
+                        pid: score + term_scores[pid] for pid, score in scores.items() if pid in term_scores
+                    }
+                if not scores:
+                    return {}
+        return {pid: -score for pid, score in scores.items()}
+
+    def __len__(self) -> int:
+        return len(self.lengths)
+
+
+# ----------------------------------------------------------
+# Search index
+# ----------------------------------------------------------
+class SearchIndex:
+    """
+    Full-text index over Product.name and Product.description.
+
+    Backed by the FTS5 table (`product_fts`, rowid = product id) that the
+    migrations create on SQLite builds that have FTS5, otherwise by an
+    InvertedIndex in this process. Product writes call `update`/`remove`
+    with the session they write through; with FTS5 that lands in the same
+    transaction.
+    """
+
+    def __init__(self):
+        self.fts5 = False
+        self.memory = InvertedIndex()
+
+    @property
+    def backend(self) -> str:
+        return "fts5" if self.fts5 else "memory"
+
+    async def setup(self, engine) -> None:
+        """Pick the backend; the in-memory one is built from the products here."""
+        if SEARCH_BACKEND != "memory" and engine.dialect.name == "sqlite":
+            async with engine.connect() as connection:
+                self.fts5 = (await connection.execute(
+                    text("SELECT 1 FROM sqlite_master WHERE name = :name"), {"name": FTS_TABLE}
+                )).first() is not None
+        if not self.fts5:
+            if WEB_CONCURRENCY > 1:
+                raise RuntimeError(
+                    f"The in-memory search index cannot serve {WEB_CONCURRENCY} workers: "
+                    "writes in one would never reach the others. Use SQLite with FTS5 "
+                    "or run a single worker."
+                )
+            async with engine.connect() as connection:
+                rows = await connection.execute(
+                    select(Product.id, Product.name, Product.description)
+                )
+                for row in rows:
+                    self.memory.add(row.id, row.name, row.description)
+        logger.info("Product search uses the %s index", self.backend)
+
+    async def update(self, session: AsyncSession, *product_ids: int) -> None:
+        """(Re)index products as they are in `session`; call before committing."""
+        ids = sorted(set(filter(None, product_ids)))
+        if not ids:
+            return
+        # Pending changes have to reach the database before they are read back
+        await session.flush()
+        if self.fts5:
+            ids_param = bindparam("ids", expanding=True)
+            for chunk in _chunks(ids):
+                await session.exec(
+                    text(f"DELETE FROM {FTS_TABLE} WHERE rowid IN :ids").bindparams(ids_param),
+                    params={"ids": list(chunk)},
+                )
+                await session.exec(
+                    text(
+                        f"INSERT INTO {FTS_TABLE} (rowid, name, description) "
+                        "SELECT id, name, coalesce(description, '') FROM product WHERE id IN :ids"
+                    ).bindparams(ids_param),
+                    params={"ids": list(chunk)},
+                )
+            return
+        for chunk in _chunks(ids):
+            rows = (await session.exec(
+                select(Product.id, Product.name, Product.description).where(Product.id.in_(chunk))
+            )).all()
+            for row in rows:
+                self.memory.add(row.id, row.name, row.description)
+
+    async def remove(self, session: AsyncSession, *product_ids: int) -> None:
+        ids = sorted(set(filter(None, product_ids)))
+        if self.fts5:
+            for chunk in _chunks(ids):
+                await session.exec(
+                    text(f"DELETE FROM {FTS_TABLE} WHERE rowid IN :ids").bindparams(
+                        bindparam("ids", expanding=True)
+                    ),
+                    params={"ids": list(chunk)},
+                )
+            return
+        for product_id in ids:
+            self.memory.remove(product_id)
+
+    async def search(self, session: AsyncSession, terms: Sequence[str], conditions=()) -> List[SearchHit]:
+        """
+        The best SEARCH_MAX_RESULTS products matching `terms` and the SQL
+        filter `conditions`, ordered by (rank, id).
+        """
+        if not terms:
+            return []
+        if self.fts5:
+            fts = table(FTS_TABLE, column("rowid"))
+            rank = func.bm25(literal_column(FTS_TABLE), NAME_WEIGHT, DESCRIPTION_WEIGHT).label("rank")
+            query = (
+                select(Product.id, rank, Product.category_id, Product.price)
+                .select_from(fts)
+                .join(Product, Product.id == fts.c.rowid)
+                .where(literal_column(FTS_TABLE).op("MATCH")(fts_query(terms)), *conditions)
+                .order_by(rank, Product.id)
+                .limit(SEARCH_MAX_RESULTS)
+            )
+            return [SearchHit(*row) for row in (await session.exec(query)).all()]
+
+        ranks = self.memory.match(terms)
+        hits = []
+        for chunk in _chunks(sorted(ranks)):
+            rows = (await session.exec(
+                select(Product.id, Product.category_id, Product.price)
+                .where(Product.id.in_(chunk), *conditions)
+            )).all()
+            hits.extend(SearchHit(row.id, ranks[row.id], row.category_id, row.price) for row in rows)
+        hits.sort(key=lambda hit: (hit.rank, hit.id))
+        return hits[:SEARCH_MAX_RESULTS]
+
+    def stats(self) -> dict:
+        stats = {"backend": self.backend, "max_results": SEARCH_MAX_RESULTS}
+        if not self.fts5:
+            stats.update(documents=len(self.memory), terms=len(self.memory.terms))
+        return stats
+
+
+search_index = SearchIndex()
+
+
+# ----------------------------------------------------------
+# Results
+# ----------------------------------------------------------
+def facets(hits: Sequence[SearchHit]) -> dict:
+    """Match counts per category and per price bucket."""
+    categories = Counter(hit.category_id for hit in hits)
+    buckets = Counter(bisect.bisect_right(SEARCH_PRICE_BUCKETS, hit.price) for hit in hits)
+    edges = [0.0] + SEARCH_PRICE_BUCKETS
+    return {
+        "categories": [
+            {"category_id": category_id, "count": count}
+            for category_id, count in categories.most_common()
+        ],
+        "price": [
+            {
+                "min": edges[index],
+                "max": SEARCH_PRICE_BUCKETS[index] if index < len(SEARCH_PRICE_BUCKETS) else None,
+                "count": buckets[index],
+            }
+            for index in range(len(edges))
+            if buckets[index]
+        ],
+    }
+
+
+def page_hits(hits: Sequence[SearchHit], cursor: Optional[str], limit: int):
+    """Keyset-page ranked hits on (rank, id); returns (page, next_cursor)."""
+    start = 0
+    if cursor:
+        last = tuple(decode_cursor(cursor, (float, int)))
+        start = bisect.bisect_right([(hit.rank, hit.id) for hit in hits], last)
+    page = list(hits[start:start + limit])
+    next_cursor = None
+    if start + limit < len(hits):
+        next_cursor = encode_cursor([page[-1].rank, page[-1].id])
+    return page, next_cursor
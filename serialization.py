@@ -0,0 +1,35 @@
+from typing import Any, Iterable, List, Type
+
+from fastapi.responses import ORJSONResponse as _ORJSONResponse
+from sqlmodel import SQLModel
+
+from metrics import timed
+
+
+class ORJSONResponse(_ORJSONResponse):
+    """fastapi's ORJSONResponse, with encoding counted as the request's serialize time."""
+
+    def render(self, content: Any) -> bytes:
+        with timed("serialize"):
+            return super().render(content)
+
+
+def schema_fields(schema: Type[SQLModel]) -> List[str]:
+    return [*schema.model_fields, *schema.model_computed_fields]
+
+
+def read_columns(table_model: Type[SQLModel], schema: Type[SQLModel]) -> list:
+    """The table columns a read schema needs, for `select(*read_columns(...))`."""
+    return [getattr(table_model, name) for name in schema.model_fields]
+
+
+def dump_rows(schema: Type[SQLModel], rows: Iterable[Any]) -> List[dict]:
+    """
+    Copy a read schema's fields off ORM objects or result rows into plain
+    dicts, for ORJSONResponse. Rows coming from the database are already
+    typed, so unlike `response_model` this skips pydantic validation; the
+    schema only decides which fields go out.
+    """
+    fields = schema_fields(schema)
+    with timed("serialize"):
+        return [{name: getattr(row, name) for name in fields} for row in rows]
@@ -0,0 +1,47 @@
+import os
+
+from dotenv import load_dotenv
+from pydantic import BaseModel, ConfigDict, ValidationError, field_validator
+
+load_dotenv()
+
+
+class Settings(BaseModel):
+    """
+    Settings shared across the app, read from the environment (and .env)
+    once per process. Tunables that belong to a single module (pool sizes,
+    cache TTLs, ...) stay next to the code they tune.
+    """
+    model_config = ConfigDict(frozen=True)
+
+    database_url: str = "sqlite:///database.db"
+    secret_key: str
+    algorithm: str = "HS256"
+    access_token_expire_minutes: int = 60 * 24
+    # Apply pending migrations at startup. Turn off when several workers
+    # start at once and run `python migrate.py` before starting them instead.
+    auto_migrate: bool = True
+
+    @field_validator("access_token_expire_minutes", mode="before")
+    @classmethod
+    def _minutes(cls, value):
+        # Older .env files spell this as a product, e.g. "60 * 24"
+        if isinstance(value, str) and "*" in value:
+            minutes = 1
+            for factor in value.split("*"):
+                minutes *= int(factor)
+            return minutes
+        return value
+
+    @classmethod
+    def from_env(cls) -> "Settings":
+        values = {
+            name: os.environ[name.upper()] for name in cls.model_fields if name.upper() in os.environ
+        }
+        try:
+            return cls(**values)
+        except ValidationError as exc:
+            raise RuntimeError(f"Invalid settings in the environment:\n{exc}") from None
+
+
+settings = Settings.from_env()
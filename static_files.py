@@ -0,0 +1,184 @@
+import os
+import re
+import threading
+from mimetypes import guess_type
+from pathlib import Path
+
+from dotenv import load_dotenv
+from starlette.concurrency import run_in_threadpool
+from starlette.datastructures import Headers
+from starlette.exceptions import HTTPException
+from starlette.responses import FileResponse, RedirectResponse, Response
+from starlette.staticfiles import NotModifiedResponse, StaticFiles
+
+from derivatives import original_image
+
+load_dotenv()
+
+# Files whose name carries their content hash never change, so clients and
+# CDNs may keep them for a year without asking again. Everything else gets
+# a short max-age and is revalidated with its ETag afterwards.
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+STATIC_MAX_AGE = int(os.getenv("STATIC_MAX_AGE", "3600"))
+
+# static/images/blobs/ab/<sha256>.<ext> and
+# static/images/variants/blobs/ab/<sha256>_<variant>.<ext>
+CONTENT_HASHED = re.compile(r"(?:^|/)blobs/[0-9a-f]{2}/(?P<tag>[0-9a-f]{64}(?:_[a-z]+)?)\.[^/]+$")
+
+# Precompressed siblings (foo.svg.br, foo.svg.gz), in order of preference.
+# Only worth looking for on types that compress; images are already packed.
+ENCODINGS = (("br", ".br"), ("gzip", ".gz"))
+COMPRESSIBLE_TYPES = ("text/", "application/json", "application/javascript", "image/svg+xml")
+
+
+class StaticStats:
+    """What the static mount sent, and what conditional/range requests saved."""
+
+    def __init__(self):
+        self.requests = 0
+        self.full = 0
+        self.partial = 0
+        self.not_modified = 0
+        self.precompressed = 0
+        self.bytes_served = 0
+        self.bytes_saved = 0
+        self._lock = threading.Lock()
+
+    def record(self, status: int, sent: int, size: int, encoded: bool) -> None:
+        with self._lock:
+            self.requests += 1
+            if status == 304:
+                self.not_modified += 1
+            elif status == 206:
+                self.partial += 1
+            elif status == 200:
+                self.full += 1
+            if encoded:
+                self.precompressed += 1
+            self.bytes_served += sent
+            if status in (200, 206, 304):
+                self.bytes_saved += max(size - sent, 0)
+
+    def as_dict(self) -> dict:
+        return {
+            "requests": self.requests,
+            "full": self.full,
+            "partial": self.partial,
+            "not_modified": self.not_modified,
+            "precompressed": self.precompressed,
+            "bytes_served": self.bytes_served,
+            "bytes_saved": self.bytes_saved,
+        }
+
+
+static_stats = StaticStats()
+
+
+def _accepted_encodings(request_headers: Headers) -> set:
+    accepted = set()
+    for part in request_headers.get("accept-encoding", "").split(","):
+        name, _, params = part.strip().partition(";")
+        if name and params.replace(" ", "") not in ("q=0", "q=0.0"):
+            accepted.add(name.lower())
+    return accepted
+
+
+def _precompressed(full_path: str, request_headers: Headers):
+    """(encoding, path, stat) of the best precompressed sibling the client accepts."""
+    accepted = _accepted_encodings(request_headers)
+    for encoding, suffix in ENCODINGS:
+        if encoding in accepted:
+            try:
+                return encoding, full_path + suffix, os.stat(full_path + suffix)
+            except OSError:
+                continue
+    return None
+
+
+class CachedStaticFiles(StaticFiles):
+    """
+    StaticFiles with a caching policy.
+
+    - Content-hashed paths (image blobs and their variants) get their hash
+      as a strong ETag and an immutable, year-long Cache-Control.
+    - Other files keep Starlette's mtime/size ETag with a short max-age.
+    - If a `.br`/`.gz` sibling exists for a compressible file and the client
+      accepts that encoding, the sibling is served instead.
+    - Range, If-Range, If-None-Match and If-Modified-Since are handled by
+      Starlette's FileResponse/StaticFiles on top of these headers.
+    - An image variant that has not been generated (yet, or at all) is a
+      temporary redirect to the original image.
+
+    Every response is counted in `static_stats`.
+    """
+
+    def file_response(self, full_path, stat_result, scope, status_code: int = 200) -> Response:
+        request_headers = Headers(scope=scope)
+        full_path = str(full_path)
+        media_type = guess_type(full_path)[0] or "text/plain"
+        headers = {}
+        etag_suffix = ""
+        # What a plain, unconditional GET would have sent, for the stats.
+        scope["static_full_size"] = stat_result.st_size
+
+        if media_type.startswith(COMPRESSIBLE_TYPES):
+            headers["vary"] = "Accept-Encoding"
+            match = _precompressed(full_path, request_headers)
+            if match is not None:
+                encoding, full_path, stat_result = match
+                headers["content-encoding"] = encoding
+                etag_suffix = "-" + encoding
+
+        hashed = CONTENT_HASHED.search(scope["path"])
+        if hashed:
+            headers["etag"] = f'"{hashed.group("tag")}{etag_suffix}"'
+            headers["cache-control"] = IMMUTABLE_CACHE_CONTROL
+        else:
+            headers["cache-control"] = f"public, max-age={STATIC_MAX_AGE}"
+
+        response = FileResponse(
+            full_path,
+            status_code=status_code,
+            headers=headers,
+            media_type=media_type,
+            stat_result=stat_result,
+        )
+        if etag_suffix and "etag" not in headers:
+            response.headers["etag"] = response.headers["etag"][:-1] + etag_suffix + '"'
+        if self.is_not_modified(response.headers, request_headers):
+            response = NotModifiedResponse(response.headers)
+        return response
+
+    async def get_response(self, path: str, scope) -> Response:
+        try:
+            return await super().get_response(path, scope)
+        except HTTPException as exc:
+            if exc.status_code != 404:
+                raise
+            original = await run_in_threadpool(original_image, Path(self.directory) / path)
+            if original is None:
+                raise
+        # Not cached, so clients pick the variant up once it exists
+        url = f"{scope.get('root_path', '')}/{original.relative_to(self.directory).as_posix()}"
+        return RedirectResponse(url, status_code=307, headers={"cache-control": "no-cache"})
+
+    async def __call__(self, scope, receive, send) -> None:
+        if scope["type"] != "http":
+            return await super().__call__(scope, receive, send)
+
+        state = {"status": 0, "sent": 0, "encoded": False}
+
+        async def counting_send(message):
+            if message["type"] == "http.response.start":
+                state["status"] = message["status"]
+                state["encoded"] = any(key == b"content-encoding" for key, _ in message.get("headers", []))
+            elif message["type"] == "http.response.body":
+                state["sent"] += len(message.get("body", b""))
+            await send(message)
+
+        scope["static_full_size"] = 0
+        try:
+            await super().__call__(scope, receive, counting_send)
+        finally:
+            full_size = scope["static_full_size"] if scope["method"] == "GET" else 0
+            static_stats.record(state["status"], state["sent"], full_size, state["encoded"])
@@ -0,0 +1,91 @@
+import os
+import sys
+import tempfile
+from contextlib import contextmanager
+from pathlib import Path
+from uuid import uuid4
+
+import pytest
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+# The app binds its engine to DATABASE_URL when first imported, so the whole
+# session shares one throwaway database (and working directory, for uploads)
+WORKDIR = Path(tempfile.mkdtemp(prefix="shop-tests-"))
+os.environ["DATABASE_URL"] = f"sqlite:///{WORKDIR / 'test.db'}"
+os.environ.setdefault("LOG_LEVEL", "WARNING")
+# Fast hashes; the work factor is not what these tests are about
+os.environ.setdefault("BCRYPT_ROUNDS", "4")
+os.chdir(WORKDIR)
+
+PASSWORD = "secret-password"
+CSV_HEADER = "name,description,price,stock_quantity,is_active,category_id\n"
+
+
+@pytest.fixture(scope="session")
+def client():
+    from fastapi.testclient import TestClient
+
+    import main
+
+    with TestClient(main.app) as client:
+        yield client
+
+
+@pytest.fixture
+def count_queries():
+    """`with count_queries() as statements:` collects the SQL run inside the block."""
+    from sqlalchemy import event
+
+    from database import engine
+
+    @contextmanager
+    def counting():
+        statements = []
+
+        def record(conn, cursor, statement, parameters, context, executemany):
+            statements.append(statement)
+
+        event.listen(engine.sync_engine, "before_cursor_execute", record)
+        try:
+            yield statements
+        finally:
+            event.remove(engine.sync_engine, "before_cursor_execute", record)
+
+    return counting
+
+
+@pytest.fixture
+def new_user(client):
+    """Register and log in a fresh user; returns (auth headers, user id)."""
+    def create(is_admin: bool = False):
+        name = f"user{uuid4().hex[:12]}"
+        response = client.post("/auth/register", json={
+            "username": name, "email": f"{name}@example.com", "password": PASSWORD, "is_admin": is_admin,
+        })
+        response.raise_for_status()
+        login = client.post("/auth/login", data={"username": name, "password": PASSWORD})
+        login.raise_for_status()
+        return {"Authorization": f"Bearer {login.json()['access_token']}"}, response.json()["id"]
+    return create
+
+
+@pytest.fixture
+def new_products(client, new_user):
+    """Import `count` products into a new category; returns their ids."""
+    def create(count: int, stock: int = 100):
+        headers, _ = new_user(is_admin=True)
+        category = client.post("/categories/", headers=headers, json={"name": f"Category {uuid4().hex[:8]}"})
+        category.raise_for_status()
+        category_id = category.json()["id"]
+        rows = "".join(f"Item {i},Test item,{i + 1},{stock},true,{category_id}\n" for i in range(count))
+        response = client.post(
+            "/products/import", headers=headers,
+            files={"file": ("products.csv", (CSV_HEADER + rows).encode(), "text/csv")},
+        )
+        response.raise_for_status()
+        assert response.json()["imported"] == count
+        products = client.get(f"/products/{category_id}", headers=headers).json()
+        return sorted(product["id"] for product in products)
+    return create
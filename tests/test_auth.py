@@ -0,0 +1,10 @@
+def test_demoted_admin_loses_admin_views_at_once(client, new_user):
+    admin, admin_id = new_user(is_admin=True)
+    # Empty categories are only listed for their owner's admin view
+    category = client.post("/categories/", headers=admin, json={"name": "Unlisted"}).json()
+    assert category["id"] in {c["id"] for c in client.get("/categories/", headers=admin).json()}
+
+    client.put(f"/users/{admin_id}", headers=admin, json={"is_admin": False}).raise_for_status()
+
+    # Same token, still claiming is_admin
+    assert category["id"] not in {c["id"] for c in client.get("/categories/", headers=admin).json()}
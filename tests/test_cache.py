@@ -0,0 +1,127 @@
+import fnmatch
+import time
+from uuid import uuid4
+
+import pytest
+
+import cache
+from conftest import CSV_HEADER
+
+
+class FakeRedis:
+    """The slice of redis.Redis that RedisCache uses, in a dict."""
+
+    def __init__(self):
+        self.data = {}
+
+    def get(self, key):
+        value, expires_at = self.data.get(key, (None, None))
+        if expires_at is not None and expires_at < time.monotonic():
+            del self.data[key]
+            return None
+        return value
+
+    def set(self, key, value, ex=None):
+        self.data[key] = (value.encode(), time.monotonic() + ex if ex else None)
+
+    def delete(self, *keys):
+        for key in keys:
+            self.data.pop(key, None)
+
+    def scan_iter(self, pattern):
+        return [key for key in list(self.data) if fnmatch.fnmatch(key, pattern)]
+
+
+def import_rows(client, headers, category_id, rows):
+    client.post(
+        "/products/import", headers=headers,
+        files={"file": ("products.csv", (CSV_HEADER + rows).encode(), "text/csv")},
+    ).raise_for_status()
+
+
+@pytest.fixture
+def own_category(client, new_user):
+    """An admin's headers and a category of theirs holding one product."""
+    admin, _ = new_user(is_admin=True)
+    category = client.post("/categories/", headers=admin, json={"name": f"Cached {uuid4().hex[:8]}"})
+    category.raise_for_status()
+    category_id = category.json()["id"]
+    import_rows(client, admin, category_id, f"Cached item,Test item,10,5,true,{category_id}\n")
+    [product] = client.get(f"/products/{category_id}", headers=admin).json()
+    return admin, category_id, product["id"]
+
+
+@pytest.fixture(params=["memory", "redis"])
+def backend(request, monkeypatch):
+    """Run the test against each cache backend, starting empty."""
+    store = cache.MemoryCache() if request.param == "memory" else cache.RedisCache(FakeRedis())
+    monkeypatch.setattr(cache, "cache", store)
+    return store
+
+
+def test_memory_cache_evicts_least_recently_used_and_expired():
+    store = cache.MemoryCache(max_entries=2, ttl=60)
+    store.set("a", 1)
+    store.set("b", 2)
+    assert store.get("a") == 1  # b is now the oldest
+    store.set("c", 3)
+    assert store.get("b") is None
+    assert (store.get("a"), store.get("c")) == (1, 3)
+
+    assert store.stats.evictions == 1
+
+    store.set("short", "lived", ttl=-1)
+    assert store.get("short", "gone") == "gone"
+
+
+def test_redis_cache_round_trips_json_under_its_prefix():
+    client = FakeRedis()
+    store = cache.RedisCache(client, prefix="test:")
+    store.set("k", {"price": 1.5, "tags": ["a"]})
+    assert store.get("k") == {"price": 1.5, "tags": ["a"]}
+    assert list(client.data) == ["test:k"]
+    store.delete("k")
+    assert store.get("k", "missing") == "missing"
+    assert store.stats.as_dict()["hits"] == 1
+
+
+def test_cached_loads_once_and_never_stores_none(client, backend):
+    calls = []
+
+    async def load(value):
+        calls.append(value)
+        return value
+
+    async def lookups():
+        return [
+            await cache.cached("present", lambda: load({"id": 1})),
+            await cache.cached("present", lambda: load({"id": 2})),
+            await cache.cached("absent", lambda: load(None)),
+            await cache.cached("absent", lambda: load(None)),
+        ]
+
+    assert client.portal.call(lookups) == [{"id": 1}, {"id": 1}, None, None]
+    assert calls == [{"id": 1}, None, None]
+
+
+def test_product_reads_are_cached_and_writes_invalidate(client, backend, own_category):
+    admin, category_id, product_id = own_category
+
+    first = client.get(f"/products/details/{product_id}", headers=admin).json()
+    hits = backend.stats.hits
+    assert client.get(f"/products/details/{product_id}", headers=admin).json() == first
+    assert backend.stats.hits == hits + 1
+
+    client.put(f"/products/update/{product_id}", headers=admin, data={"price": "42.5"}).raise_for_status()
+    assert client.get(f"/products/details/{product_id}", headers=admin).json()["price"] == 42.5
+    listed = client.get(f"/products/{category_id}", headers=admin).json()
+    assert [p["price"] for p in listed] == [42.5]
+
+
+def test_a_missing_product_is_found_once_it_is_imported(client, backend, own_category):
+    admin, category_id, product_id = own_category
+    next_id = product_id + 1
+    assert client.get(f"/products/details/{next_id}", headers=admin).status_code == 404
+
+    import_rows(client, admin, category_id, f"Late,Arrival,3,1,true,{category_id}\n")
+    assert client.get(f"/products/details/{next_id}", headers=admin).json()["name"] == "Late"
@@ -0,0 +1,63 @@
+import asyncio
+
+import httpx
+
+
+def send_all(client, requests):
+    """Send every (method, url, kwargs) request to the app at once; returns the responses."""
+    import main
+
+    async def send():
+        transport = httpx.ASGITransport(app=main.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as http:
+            return await asyncio.gather(*(http.request(method, url, **kwargs) for method, url, kwargs in requests))
+
+    return client.portal.call(send)
+
+
+def stock_of(client, headers, product_id):
+    return client.get(f"/products/details/{product_id}", headers=headers).json()["stock_quantity"]
+
+
+def in_carts(client, shoppers, product_id):
+    return sum(
+        item["quantity"]
+        for headers in shoppers
+        for item in client.get("/cart/items/", headers=headers).json()
+        if item["product_id"] == product_id
+    )
+
+
+def test_parallel_adds_never_oversell(client, new_user, new_products):
+    [product_id] = new_products(1, stock=10)
+    shoppers = [new_user()[0] for _ in range(10)]
+
+    responses = send_all(client, [
+        ("POST", "/cart/add", {"headers": headers, "json": {"product_id": product_id, "quantity": 1}})
+        for headers in shoppers
+        for _ in range(4)
+    ])
+
+    statuses = [response.status_code for response in responses]
+    assert statuses.count(200) == 10
+    assert statuses.count(400) == 30
+    assert stock_of(client, shoppers[0], product_id) == 0
+    assert in_carts(client, shoppers, product_id) == 10
+
+
+def test_parallel_adds_and_clears_keep_stock(client, new_user, new_products):
+    [product_id] = new_products(1, stock=50)
+    shoppers = [new_user() for _ in range(5)]
+
+    requests = []
+    for round_ in range(6):
+        for headers, user_id in shoppers:
+            requests.append(("POST", "/cart/add", {"headers": headers, "json": {"product_id": product_id, "quantity": 2}}))
+            if round_ % 2:
+                requests.append(("DELETE", f"/cart/clear/{user_id}", {"headers": headers}))
+    responses = send_all(client, requests)
+
+    assert all(response.status_code in (200, 404) for response in responses)
+    headers = [headers for headers, _ in shoppers]
+    # Every unit is either back in stock or in exactly one open cart
+    assert stock_of(client, headers[0], product_id) + in_carts(client, headers, product_id) == 50
@@ -0,0 +1,25 @@
+def test_cart_query_counts_do_not_grow_with_items(client, new_user, new_products, count_queries):
+    product_ids = new_products(61)
+    listing, clearing = {}, {}
+    start = 0
+    for size in (1, 10, 50):
+        headers, user_id = new_user()
+        items = product_ids[start:start + size]
+        start += size
+        for product_id in items:
+            client.post("/cart/add", headers=headers, json={"product_id": product_id, "quantity": 1}).raise_for_status()
+
+        with count_queries() as statements:
+            response = client.get("/cart/items/", headers=headers)
+        assert response.status_code == 200
+        assert sorted(item["product_id"] for item in response.json()) == items
+        listing[size] = len(statements)
+
+        with count_queries() as statements:
+            response = client.delete(f"/cart/clear/{user_id}", headers=headers)
+        assert response.status_code == 200
+        clearing[size] = len(statements)
+        assert client.get("/cart/items/", headers=headers).json() == []
+
+    assert listing[1] == listing[10] == listing[50], listing
+    assert clearing[1] == clearing[10] == clearing[50], clearing
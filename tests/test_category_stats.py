@@ -0,0 +1,126 @@
+import sqlite3
+from uuid import uuid4
+
+from conftest import CSV_HEADER, WORKDIR
+
+
+def stored(category_id):
+    with sqlite3.connect(WORKDIR / "test.db") as connection:
+        row = connection.execute(
+            "SELECT product_count, active_count, in_stock_count, min_price, max_price "
+            "FROM categorystats WHERE category_id = ?", (category_id,),
+        ).fetchone()
+    return row or (0, 0, 0, None, None)
+
+
+def recomputed(category_id):
+    with sqlite3.connect(WORKDIR / "test.db") as connection:
+        return connection.execute(
+            "SELECT count(*), coalesce(sum(is_active), 0), coalesce(sum(is_active AND stock_quantity > 0), 0), "
+            "min(CASE WHEN is_active THEN price END), max(CASE WHEN is_active THEN price END) "
+            "FROM product WHERE category_id = ?", (category_id,),
+        ).fetchone()
+
+
+def new_category(client, headers):
+    response = client.post("/categories/", headers=headers, json={"name": f"Stats {uuid4().hex[:8]}"})
+    response.raise_for_status()
+    return response.json()["id"]
+
+
+def test_aggregates_follow_every_product_change(client, new_user):
+    admin, _ = new_user(is_admin=True)
+    shopper, shopper_id = new_user()
+    first, second = new_category(client, admin), new_category(client, admin)
+
+    def check():
+        for category_id in (first, second):
+            assert stored(category_id) == recomputed(category_id), category_id
+
+    def create(price, stock=5, active=True, category_id=first):
+        response = client.post(f"/products/{category_id}", headers=admin, data={
+            "name": "Stats item", "price": str(price), "stock_quantity": str(stock), "is_active": str(active).lower(),
+        })
+        response.raise_for_status()
+        check()
+        return response.json()["product_id"]
+
+    def update(product_id, **fields):
+        client.put(f"/products/update/{product_id}", headers=admin, data={k: str(v) for k, v in fields.items()}).raise_for_status()
+        check()
+
+    cheap, mid, dear = create(5), create(10, stock=2), create(30)
+    hidden = create(100, active=False)
+
+    update(mid, price=1)  # new minimum
+    update(cheap, price=50)  # new maximum
+    update(cheap, price=20)  # maximum moves back down
+    update(mid, is_active="false")  # the minimum leaves
+    update(hidden, is_active="true")  # a new maximum arrives
+    update(dear, category_id=second)  # moves between categories
+    update(dear, stock_quantity=0)
+
+    client.delete(f"/products/{hidden}", headers=admin).raise_for_status()
+    check()
+
+    # Selling out and restocking through the cart
+    update(mid, is_active="true")
+    client.post("/cart/add", headers=shopper, json={"product_id": mid, "quantity": 2}).raise_for_status()
+    check()
+    client.delete(f"/cart/clear/{shopper_id}", headers=shopper).raise_for_status()
+    check()
+
+    rows = f"Imported,Bulk,0.5,3,true,{first}\nImported,Bulk,75,0,true,{second}\nImported,Bulk,2,3,false,{first}\n"
+    client.post(
+        "/products/import", headers=admin,
+        files={"file": ("products.csv", (CSV_HEADER + rows).encode(), "text/csv")},
+    ).raise_for_status()
+    check()
+
+
+def test_cart_changes_do_not_rescan_the_category(client, new_user, new_products, count_queries):
+    counts = {}
+    for size in (1, 300):
+        product_id = new_products(size, stock=1)[0]
+        headers, user_id = new_user()
+        with count_queries() as statements:
+            # Sells the product out, then puts it back in stock
+            client.post("/cart/add", headers=headers, json={"product_id": product_id, "quantity": 1}).raise_for_status()
+            client.delete(f"/cart/clear/{user_id}", headers=headers).raise_for_status()
+        counts[size] = [s for s in statements if "categorystats" in s or "FROM product" in s]
+    assert len(counts[1]) == len(counts[300])
+    # No aggregate over the category's products
+    assert not any("count(" in statement for statement in counts[300])
+
+
+def test_cart_changes_refresh_cached_category_views(client, new_user, new_products, monkeypatch):
+    import inventory
+    from database import async_session
+
+    product_id, _ = new_products(2, stock=1)
+    shopper, shopper_id = new_user()
+    category_id = client.get(f"/products/details/{product_id}", headers=shopper).json()["category_id"]
+
+    def in_stock():
+        categories = client.get("/categories/", headers=shopper).json()
+        listed = client.get(f"/products/{category_id}", headers=shopper).json()
+        count = next(c["in_stock_count"] for c in categories if c["id"] == category_id)
+        return count, {p["id"]: p["stock_quantity"] for p in listed}[product_id]
+
+    assert in_stock() == (2, 1)  # now cached
+    client.post("/cart/add", headers=shopper, json={"product_id": product_id, "quantity": 1}).raise_for_status()
+    assert in_stock() == (1, 0)
+    client.delete(f"/cart/clear/{shopper_id}", headers=shopper).raise_for_status()
+    assert in_stock() == (2, 1)
+
+    # The sweeper giving back an abandoned cart
+    client.post("/cart/add", headers=shopper, json={"product_id": product_id, "quantity": 1}).raise_for_status()
+    assert in_stock() == (1, 0)
+    monkeypatch.setattr(inventory, "RESERVATION_TTL_MINUTES", -1)
+
+    async def sweep():
+        async with async_session() as session:
+            return await inventory.release_expired_reservations(session)
+
+    assert client.portal.call(sweep) >= 1
+    assert in_stock() == (2, 1)
@@ -0,0 +1,32 @@
+import threading
+from concurrent.futures import Future
+
+from derivatives import DerivativeQueue
+
+
+def finished(error=None):
+    future = Future()
+    if error:
+        future.set_exception(error)
+    else:
+        future.set_result([])
+    return future
+
+
+def test_jobs_finishing_on_other_threads_are_all_counted():
+    queue = DerivativeQueue()
+    paths = [f"static/images/{i}.png" for i in range(400)]
+    queue.pending.update(paths)
+
+    def finish(chunk):
+        for number, path in chunk:
+            queue._done(path, finished(ValueError("broken") if number % 4 == 0 else None))
+
+    jobs = list(enumerate(paths))
+    threads = [threading.Thread(target=finish, args=(jobs[start::8],)) for start in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert queue.stats() == {"workers": queue.workers, "pending": 0, "completed": 300, "failed": 100}
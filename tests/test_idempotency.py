@@ -0,0 +1,69 @@
+from uuid import uuid4
+
+from test_cart_concurrency import send_all, stock_of
+
+
+def add(client, headers, product_id, key, quantity=1):
+    return client.post("/cart/add", headers={**headers, "Idempotency-Key": key},
+                       json={"product_id": product_id, "quantity": quantity})
+
+
+def test_a_retry_replays_the_first_response(client, new_user, new_products):
+    [product_id] = new_products(1, stock=10)
+    shopper, _ = new_user()
+    key = uuid4().hex
+
+    first = add(client, shopper, product_id, key)
+    retry = add(client, shopper, product_id, key)
+    assert first.status_code == retry.status_code == 200
+    assert retry.json() == first.json()
+    assert "idempotent-replayed" not in first.headers
+    assert retry.headers["idempotent-replayed"] == "true"
+    assert stock_of(client, shopper, product_id) == 9
+
+    # A new key is a new request
+    assert "idempotent-replayed" not in add(client, shopper, product_id, uuid4().hex).headers
+    assert stock_of(client, shopper, product_id) == 8
+
+
+def test_a_key_reused_for_a_different_body_is_rejected(client, new_user, new_products):
+    [product_id] = new_products(1, stock=10)
+    shopper, _ = new_user()
+    key = uuid4().hex
+
+    assert add(client, shopper, product_id, key).status_code == 200
+    assert add(client, shopper, product_id, key, quantity=2).status_code == 422
+    assert stock_of(client, shopper, product_id) == 9
+
+
+def test_a_failed_request_can_be_retried_with_its_key(client, new_user, new_products):
+    [product_id] = new_products(1, stock=1)
+    holder, _ = new_user()
+    shopper, _ = new_user()
+    key = uuid4().hex
+
+    add(client, holder, product_id, uuid4().hex).raise_for_status()
+    assert add(client, shopper, product_id, key).status_code == 400
+
+    # The stock comes back; the same request now runs for real
+    [item] = client.get("/cart/items/", headers=holder).json()
+    client.delete(f"/cart/remove/{item['cart_item_id']}", headers=holder).raise_for_status()
+    retry = add(client, shopper, product_id, key)
+    assert retry.status_code == 200
+    assert "idempotent-replayed" not in retry.headers
+    assert stock_of(client, shopper, product_id) == 0
+
+
+def test_a_concurrent_duplicate_waits_and_replays(client, new_user, new_products):
+    [product_id] = new_products(1, stock=10)
+    shopper, _ = new_user()
+    request = ("POST", "/cart/add", {
+        "headers": {**shopper, "Idempotency-Key": uuid4().hex},
+        "json": {"product_id": product_id, "quantity": 1},
+    })
+
+    responses = send_all(client, [request, request])
+    assert [r.status_code for r in responses] == [200, 200]
+    assert responses[0].json() == responses[1].json()
+    assert sorted(r.headers.get("idempotent-replayed", "") for r in responses) == ["", "true"]
+    assert stock_of(client, shopper, product_id) == 9
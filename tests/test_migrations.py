@@ -0,0 +1,98 @@
+import shutil
+import sqlite3
+
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.exc import IntegrityError
+from sqlmodel import SQLModel
+
+import migrations
+from conftest import ROOT
+
+
+def migrate(path):
+    engine = create_engine(f"sqlite:///{path}")
+    try:
+        with engine.connect() as connection:
+            applied = migrations.upgrade(connection)
+            version = migrations.current_version(connection)
+    finally:
+        engine.dispose()
+    return applied, version
+
+
+def index_names(path):
+    with sqlite3.connect(path) as connection:
+        return {name for (name,) in connection.execute("SELECT name FROM sqlite_master WHERE type = 'index'")}
+
+
+def test_shipped_database_migrates_to_latest(tmp_path):
+    path = tmp_path / "database.db"
+    shutil.copy(ROOT / "database.db", path)
+
+    applied, version = migrate(path)
+    assert applied == [m.version for m in migrations.MIGRATIONS]
+    assert version == migrations.latest_version()
+
+    declared = {index.name for table in SQLModel.metadata.sorted_tables for index in table.indexes}
+    assert declared <= index_names(path)
+    with sqlite3.connect(path) as connection:
+        assert connection.execute("SELECT count(*) FROM product").fetchone()[0] == 145
+        assert connection.execute("SELECT count(*) FROM product_fts").fetchone()[0] == 145
+
+    # Nothing left to do the second time
+    assert migrate(path) == ([], migrations.latest_version())
+
+
+def test_new_database_gets_the_search_index(tmp_path):
+    path = tmp_path / "new.db"
+    assert migrate(path) == ([m.version for m in migrations.MIGRATIONS], migrations.latest_version())
+    with sqlite3.connect(path) as connection:
+        assert connection.execute("SELECT name FROM sqlite_master WHERE name = 'product_fts'").fetchone()
+
+
+def test_duplicate_open_cart_rows_are_merged(tmp_path):
+    path = tmp_path / "database.db"
+    shutil.copy(ROOT / "database.db", path)
+    with sqlite3.connect(path) as connection:
+        user_id, product_id = connection.execute("SELECT user_id, product_id FROM cartitem").fetchone()
+        # Two more open rows and an ordered one for the same user and product
+        connection.executemany(
+            "INSERT INTO cartitem (user_id, product_id, quantity, added_at, in_order) VALUES (?, ?, ?, '2024-01-01', ?)",
+            [(user_id, product_id, 2, 0), (user_id, product_id, 3, 0), (user_id, product_id, 7, 1)],
+        )
+        before = connection.execute(
+            "SELECT sum(quantity) FROM cartitem WHERE in_order = 0 AND user_id = ? AND product_id = ?",
+            (user_id, product_id),
+        ).fetchone()[0]
+
+    assert migrate(path)[1] == migrations.latest_version()
+    with sqlite3.connect(path) as connection:
+        rows = connection.execute(
+            "SELECT in_order, quantity FROM cartitem WHERE user_id = ? AND product_id = ? ORDER BY in_order",
+            (user_id, product_id),
+        ).fetchall()
+    assert rows == [(0, before), (1, 7)]
+    assert "uq_cartitem_user_product_open" in index_names(path)
+
+
+def test_failing_migration_is_not_recorded(tmp_path, monkeypatch):
+    path = tmp_path / "database.db"
+    shutil.copy(ROOT / "database.db", path)
+    migrate(path)
+
+    def broken(connection):
+        connection.exec_driver_sql("INSERT INTO user (id, username, email, password, is_admin, created_at, last_login_at) "
+                                   "SELECT id, username, email, password, is_admin, created_at, last_login_at FROM user")
+
+    latest = migrations.latest_version()
+    monkeypatch.setattr(migrations, "MIGRATIONS", [
+        *migrations.MIGRATIONS, migrations.Migration(latest + 1, "Broken", broken),
+    ])
+    with pytest.raises(IntegrityError):
+        migrate(path)
+
+    engine = create_engine(f"sqlite:///{path}")
+    with engine.connect() as connection:
+        assert migrations.current_version(connection) == latest
+    engine.dispose()
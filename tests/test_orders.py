@@ -0,0 +1,28 @@
+def test_checkout_query_count_does_not_grow_with_items(client, new_user, new_products, count_queries):
+    product_ids = new_products(111)
+    counts = {}
+    start = 0
+    for size in (1, 10, 100):
+        headers, _ = new_user()
+        items = product_ids[start:start + size]
+        start += size
+        for product_id in items:
+            client.post("/cart/add", headers=headers, json={"product_id": product_id, "quantity": 1}).raise_for_status()
+
+        with count_queries() as statements:
+            response = client.post("/orders/create", headers=headers, json={
+                "items": [{"product_id": product_id, "quantity": 1} for product_id in items],
+                "address": "1 Test Street",
+                "is_paid": True,
+            })
+        assert response.status_code == 200
+        counts[size] = len(statements)
+
+        # Orders come back in the order of the request, each for its product
+        created = response.json()["orders"]
+        assert len(created) == size
+        page = client.get("/orders/all", headers=headers, params={"include_products": "true", "limit": 200}).json()
+        by_id = {order["id"]: order for order in page["items"]}
+        assert [by_id[o["order_id"]]["product"]["product_id"] for o in created] == items
+
+    assert counts[1] == counts[10] == counts[100], counts
@@ -0,0 +1,161 @@
+import asyncio
+from datetime import datetime, timedelta
+from uuid import uuid4
+
+import pytest
+from sqlmodel import select, update
+
+
+@pytest.fixture
+def topic(monkeypatch):
+    """A topic of this test's own, so events other tests leave due are not counted."""
+    import outbox
+
+    name = f"test.{uuid4().hex[:8]}"
+    calls = {}
+    failures = {}
+
+    async def handle(session, event):
+        calls[event.idempotency_key] = calls.get(event.idempotency_key, 0) + 1
+        if failures.get(event.idempotency_key, 0) >= calls[event.idempotency_key]:
+            raise RuntimeError("downstream unavailable")
+
+    monkeypatch.setitem(outbox.HANDLERS, name, handle)
+    return name, calls, failures
+
+
+def enqueue(client, topic, keys):
+    import outbox
+    from database import async_session
+
+    async def add():
+        async with async_session() as session:
+            await outbox.enqueue(session, topic, [(key, {"n": n}) for n, key in enumerate(keys)])
+            await session.commit()
+    client.portal.call(add)
+
+
+def events(client, topic):
+    from database import async_session
+    from models import OutboxEvent
+
+    async def load():
+        async with async_session() as session:
+            return (await session.exec(
+                select(OutboxEvent).where(OutboxEvent.topic == topic).order_by(OutboxEvent.id)
+            )).all()
+    return client.portal.call(load)
+
+
+def make_due(client, topic):
+    """Skip past a lease or backoff."""
+    from database import async_session
+    from models import OutboxEvent
+
+    async def rewind():
+        async with async_session() as session:
+            await session.exec(
+                update(OutboxEvent).where(OutboxEvent.topic == topic).values(available_at=datetime.now())
+            )
+            await session.commit()
+    client.portal.call(rewind)
+
+
+def drain(client):
+    import outbox
+    from database import async_session
+
+    return client.portal.call(lambda: outbox.drain(async_session, once=True))
+
+
+def test_failed_events_back_off_then_succeed(client, topic, monkeypatch):
+    import outbox
+
+    name, calls, failures = topic
+    keys = [f"{name}-{n}" for n in range(3)]
+    failures[keys[0]] = failures[keys[1]] = 1
+    monkeypatch.setattr(outbox, "OUTBOX_RETRY_BASE_SECONDS", 60)
+    enqueue(client, name, keys)
+
+    before = datetime.now()
+    drain(client)
+    first, second, third = events(client, name)
+    assert third.status == "done" and third.attempts == 1 and third.processed_at
+    for event in (first, second):
+        assert (event.status, event.attempts) == ("pending", 1)
+        assert "downstream unavailable" in event.last_error
+        assert before + timedelta(seconds=59) < event.available_at < datetime.now() + timedelta(seconds=61)
+
+    # Not due yet: another pass leaves them alone
+    drain(client)
+    assert calls == {keys[0]: 1, keys[1]: 1, keys[2]: 1}
+
+    make_due(client, name)
+    drain(client)
+    assert [(e.status, e.attempts, e.last_error) for e in events(client, name)] == [
+        ("done", 2, None), ("done", 2, None), ("done", 1, None),
+    ]
+    assert calls == {keys[0]: 2, keys[1]: 2, keys[2]: 1}
+
+
+def test_backoff_doubles_and_gives_up_after_max_attempts(client, topic, monkeypatch):
+    import outbox
+
+    name, calls, failures = topic
+    key = f"{name}-0"
+    failures[key] = 99
+    monkeypatch.setattr(outbox, "OUTBOX_RETRY_BASE_SECONDS", 60)
+    monkeypatch.setattr(outbox, "OUTBOX_MAX_ATTEMPTS", 3)
+    enqueue(client, name, [key])
+
+    for attempt, delay in [(1, 60), (2, 120)]:
+        make_due(client, name)
+        before = datetime.now()
+        drain(client)
+        (event,) = events(client, name)
+        assert (event.status, event.attempts) == ("pending", attempt)
+        assert before + timedelta(seconds=delay - 1) < event.available_at < datetime.now() + timedelta(seconds=delay + 1)
+
+    make_due(client, name)
+    drain(client)
+    (event,) = events(client, name)
+    assert (event.status, event.attempts) == ("failed", 3)
+    make_due(client, name)
+    drain(client)
+    assert calls[key] == 3
+
+
+def test_events_without_a_handler_fail_at_once(client):
+    name = f"test.{uuid4().hex[:8]}"
+    enqueue(client, name, [f"{name}-0"])
+    drain(client)
+    (event,) = events(client, name)
+    assert (event.status, event.attempts) == ("failed", 1)
+    assert "no handler" in event.last_error
+
+
+def test_claims_are_exclusive_and_leased(client, topic):
+    import outbox
+    from database import async_session
+
+    name, calls, _ = topic
+    drain(client)  # whatever other tests left due
+    enqueue(client, name, [f"{name}-{n}" for n in range(10)])
+
+    async def claim():
+        async with async_session() as session:
+            return [event.id for event in await outbox.claim(session) if event.topic == name]
+
+    async def claim_twice():
+        return await asyncio.gather(claim(), claim())
+
+    first, second = client.portal.call(claim_twice)
+    assert len(first) + len(second) == 10
+    assert not set(first) & set(second)
+
+    # The claimer died: nothing is due again until its lease runs out
+    assert client.portal.call(claim) == []
+    make_due(client, name)
+    assert sorted(client.portal.call(claim)) == sorted(first + second)
+    assert {event.attempts for event in events(client, name)} == {2}
+    assert calls == {}
@@ -0,0 +1,93 @@
+from uuid import uuid4
+
+import pytest
+
+from conftest import CSV_HEADER
+from pagination import encode_cursor
+
+
+@pytest.fixture
+def catalog(client, new_user):
+    """
+    A category of 12 products named `word` with four prices, three each, all
+    imported at once: every sort key has ties. Returns (headers, category id,
+    word, products by id).
+    """
+    headers, _ = new_user(is_admin=True)
+    category_id = client.post("/categories/", headers=headers, json={"name": f"Ties {uuid4().hex[:8]}"}).json()["id"]
+    word = f"tie{uuid4().hex[:8]}"
+    rows = "".join(f"{word},same,{1 + i % 4},5,true,{category_id}\n" for i in range(12))
+    client.post("/products/import", headers=headers, files={
+        "file": ("products.csv", (CSV_HEADER + rows).encode(), "text/csv"),
+    }).raise_for_status()
+    products = {p["id"]: p for p in client.get(f"/products/{category_id}", headers=headers).json()}
+    assert len(products) == 12
+    return headers, category_id, word, products
+
+
+def walk(client, url, headers, params, limit=5):
+    """Follow next_cursor to the end; returns the items' ids in order."""
+    ids, cursor = [], None
+    while True:
+        response = client.get(url, headers=headers, params={**params, "limit": limit, "cursor": cursor})
+        response.raise_for_status()
+        page = response.json()
+        assert len(page["items"]) <= limit
+        ids += [item["id"] for item in page["items"]]
+        cursor = page["next_cursor"]
+        if cursor is None:
+            return ids
+
+
+@pytest.mark.parametrize("sort", ["id", "-id", "price", "-price", "name", "-name", "created_at", "-created_at"])
+def test_list_pages_cover_every_row_once_despite_ties(client, catalog, sort):
+    headers, category_id, _, products = catalog
+    field, descending = sort.lstrip("-"), sort.startswith("-")
+    expected = sorted(products, key=lambda pid: (products[pid][field], pid), reverse=descending)
+    assert walk(client, "/products/list", headers, {"category_id": category_id, "sort": sort}) == expected
+
+
+def test_search_pages_cover_every_hit_once_despite_ties(client, catalog):
+    headers, _, word, products = catalog
+    # Identical text ranks identically; ties go by id
+    assert walk(client, "/products/search", headers, {"q": word}, limit=5) == sorted(products)
+
+
+def test_order_pages_cover_every_order_once(client, new_user, new_products):
+    headers, _ = new_user()
+    product_ids = new_products(7)
+    for product_id in product_ids:
+        client.post("/cart/add", headers=headers, json={"product_id": product_id, "quantity": 1}).raise_for_status()
+    # One checkout, so the orders share their order_date
+    client.post("/orders/create", headers=headers, json={
+        "items": [{"product_id": product_id, "quantity": 1} for product_id in product_ids],
+        "address": "1 Test Street",
+    }).raise_for_status()
+
+    ids = walk(client, "/orders/all", headers, {}, limit=3)
+    assert len(ids) == 7
+    assert ids == sorted(ids, reverse=True)
+
+
+@pytest.mark.parametrize("url, params, valid", [
+    ("/products/list", {}, [1]),
+    ("/products/list", {"sort": "-price"}, [1.5, 1]),
+    ("/products/list", {"sort": "created_at"}, [{"dt": "2024-01-01T00:00:00"}, 1]),
+    ("/products/search", {"q": "item"}, [-1.5, 1]),
+    ("/orders/all", {}, [{"dt": "2024-01-01T00:00:00"}, 1]),
+])
+def test_malformed_and_mistyped_cursors_are_rejected(client, new_user, url, params, valid):
+    headers, _ = new_user()
+    assert client.get(url, headers=headers, params={**params, "cursor": encode_cursor(valid)}).status_code == 200
+
+    bad = [
+        "not a cursor",
+        encode_cursor(valid + [1]),
+        encode_cursor(["1"] * len(valid)),
+        encode_cursor([True] * len(valid)),
+        encode_cursor([None] * len(valid)),
+        encode_cursor([{"dt": "yesterday"}] * len(valid)),
+    ]
+    for cursor in bad:
+        response = client.get(url, headers=headers, params={**params, "cursor": cursor})
+        assert response.status_code == 400, (cursor, response.text)
@@ -0,0 +1,22 @@
+from uuid import uuid4
+
+from conftest import CSV_HEADER
+
+
+def test_import_query_count_does_not_grow_with_rows(client, new_user, count_queries):
+    headers, _ = new_user(is_admin=True)
+    counts = {}
+    for size in (10, 500):
+        category_id = client.post("/categories/", headers=headers, json={"name": f"Import {uuid4().hex[:8]}"}).json()["id"]
+        rows = "".join(f"Item {i},Imported,{i + 1},5,true,{category_id}\n" for i in range(size))
+        with count_queries() as statements:
+            response = client.post(
+                "/products/import", headers=headers,
+                files={"file": ("products.csv", (CSV_HEADER + rows).encode(), "text/csv")},
+            )
+        assert response.status_code == 200
+        assert response.json()["imported"] == size
+        counts[size] = len(statements)
+        assert len(client.get(f"/products/{category_id}", headers=headers).json()) == size
+
+    assert counts[10] == counts[500], counts
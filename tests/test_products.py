@@ -0,0 +1,95 @@
+import io
+from pathlib import Path
+
+from PIL import Image
+
+
+def png(color="red"):
+    buffer = io.BytesIO()
+    Image.new("RGB", (8, 8), color).save(buffer, "PNG")
+    return buffer.getvalue()
+
+
+def test_listing_products_does_not_stat_variant_files(client, new_user, new_products, monkeypatch):
+    admin, _ = new_user(is_admin=True)
+    product_id = new_products(1)[0]
+    category_id = client.get(f"/products/details/{product_id}", headers=admin).json()["category_id"]
+    for i in range(5):
+        client.post(f"/products/{category_id}", headers=admin, data={
+            "name": f"Pictured {i}", "price": "1", "stock_quantity": "1",
+        }, files={"file": ("photo.png", png(), "image/png")}).raise_for_status()
+
+    stats = []
+    exists = Path.exists
+    monkeypatch.setattr(Path, "exists", lambda self, *args, **kwargs: stats.append(self) or exists(self, *args, **kwargs))
+    page = client.get("/products/list", headers=admin, params={"category_id": category_id}).json()
+    assert stats == []
+
+    pictured = [product for product in page["items"] if product["image_path"]]
+    assert len(pictured) == 5
+    for product in pictured:
+        stem = Path(product["image_path"]).stem
+        assert set(product["image_variants"]) == {"thumb", "medium", "webp"}
+        assert Path(product["image_variants"]["thumb"]).name == f"{stem}_thumb.jpg"
+
+
+def test_missing_variants_redirect_to_the_original(client):
+    # Stored, but its variants never generated
+    blob = Path("static/images/blobs/00") / f"{'0' * 64}.png"
+    blob.parent.mkdir(parents=True, exist_ok=True)
+    blob.write_bytes(png())
+
+    thumb = Path("static/images/variants/blobs/00") / f"{'0' * 64}_thumb.jpg"
+    response = client.get(f"/{thumb}", follow_redirects=False)
+    assert response.status_code == 307
+    assert response.headers["location"] == f"/{blob}"
+    assert response.headers["cache-control"] == "no-cache"
+    assert client.get(f"/{thumb}").content == png()
+
+    assert client.get("/static/images/variants/blobs/00/nothing_thumb.jpg").status_code == 404
+
+
+def test_non_image_uploads_are_rejected(client, new_user, new_products):
+    admin, _ = new_user(is_admin=True)
+    category_id = client.get(f"/products/details/{new_products(1)[0]}", headers=admin).json()["category_id"]
+    response = client.post(f"/products/{category_id}", headers=admin, data={
+        "name": "Manual", "price": "1", "stock_quantity": "1",
+    }, files={"file": ("manual.pdf", b"%PDF-1.4 not an image", "application/pdf")})
+    assert response.status_code == 415
+    assert not list(Path("static/images/blobs").rglob(".upload-*"))
+
+
+def test_upload_keeps_a_blob_released_before_it_commits(client, new_user, monkeypatch):
+    import routes.products
+    from blobstore import release_images
+    from database import async_session
+    from models import Product
+
+    admin, _ = new_user(is_admin=True)
+    category_id = client.post("/categories/", headers=admin, json={"name": "Racing"}).json()["id"]
+
+    def create(name):
+        response = client.post(f"/products/{category_id}", headers=admin, data={
+            "name": name, "price": "1", "stock_quantity": "1",
+        }, files={"file": ("photo.png", png("teal"), "image/png")})
+        response.raise_for_status()
+        return response.json()
+
+    first = create("First")
+    store_upload = routes.products.store_upload
+
+    async def store_then_release(file):
+        # The upload finds the blob, then its last other reference goes away
+        stored = await store_upload(file)
+        async with async_session() as session:
+            product = await session.get(Product, first["product_id"])
+            product.image_path = None
+            await session.commit()
+            await release_images(session, first["image_path"])
+        return stored
+
+    monkeypatch.setattr(routes.products, "store_upload", store_then_release)
+    second = create("Second")
+    assert second["image_path"] == first["image_path"]
+    assert Path(second["image_path"]).read_bytes() == png("teal")
+    assert not [p for p in Path("static/images/blobs").rglob(".*") if p.is_file()]
@@ -0,0 +1,27 @@
+import os
+import subprocess
+import sys
+
+from benchmarks import query_plans
+from conftest import ROOT, WORKDIR
+
+
+def test_no_route_scans_or_sorts_a_whole_table():
+    # Its own process: the check seeds and binds the app to a database of its own
+    result = subprocess.run(
+        [sys.executable, "-m", "benchmarks.query_plans"],
+        cwd=ROOT, env={**os.environ, "LOG_LEVEL": "WARNING"}, capture_output=True, text=True, timeout=600,
+    )
+    assert result.returncode == 0, result.stdout + result.stderr
+
+
+def test_unindexed_scans_and_sorts_are_reported(client):
+    statements = {
+        ("GET /x", "SELECT id FROM product WHERE description = ?"): ("x",),
+        ("GET /x", "SELECT id FROM product WHERE category_id = ? ORDER BY description LIMIT 5"): (1,),
+        ("GET /x", "SELECT id FROM product WHERE category_id = ? ORDER BY price, id LIMIT 5"): (1,),
+    }
+    assert set(query_plans.check(WORKDIR / "test.db", statements, verbose=False)) == {
+        "GET /x: full scan of product",
+        "GET /x: temp B-tree sort (description)",
+    }
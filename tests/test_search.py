@@ -0,0 +1,27 @@
+import asyncio
+
+import pytest
+
+import search
+from database import build_engine
+
+
+def test_memory_index_refuses_several_workers(tmp_path, monkeypatch):
+    monkeypatch.setattr(search, "SEARCH_BACKEND", "memory")
+    monkeypatch.setattr(search, "WEB_CONCURRENCY", 4)
+    engine = build_engine(f"sqlite:///{tmp_path / 'search.db'}")
+
+    async def setup():
+        try:
+            await search.SearchIndex().setup(engine)
+        finally:
+            await engine.dispose()
+
+    with pytest.raises(RuntimeError, match="4 workers"):
+        asyncio.run(setup())
+
+
+def test_search_uses_the_migrated_fts_table(client, new_user):
+    headers, _ = new_user()
+    assert search.search_index.backend == "fts5"
+    client.get("/products/search", headers=headers, params={"q": "item"}).raise_for_status()
@@ -0,0 +1,110 @@
+import hashlib
+import logging
+import os
+import tempfile
+from pathlib import Path
+from typing import NamedTuple, Optional
+
+from dotenv import load_dotenv
+from fastapi import HTTPException, UploadFile
+from fastapi.concurrency import run_in_threadpool
+
+load_dotenv()
+
+UPLOAD_DIR = Path("static/images")
+MAX_UPLOAD_BYTES = int(os.getenv("MAX_UPLOAD_BYTES", str(10 * 1024 * 1024)))
+UPLOAD_CHUNK_SIZE = int(os.getenv("UPLOAD_CHUNK_SIZE", str(1024 * 1024)))
+
+logger = logging.getLogger(__name__)
+
+
+class StoredFile(NamedTuple):
+    path: Path
+    size: int
+    sha256: str
+    # The upload's own link to the file, kept until the row using it commits
+    hold: Optional[str] = None
+
+
+def safe_filename(filename: str) -> str:
+    """Drop any directory part a client put in the upload's filename."""
+    name = Path(filename or "").name.replace(" ", "_")
+    return name or "upload"
+
+
+def _too_large() -> HTTPException:
+    return HTTPException(
+        status_code=413,
+        detail=f"File too large. Maximum upload size is {MAX_UPLOAD_BYTES} bytes.",
+    )
+
+
+def _write_chunk(out, digest, chunk: bytes):
+    digest.update(chunk)
+    out.write(chunk)
+
+
+def _finish_file(out):
+    out.flush()
+    os.fsync(out.fileno())
+    out.close()
+
+
+def _discard_file(tmp_path: str):
+    try:
+        os.unlink(tmp_path)
+    except FileNotFoundError:
+        pass
+
+
+class PendingFile(NamedTuple):
+    """A fully written, hashed upload still sitting at its temporary path."""
+    tmp_path: str
+    size: int
+    sha256: str
+
+
+async def stream_to_temp(
+    file: UploadFile, tmp_dir: Path, max_bytes: int = MAX_UPLOAD_BYTES
+) -> PendingFile:
+    """
+    Stream an upload into a temporary file in `tmp_dir`.
+
+    The body is copied chunk by chunk, with writes and hashing done in the
+    threadpool so the event loop is never blocked on disk. Uploads over
+    `max_bytes` are rejected with 413 and leave nothing behind. The caller
+    renames the result into place (same filesystem, so atomically) or
+    discards it.
+    """
+    if file.size is not None and file.size > max_bytes:
+        raise _too_large()
+
+    await run_in_threadpool(tmp_dir.mkdir, parents=True, exist_ok=True)
+    fd, tmp_path = await run_in_threadpool(
+        tempfile.mkstemp, dir=tmp_dir, prefix=".upload-", suffix=".part"
+    )
+    out = os.fdopen(fd, "wb")
+    digest = hashlib.sha256()
+    size = 0
+    try:
+        while chunk := await file.read(UPLOAD_CHUNK_SIZE):
+            size += len(chunk)
+            if size > max_bytes:
+                raise _too_large()
+            await run_in_threadpool(_write_chunk, out, digest, chunk)
+        await run_in_threadpool(_finish_file, out)
+    except BaseException:
+        out.close()
+        await run_in_threadpool(_discard_file, tmp_path)
+        raise
+
+    return PendingFile(tmp_path, size, digest.hexdigest())
+
+
+def remove_file(path: str):
+    old_path = Path(path)
+    if old_path.exists():
+        try:
+            old_path.unlink()
+        except Exception as e:
+            logger.warning("Failed to delete old image %s: %s", path, e)